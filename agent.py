@@ -1,102 +1,302 @@
 import os
+import sys
+import time
+import queue
 import logging
 import json
+import argparse
+from collections import defaultdict, Counter
 from datetime import datetime
+import threading
+import contextvars
+from typing import Dict, List, Optional, Tuple
 import google.generativeai as genai
+from creative_generator import configure_genai
+from resilience import call_with_resilience, GEMINI_TEXT_TIMEOUT
+from telemetry import span
+from scheduler import get_scheduler, scheduling
 
-try:
-    TEXT_MODEL = genai.GenerativeModel(model_name='gemini-2.5-flash-lite')
-except Exception as e:
-    logging.error(f"Could not initialize Gemini text model for Agent: {e}")
-    TEXT_MODEL = None
-
+TEXT_MODEL_NAME = 'gemini-2.5-flash-lite'
 LOGS_DIR = "logs"
 ALERTS_DIR = "alerts"
+# Append-only history of campaign runs, one JSON record per line.
+RUNS_LOG_PATH = os.getenv("RUNS_LOG_PATH", os.path.join(LOGS_DIR, "runs.jsonl"))
+# Flagged runs are collected and sent as one alert digest at most this often.
+ALERT_DIGEST_INTERVAL = int(os.getenv("ALERT_DIGEST_INTERVAL", "300"))
 
-def _generate_and_save_alert(brief, expected_count, actual_count):
-    """
-    Uses the Gemini AI to translate campaign failure data into a human-readable
-    email and saves it locally.
-    """
-    if not TEXT_MODEL:
-        logging.error("Cannot generate AI alert because the text model failed to initialize.")
-        return
+_text_model = None
+_text_model_lock = threading.Lock()
 
-    logging.warning("Issue detected. Triggering AI Alerter...")
-    os.makedirs(ALERTS_DIR, exist_ok=True)
+def _get_text_model():
+    """Creates the Gemini text model on first use; returns None if it cannot be initialized."""
+    global _text_model
+    if _text_model is None:
+        with _text_model_lock:
+            if _text_model is None:
+                try:
+                    configure_genai()
+                    _text_model = genai.GenerativeModel(model_name=TEXT_MODEL_NAME)
+                except Exception as e:
+                    logging.error(f"Could not initialize Gemini text model for Agent: {e}")
+    return _text_model
 
-    context = {
+def build_run_record(brief, variants: List[Dict], campaign_folder: Optional[str], duration_s: float) -> Dict:
+    """
+    The structured record of one campaign run: totals plus each variant's
+    status, latency and failure reason. 'variants' are pipeline variant summaries.
+    """
+    generated = sum(1 for variant in variants if variant["url"])
+    return {
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
         "campaign_name": brief.campaign_name,
-        "status": "FLAGGED_INSUFFICIENT_ASSETS",
-        "severity": "Warning",
-        "details": {
-            "expected_variant_count": expected_count,
-            "generated_variant_count": actual_count,
-            "message": brief.message,
-            "products": list(brief.products.keys())
-        },
-        "suggested_action": f"Review the campaign log at '{LOGS_DIR}/{brief.campaign_name.replace(' ', '_')}.log' for potential errors."
+        "campaign_folder": campaign_folder,
+        "status": "SUCCESS" if variants and generated >= len(variants) else "FLAGGED_INSUFFICIENT_ASSETS",
+        "expected_variants": len(variants),
+        "generated_variants": generated,
+        "duration_s": round(duration_s, 3),
+        "message": brief.message,
+        "products": list(brief.products.keys()),
+        "variants": [
+            {
+                "product": variant["product"],
+                "aspect_ratio": variant["aspect_ratio"],
+                "locale": variant.get("locale"),
+                "mode": variant.get("mode"),
+                "status": "ok" if variant["url"] else "failed",
+                "duration_s": variant["duration_s"],
+                "cache_hit": variant["cache_hit"],
+                "error": variant["error"],
+                "url": variant["url"],
+            }
+            for variant in variants
+        ],
     }
 
+def _template_digest(records: List[Dict]) -> str:
+    lines = [
+        f"Subject: {len(records)} campaign run(s) flagged for insufficient assets",
+        "",
+        "Hi Team,",
+        "",
+        "The following campaign runs produced fewer creatives than expected:",
+        "",
+    ]
+    for record in records:
+        lines.append(f"- {record['campaign_name']} ({record['timestamp']} UTC): "
+                     f"{record['generated_variants']}/{record['expected_variants']} creatives generated.")
+        reasons = Counter(variant["error"] for variant in record["variants"] if variant["error"])
+        for reason, count in reasons.most_common(3):
+            lines.append(f"    {count}x {reason}")
+        if record["campaign_folder"]:
+            lines.append(f"    Fill in the missing creatives: POST /campaigns/{record['campaign_folder'].strip('/')}/resume")
+    lines += ["", f"Full run records are in '{RUNS_LOG_PATH}'; run 'python agent.py stats' for failure rates."]
+    return "\n".join(lines) + "\n"
+
+def _write_alert_digest(records: List[Dict]):
+    """
+    Writes one alert covering every flagged run since the last digest. The text
+    model words it if it answers within GEMINI_TEXT_TIMEOUT; otherwise a plain
+    template is used, so a slow model never holds alerts back.
+    """
+    logging.warning(f"{len(records)} flagged campaign run(s). Writing alert digest...")
+    os.makedirs(ALERTS_DIR, exist_ok=True)
+    context = [
+        {
+            "campaign_name": record["campaign_name"],
+            "status": record["status"],
+            "severity": "Warning",
+            "timestamp_utc": record["timestamp"],
+            "expected_variant_count": record["expected_variants"],
+            "generated_variant_count": record["generated_variants"],
+            "message": record["message"],
+            "products": record["products"],
+            "failure_reasons": sorted({variant["error"] for variant in record["variants"] if variant["error"]}),
+            "resume_endpoint": f"POST /campaigns/{record['campaign_folder'].strip('/')}/resume" if record["campaign_folder"] else None,
+        }
+        for record in records
+    ]
     prompt = (
         "You are a production assistant AI for a busy marketing team. "
-        "Based on the following structured JSON data report, write a simple, clear, and human-readable email alert. "
+        "Based on the following structured JSON data report of flagged campaign runs, write a simple, clear, and human-readable email alert "
+        "that covers all of them. "
         "The email should be suitable for saving as a text file. Do not include the JSON in your response. "
-        "Start the email with a clear subject line.\n\n"
+        "Start the email with a clear subject line. "
+        f"Mention that full run records are in '{RUNS_LOG_PATH}', and that each campaign's resume_endpoint "
+        "regenerates only its missing creatives without paying again for the ones that succeeded.\n\n"
         f"JSON REPORT:\n{json.dumps(context, indent=2)}"
     )
 
-    try:
-        response = TEXT_MODEL.generate_content(prompt)
-        email_content = response.text
-        safe_campaign_name = brief.campaign_name.replace(' ', '_')
-        alert_filepath = os.path.join(ALERTS_DIR, f"ALERT_{safe_campaign_name}.txt")
-        with open(alert_filepath, 'w') as f:
-            f.write(email_content)
-        
-        logging.info(f"Successfully generated and saved alert to: {alert_filepath}")
+    email_content = None
+    text_model = _get_text_model()
+    if text_model:
+        try:
+            # One attempt only, and no long wait for quota: either would delay the alert further.
+            with scheduling(campaign="alert_digest", priority="bulk"):
+                response = call_with_resilience(
+                    "gemini", "gemini_text", get_scheduler("gemini_text").wrap(text_model.generate_content, timeout=GEMINI_TEXT_TIMEOUT),
+                    prompt, request_options={"timeout": GEMINI_TEXT_TIMEOUT}, max_attempts=1,
+                )
+            email_content = response.text
+        except Exception as e:
+            logging.error(f"Failed to generate AI alert, using the template instead: {e}")
+    if not email_content:
+        email_content = _template_digest(records)
 
-    except Exception as e:
-        logging.error(f"Failed to generate AI alert: {e}")
+    alert_filepath = os.path.join(ALERTS_DIR, f"ALERT_DIGEST_{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.txt")
+    with open(alert_filepath, 'w') as f:
+        f.write(email_content)
+    logging.info(f"Successfully saved alert digest to: {alert_filepath}")
 
-
-def run_post_process_checks(brief, generated_urls: list):
+class PostProcessAgent:
     """
-    The main function for the agent. It logs campaign results and triggers
-    alerts if there's a problem.
+    Consumes campaign run records from a queue on a background thread: appends
+    each to the JSONL history and collects flagged runs into a digest that is
+    written every ALERT_DIGEST_INTERVAL seconds (and when the agent stops).
     """
-    os.makedirs(LOGS_DIR, exist_ok=True)
-    
-    # Calculate expected vs. actual creative counts
-    expected_count = len(brief.products) * 3  # 3 aspect ratios per product
-    actual_count = len(generated_urls)
-    
-    # Create a safe filename for the log
-    safe_campaign_name = brief.campaign_name.replace(' ', '_')
-    log_filepath = os.path.join(LOGS_DIR, f"{safe_campaign_name}.log")
-
-    # Prepare the log content
-    log_content = (
-        f"Campaign Generation Log\n"
-        f"-------------------------\n"
-        f"Campaign Name: {brief.campaign_name}\n"
-        f"Timestamp (UTC): {datetime.utcnow().isoformat()}\n"
-        f"Status: {'SUCCESS' if actual_count >= expected_count else 'FLAGGED INSUFFICIENT ASSETS'}\n\n"
-        f"Metrics:\n"
-        f"  - Expected Creatives: {expected_count}\n"
-        f"  - Generated Creatives: {actual_count}\n\n"
-        f"Brief Details:\n{json.dumps(brief.dict(), indent=2)}\n\n"
-        f"Generated File URLs:\n"
-    )
-    for url in generated_urls:
-        log_content += f"  - {url}\n"
-
-    # Write the log file
-    with open(log_filepath, 'w') as f:
-        f.write(log_content)
-    
-    logging.info(f"Campaign results logged to: {log_filepath}")
-
-    # If there's a mismatch, trigger the AI alerter
-    if actual_count < expected_count:
-        _generate_and_save_alert(brief, expected_count, actual_count)
\ No newline at end of file
+
+    def __init__(self, runs_log_path: str = RUNS_LOG_PATH, digest_interval: int = ALERT_DIGEST_INTERVAL):
+        self.runs_log_path = runs_log_path
+        self.digest_interval = digest_interval
+        self._queue: "queue.Queue[Optional[Tuple[contextvars.Context, Dict]]]" = queue.Queue()
+        self._pending_alerts: List[Dict] = []
+        self._thread = threading.Thread(target=self._run, name="agent", daemon=True)
+        self._thread.start()
+
+    def submit(self, record: Dict):
+        # The submitter's context travels with the record, so the agent's work
+        # shows up in the campaign's trace.
+        self._queue.put((contextvars.copy_context(), record))
+
+    def _run(self):
+        next_digest = time.monotonic() + self.digest_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, next_digest - time.monotonic()))
+                if item is None:
+                    self._flush_alerts()
+                    return
+                context, record = item
+                context.run(self._handle, record)
+            except queue.Empty:
+                pass
+            if time.monotonic() >= next_digest:
+                self._flush_alerts()
+                next_digest = time.monotonic() + self.digest_interval
+
+    def _handle(self, record: Dict):
+        with span("agent_check", campaign=record["campaign_name"]):
+            self._log_run(record)
+
+    def _log_run(self, record: Dict):
+        try:
+            os.makedirs(os.path.dirname(self.runs_log_path) or ".", exist_ok=True)
+            with open(self.runs_log_path, 'a') as f:
+                f.write(json.dumps(record) + "\n")
+            logging.info(f"Campaign run for '{record['campaign_name']}' logged to: {self.runs_log_path}")
+        except Exception as e:
+            logging.error(f"Agent failed to log campaign run: {e}")
+        if record["status"] != "SUCCESS":
+            self._pending_alerts.append(record)
+
+    def _flush_alerts(self):
+        if not self._pending_alerts:
+            return
+        records, self._pending_alerts = self._pending_alerts, []
+        try:
+            _write_alert_digest(records)
+        except Exception as e:
+            logging.error(f"Agent failed to write alert digest: {e}")
+
+    def stop(self, timeout: Optional[float] = None):
+        """Processes everything still queued, writes any pending digest and stops the thread."""
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+_agent: Optional[PostProcessAgent] = None
+_agent_lock = threading.Lock()
+
+def submit_run(record: Dict):
+    """Hands a run record to the background agent (started on first use) and returns immediately."""
+    global _agent
+    with _agent_lock:
+        if _agent is None:
+            _agent = PostProcessAgent()
+        _agent.submit(record)
+
+def shutdown_agent(timeout: Optional[float] = 30):
+    global _agent
+    with _agent_lock:
+        agent, _agent = _agent, None
+    if agent:
+        agent.stop(timeout)
+
+def load_run_records(path: str = RUNS_LOG_PATH, since: Optional[str] = None, campaign: Optional[str] = None):
+    """Streams run records from the JSONL history, optionally filtered by start date and campaign name substring."""
+    if not os.path.exists(path):
+        return
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if since and record["timestamp"] < since:
+                continue
+            if campaign and campaign.lower() not in record["campaign_name"].lower():
+                continue
+            yield record
+
+def campaign_stats(records) -> List[Dict]:
+    """Per-campaign run and variant counts, failure rate, average variant latency and top failure reasons."""
+    stats: Dict[str, Dict] = defaultdict(lambda: {"runs": 0, "flagged_runs": 0, "variants": 0, "failed": 0, "latency": 0.0, "reasons": Counter()})
+    for record in records:
+        entry = stats[record["campaign_name"]]
+        entry["runs"] += 1
+        entry["flagged_runs"] += record["status"] != "SUCCESS"
+        for variant in record["variants"]:
+            entry["variants"] += 1
+            entry["latency"] += variant["duration_s"] or 0.0
+            if variant["status"] != "ok":
+                entry["failed"] += 1
+                entry["reasons"][variant["error"] or "unknown"] += 1
+    return [
+        {
+            "campaign_name": name,
+            "runs": entry["runs"],
+            "flagged_runs": entry["flagged_runs"],
+            "variants": entry["variants"],
+            "failed_variants": entry["failed"],
+            "failure_rate": round(entry["failed"] / entry["variants"], 3) if entry["variants"] else 0.0,
+            "avg_variant_latency_s": round(entry["latency"] / entry["variants"], 3) if entry["variants"] else None,
+            "top_failure_reasons": entry["reasons"].most_common(3),
+        }
+        for name, entry in sorted(stats.items(), key=lambda item: item[0].lower())
+    ]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the campaign run history written by the agent.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    stats_parser = subparsers.add_parser("stats", help="Failure rates per campaign.")
+    stats_parser.add_argument("--runs-log", default=RUNS_LOG_PATH, help="Path to the JSONL run history.")
+    stats_parser.add_argument("--since", help="Only runs at or after this ISO date/time (UTC).")
+    stats_parser.add_argument("--campaign", help="Only campaigns whose name contains this text.")
+    stats_parser.add_argument("--json", action="store_true", help="Print JSON instead of a table.")
+    args = parser.parse_args()
+
+    rows = campaign_stats(load_run_records(args.runs_log, since=args.since, campaign=args.campaign))
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        sys.exit(0)
+    if not rows:
+        print(f"No campaign runs found in {args.runs_log}.")
+        sys.exit(0)
+    print(f"{'campaign':<32} {'runs':>5} {'flagged':>8} {'variants':>9} {'failed':>7} {'fail %':>7} {'avg s':>7}")
+    for row in rows:
+        avg = f"{row['avg_variant_latency_s']:.2f}" if row['avg_variant_latency_s'] is not None else "-"
+        print(f"{row['campaign_name'][:32]:<32} {row['runs']:>5} {row['flagged_runs']:>8} {row['variants']:>9} "
+              f"{row['failed_variants']:>7} {row['failure_rate'] * 100:>6.1f}% {avg:>7}")
+        for reason, count in row["top_failure_reasons"]:
+            print(f"{'':<34}{count}x {reason[:90]}")
@@ -0,0 +1,226 @@
+"""
+In-process stand-ins for the Gemini image model and the Dropbox SDK client,
+so the real FastAPI app can be benchmarked end to end without network access
+or quota. Latency, error rate and image size are configurable; everything
+else behaves like the real services as far as this app can tell.
+"""
+import io
+import random
+import threading
+import time
+import types
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import dropbox
+from google.api_core import exceptions as google_exceptions
+from PIL import Image
+
+class FakeLatency:
+    """Sleeps for 'seconds' ± jitter (a share of it) and fails with probability error_rate."""
+
+    def __init__(self, seconds: float, jitter: float = 0.2, error_rate: float = 0.0, seed: Optional[int] = None):
+        self.seconds = seconds
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def wait(self) -> bool:
+        """Waits out one call's latency; returns True if the call should fail."""
+        with self._lock:
+            delay = self.seconds * self._random.uniform(1 - self.jitter, 1 + self.jitter)
+            fail = self._random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        return fail
+
+class FakeGeminiModel:
+    """
+    Answers generate_content like the image model: with a PNG the shape of the
+    placeholder image it was sent, whose long side is image_size pixels.
+    Failures are 503s, which the resilience layer retries. Text prompts (the
+    agent's alert digests) get a short text answer.
+    """
+
+    def __init__(self, latency: FakeLatency, image_size: int = 1024):
+        self.latency = latency
+        self.image_size = image_size
+        self._images: Dict[Tuple[int, int], bytes] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _image(self, shape: Tuple[int, int]) -> bytes:
+        scale = self.image_size / max(shape)
+        size = (max(1, round(shape[0] * scale)), max(1, round(shape[1] * scale)))
+        with self._lock:
+            data = self._images.get(size)
+            if data is None:
+                # Noise over a gradient compresses about as badly as a real photo,
+                # so export and upload costs are realistic. Rendered once per size.
+                gradient = Image.linear_gradient("L").resize(size).convert("RGB")
+                noise = Image.effect_noise(size, 40).convert("RGB")
+                buffer = io.BytesIO()
+                Image.blend(gradient, noise, 0.35).save(buffer, format="PNG")
+                data = self._images[size] = buffer.getvalue()
+            return data
+
+    def generate_content(self, contents, request_options=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+        if self.latency.wait():
+            raise google_exceptions.ServiceUnavailable("Fake Gemini: injected error.")
+        if isinstance(contents, str):
+            return types.SimpleNamespace(text="Subject: Benchmark alert\n\nFake alert digest.\n")
+        placeholder = contents[-1]
+        shape = Image.open(io.BytesIO(placeholder["data"])).size if isinstance(placeholder, dict) else (1024, 1024)
+        part = types.SimpleNamespace(inline_data=types.SimpleNamespace(data=self._image(shape), mime_type="image/png"), text="")
+        return types.SimpleNamespace(
+            candidates=[types.SimpleNamespace(content=types.SimpleNamespace(parts=[part]))],
+            prompt_feedback=None,
+        )
+
+class FakeDropbox:
+    """
+    The subset of dropbox.Dropbox this app uses, backed by an in-memory file
+    tree. list_folder cursors are positions in an append-only change log, so
+    incremental catalog syncs behave as they do against Dropbox. Failures are
+    500s, which the resilience layer retries.
+    """
+    PAGE_SIZE = 2000
+
+    def __init__(self, latency: FakeLatency):
+        self.latency = latency
+        self._files: Dict[str, bytes] = {}
+        self._folders: Dict[str, str] = {}
+        self._links: Dict[str, str] = {}
+        self._changes: List = []
+        self._sessions: Dict[str, bytearray] = {}
+        self._lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+
+    def _call(self, name: str):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency.wait():
+            raise dropbox.exceptions.InternalServerError("fake", 500, f"Fake Dropbox: injected error in {name}.")
+
+    def _add_folders(self, path: str):
+        parts = path.split("/")[1:-1]
+        for depth in range(1, len(parts) + 1):
+            folder = "/" + "/".join(parts[:depth])
+            if folder.lower() not in self._folders:
+                self._folders[folder.lower()] = folder
+                self._changes.append(dropbox.files.FolderMetadata(
+                    name=parts[depth - 1], id=f"id:{folder.lower()}", path_lower=folder.lower(), path_display=folder,
+                ))
+
+    def add_file(self, path: str, data: bytes) -> dropbox.files.FileMetadata:
+        """Stores a file without latency or errors (for seeding the account before a run)."""
+        now = datetime.utcnow().replace(microsecond=0)
+        metadata = dropbox.files.FileMetadata(
+            name=path.split("/")[-1], id=f"id:{path.lower()}", client_modified=now, server_modified=now,
+            rev="0123456789abcdef", size=len(data), path_lower=path.lower(), path_display=path,
+        )
+        with self._lock:
+            self._add_folders(path)
+            self._files[path.lower()] = data
+            self._changes.append(metadata)
+        return metadata
+
+    def _page(self, start: int, prefix: str = ""):
+        with self._lock:
+            entries = [entry for entry in self._changes[start:start + self.PAGE_SIZE]
+                       if not prefix or entry.path_lower == prefix or entry.path_lower.startswith(prefix + "/")]
+            cursor = min(start + self.PAGE_SIZE, len(self._changes))
+            has_more = cursor < len(self._changes)
+        return types.SimpleNamespace(entries=entries, cursor=str(cursor), has_more=has_more)
+
+    # --- SDK methods -------------------------------------------------------
+
+    def users_get_current_account(self):
+        self._call("users_get_current_account")
+        return types.SimpleNamespace(account_id="dbid:fake")
+
+    def files_upload(self, data: bytes, path: str, mode=None):
+        self._call("files_upload")
+        self.add_file(path, data)
+
+    def files_upload_session_start(self, f: bytes, close: bool = False, session_type=None, content_hash=None):
+        self._call("files_upload_session_start")
+        session_id = f"session:{uuid.uuid4().hex}"
+        with self._lock:
+            self._sessions[session_id] = bytearray(f)
+        return dropbox.files.UploadSessionStartResult(session_id=session_id)
+
+    def files_upload_session_append_v2(self, f: bytes, cursor, close: bool = False, content_hash=None):
+        self._call("files_upload_session_append_v2")
+        with self._lock:
+            self._sessions[cursor.session_id] += f
+
+    def files_upload_session_finish_batch_v2(self, entries):
+        self._call("files_upload_session_finish_batch_v2")
+        results = []
+        for entry in entries:
+            with self._lock:
+                data = bytes(self._sessions.pop(entry.cursor.session_id))
+            results.append(dropbox.files.UploadSessionFinishBatchResultEntry.success(self.add_file(entry.commit.path, data)))
+        return dropbox.files.UploadSessionFinishBatchResult(entries=results)
+
+    def files_create_folder_batch(self, paths: List[str], autorename: bool = False, force_async: bool = False):
+        self._call("files_create_folder_batch")
+        with self._lock:
+            for path in paths:
+                self._add_folders(path.rstrip("/") + "/")
+        return dropbox.files.CreateFolderBatchLaunch.complete(dropbox.files.CreateFolderBatchResult(entries=[]))
+
+    def files_list_folder(self, path: str, recursive: bool = False, limit: Optional[int] = None):
+        self._call("files_list_folder")
+        prefix = path.rstrip("/").lower()
+        if prefix and prefix not in self._folders:
+            error = dropbox.files.ListFolderError.path(dropbox.files.LookupError.not_found)
+            raise dropbox.exceptions.ApiError("fake", error, None, None)
+        return self._page(0, prefix)
+
+    def files_list_folder_continue(self, cursor: str):
+        self._call("files_list_folder_continue")
+        return self._page(int(cursor))
+
+    def sharing_list_shared_links(self, path: Optional[str] = None, cursor: Optional[str] = None, direct_only: Optional[bool] = None):
+        self._call("sharing_list_shared_links")
+        with self._lock:
+            items = [(p, url) for p, url in self._links.items() if path is None or p == path.lower()]
+        links = [
+            dropbox.sharing.FileLinkMetadata(
+                url=url, name=p.split("/")[-1], path_lower=p, link_permissions=dropbox.sharing.LinkPermissions(can_revoke=False),
+                client_modified=datetime(2025, 1, 1), server_modified=datetime(2025, 1, 1), rev="0123456789abcdef", size=1,
+            )
+            for p, url in items
+        ]
+        return types.SimpleNamespace(links=links, has_more=False, cursor=None)
+
+    def sharing_create_shared_link_with_settings(self, path: str, settings=None):
+        self._call("sharing_create_shared_link_with_settings")
+        url = f"https://www.dropbox.com/scl/fi/fake{path}?dl=0"
+        with self._lock:
+            self._links[path.lower()] = url
+        return types.SimpleNamespace(url=url)
+
+    def files_get_thumbnail(self, path: str, format=None, size=None, mode=None):
+        self._call("files_get_thumbnail")
+        buffer = io.BytesIO()
+        Image.new("RGB", (64, 64), "gray").save(buffer, format="JPEG")
+        return None, types.SimpleNamespace(content=buffer.getvalue())
+
+def install(gemini: FakeGeminiModel, dbx: FakeDropbox):
+    """
+    Points the app's Gemini and Dropbox clients at the fakes. Call before the
+    app's lifespan starts, since that is when the clients are created.
+    """
+    import creative_generator
+    import dropbox_helper
+
+    creative_generator.genai.configure = lambda **kwargs: None
+    creative_generator.genai.GenerativeModel = lambda model_name=None, **kwargs: gemini
+    creative_generator.genai.get_model = lambda name: types.SimpleNamespace(name=name)
+    dropbox_helper.dropbox.Dropbox = lambda *args, **kwargs: dbx
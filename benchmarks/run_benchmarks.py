@@ -0,0 +1,307 @@
+"""
+Offline benchmark of the FastAPI app against the fakes in benchmarks/fakes.py.
+
+Runs /process-brief across concurrency levels and brief sizes (products x the
+3 aspect ratios) and /list-campaigns across concurrency levels, each scenario
+in a fresh process with its own cache and catalog, and reports requests/sec,
+p50/p95/p99 latency, peak RSS and scaling against concurrency 1.
+
+    python benchmarks/run_benchmarks.py --save-baseline
+    python benchmarks/run_benchmarks.py --compare benchmarks/baseline.json
+
+Every run is saved to benchmarks/results/; --compare exits with status 1 if
+any scenario's throughput or p95 latency regressed by more than --threshold.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+ASPECT_RATIOS_PER_BRIEF = 3
+
+def _percentile(values: List[float], share: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(share * len(ordered)) - 1))]
+
+def _process_peak_rss_mb(pid: int) -> Optional[float]:
+    """Peak RSS (VmHWM) of a live process; Linux only."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def _peak_rss_mb() -> Dict[str, Optional[float]]:
+    """Peak RSS of this process and the sum of its live export workers' peaks (None where unavailable)."""
+    # ru_maxrss is in KiB on Linux and bytes on macOS.
+    unit = 1 if platform.system() == "Darwin" else 1024
+    children = [_process_peak_rss_mb(child.pid) for child in multiprocessing.active_children()]
+    children = [peak for peak in children if peak is not None]
+    return {
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2 ** 20, 1),
+        "peak_child_rss_mb": round(sum(children), 1) if children else None,
+    }
+
+def _brief(name: str, products: int) -> Dict:
+    return {
+        "campaign_name": name,
+        "region": "US",
+        "audience": "Benchmark shoppers",
+        # Unique per request so every variant misses the generation cache.
+        "message": f"{name}: new season, new look.",
+        "brand_colors": ["#1a1a1a", "#ffcc00"],
+        "products": {f"Product {i + 1}": {"description": f"Benchmark product number {i + 1}."} for i in range(products)},
+    }
+
+# --- worker (one scenario, in its own process) -----------------------------
+
+def run_scenario(scenario: Dict, settings: Dict) -> Dict:
+    """Starts the app against fresh fakes and drives one scenario through it."""
+    workdir = tempfile.mkdtemp(prefix="creative-bench-")
+    os.environ.update({
+        "GOOGLE_API_KEY": "benchmark", "GEMINI_IMG_MODEL": "benchmark-image-model",
+        "DROPBOX_APP_KEY": "benchmark", "DROPBOX_APP_SECRET": "benchmark", "DROPBOX_REFRESH_TOKEN": "benchmark",
+        "CATALOG_DB_PATH": os.path.join(workdir, "catalog.sqlite3"),
+        "GENERATION_CACHE_DIR": os.path.join(workdir, "generations"),
+        "THUMBNAIL_CACHE_DIR": os.path.join(workdir, "thumbnails"),
+        "JOURNAL_DB_PATH": os.path.join(workdir, "journal.sqlite3"),
+        "JOURNAL_BASE_IMAGE_DIR": os.path.join(workdir, "journal_base_images"),
+        "RUNS_LOG_PATH": os.path.join(workdir, "runs.jsonl"),
+        # Injected errors are retried; keep backoff short relative to the fake latencies.
+        "RETRY_BASE_DELAY": os.environ.get("RETRY_BASE_DELAY", "0.05"),
+        "RETRY_MAX_DELAY": os.environ.get("RETRY_MAX_DELAY", "0.5"),
+        # Measure the code, not the model quota (set GEMINI_IMAGE_RPM to benchmark the scheduler too).
+        "GEMINI_IMAGE_RPM": os.environ.get("GEMINI_IMAGE_RPM", "0"),
+    })
+    # The app serves ./frontend and writes ./alerts; keep both out of the repo.
+    os.chdir(workdir)
+    os.symlink(os.path.join(REPO_DIR, "frontend"), os.path.join(workdir, "frontend"))
+    sys.path.insert(0, REPO_DIR)
+
+    import logging
+    import fakes
+    gemini = fakes.FakeGeminiModel(
+        fakes.FakeLatency(settings["gemini_latency"], settings["jitter"], settings["error_rate"], seed=1),
+        image_size=settings["image_size"],
+    )
+    dbx = fakes.FakeDropbox(fakes.FakeLatency(settings["dropbox_latency"], settings["jitter"], settings["error_rate"], seed=2))
+    fakes.install(gemini, dbx)
+
+    from fastapi.testclient import TestClient
+    import main
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if scenario["endpoint"] == "/list-campaigns":
+        placeholder = b"\x89PNG benchmark asset"
+        for campaign in range(settings["catalog_campaigns"]):
+            for ratio in ("1:1", "9:16", "16:9"):
+                for product in range(2):
+                    dbx.add_file(f"/Seeded_{campaign}/{ratio}/Seeded_{campaign}_P{product}_{ratio.replace(':', 'x')}.png", placeholder)
+
+    latencies: List[float] = []
+    errors = 0
+    with TestClient(main.app) as client:
+        def one(request_number: int) -> int:
+            start = time.perf_counter()
+            if scenario["endpoint"] == "/process-brief":
+                brief = _brief(f"Bench {os.getpid()} {request_number}", scenario["products"])
+                response = client.post("/process-brief", data={"brief_data": json.dumps(brief)})
+                ok = response.status_code == 200 and len(response.json()["image_urls"]) == scenario["variants"]
+            else:
+                # Alternate between the first gallery page and a name search.
+                params = {"limit": 20} if request_number % 2 else {"limit": 20, "campaign": f"Seeded_{request_number % 50}"}
+                response = client.get("/list-campaigns", params=params)
+                ok = response.status_code == 200
+            latencies.append(time.perf_counter() - start)
+            return 0 if ok else 1
+
+        # One untimed request warms up imports, the export pool and the catalog.
+        one(-1)
+        latencies.clear()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=scenario["concurrency"]) as executor:
+            errors = sum(executor.map(one, range(scenario["requests"])))
+        elapsed = time.perf_counter() - start
+        # Read while the export workers are still alive.
+        memory = _peak_rss_mb()
+
+    shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        **scenario,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(scenario["requests"] / elapsed, 3),
+        "p50_s": round(_percentile(latencies, 0.50), 4),
+        "p95_s": round(_percentile(latencies, 0.95), 4),
+        "p99_s": round(_percentile(latencies, 0.99), 4),
+        "gemini_calls": gemini.calls,
+        "dropbox_calls": sum(dbx.calls.values()),
+        **memory,
+    }
+
+# --- driver ----------------------------------------------------------------
+
+def _scenarios(args) -> List[Dict]:
+    scenarios = []
+    for products in args.products:
+        for concurrency in args.concurrency:
+            scenarios.append({
+                "name": f"process-brief p{products} c{concurrency}",
+                "endpoint": "/process-brief",
+                "products": products,
+                "variants": products * ASPECT_RATIOS_PER_BRIEF,
+                "concurrency": concurrency,
+                "requests": max(args.requests, concurrency),
+            })
+    for concurrency in args.concurrency:
+        scenarios.append({
+            "name": f"list-campaigns c{concurrency}",
+            "endpoint": "/list-campaigns",
+            "products": None,
+            "variants": None,
+            "concurrency": concurrency,
+            "requests": max(args.list_requests, concurrency),
+        })
+    return scenarios
+
+def _run_in_subprocess(scenario: Dict, settings: Dict) -> Dict:
+    process = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--worker", json.dumps({"scenario": scenario, "settings": settings})],
+        capture_output=True, text=True, cwd=REPO_DIR,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"Scenario '{scenario['name']}' failed:\n{process.stderr[-4000:]}")
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+def _add_scaling(results: List[Dict]):
+    """Throughput relative to the same scenario at the lowest concurrency, divided by the concurrency ratio."""
+    for result in results:
+        base = min((r for r in results if r["endpoint"] == result["endpoint"] and r["products"] == result["products"]),
+                   key=lambda r: r["concurrency"])
+        speedup = result["rps"] / base["rps"] if base["rps"] else 0.0
+        result["speedup"] = round(speedup, 2)
+        result["scaling_efficiency"] = round(speedup * base["concurrency"] / result["concurrency"], 2)
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=REPO_DIR, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def _print_table(results: List[Dict]):
+    print(f"{'scenario':<28} {'req':>5} {'err':>4} {'req/s':>8} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'rss MB':>7} {'child':>6} {'speedup':>7} {'eff':>5}")
+    for r in results:
+        print(f"{r['name']:<28} {r['requests']:>5} {r['errors']:>4} {r['rps']:>8.2f} {r['p50_s']:>7.3f} {r['p95_s']:>7.3f} "
+              f"{r['p99_s']:>7.3f} {r['peak_rss_mb']:>7.1f} {r['peak_child_rss_mb'] or 0:>6.1f} {r['speedup']:>7.2f} {r['scaling_efficiency']:>5.2f}")
+
+def compare(results: List[Dict], baseline: Dict, threshold: float) -> List[str]:
+    """Prints the change against a baseline run; returns the scenarios that regressed beyond threshold."""
+    base_by_name = {r["name"]: r for r in baseline["results"]}
+    regressions = []
+    print(f"\nCompared with {baseline['meta'].get('commit') or 'baseline'} ({baseline['meta']['timestamp']}):")
+    print(f"{'scenario':<28} {'req/s':>16} {'change':>8} {'p95 s':>16} {'change':>8}")
+    for r in results:
+        base = base_by_name.get(r["name"])
+        if not base:
+            print(f"{r['name']:<28} (not in baseline)")
+            continue
+        rps_change = (r["rps"] - base["rps"]) / base["rps"] if base["rps"] else 0.0
+        p95_change = (r["p95_s"] - base["p95_s"]) / base["p95_s"] if base["p95_s"] else 0.0
+        regressed = rps_change < -threshold or p95_change > threshold
+        if regressed:
+            regressions.append(r["name"])
+        print(f"{r['name']:<28} {base['rps']:>7.2f} -> {r['rps']:>6.2f} {rps_change:>+8.1%} "
+              f"{base['p95_s']:>7.3f} -> {r['p95_s']:>6.3f} {p95_change:>+8.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark /process-brief and /list-campaigns against local fakes.")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 4, 8], help="Comma-separated concurrency levels.")
+    parser.add_argument("--products", type=_int_list, default=[1, 3], help="Comma-separated products per brief (each gets 3 aspect ratios).")
+    parser.add_argument("--requests", type=int, default=8, help="/process-brief requests per scenario.")
+    parser.add_argument("--list-requests", type=int, default=200, help="/list-campaigns requests per scenario.")
+    parser.add_argument("--gemini-latency", type=float, default=0.5, help="Seconds per fake image generation.")
+    parser.add_argument("--dropbox-latency", type=float, default=0.05, help="Seconds per fake Dropbox call.")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Latency varies by up to this share either way.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of fake calls that fail with a retryable error.")
+    parser.add_argument("--image-size", type=int, default=1024, help="Long side in pixels of fake generated images.")
+    parser.add_argument("--catalog-campaigns", type=int, default=200, help="Campaigns seeded into Dropbox for /list-campaigns.")
+    parser.add_argument("--output", help="Where to save this run (default: benchmarks/results/<time>_<commit>.json).")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE, help="Also save this run as the baseline.")
+    parser.add_argument("--compare", nargs="?", const=DEFAULT_BASELINE, help="Compare with a saved baseline run.")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Relative change in req/s or p95 that counts as a regression.")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        job = json.loads(args.worker)
+        print(json.dumps(run_scenario(job["scenario"], job["settings"])))
+        sys.exit(0)
+
+    settings = {
+        "gemini_latency": args.gemini_latency,
+        "dropbox_latency": args.dropbox_latency,
+        "jitter": args.jitter,
+        "error_rate": args.error_rate,
+        "image_size": args.image_size,
+        "catalog_campaigns": args.catalog_campaigns,
+    }
+    results = []
+    for scenario in _scenarios(args):
+        print(f"Running {scenario['name']} ({scenario['requests']} requests)...", file=sys.stderr)
+        results.append(_run_in_subprocess(scenario, settings))
+    _add_scaling(results)
+    _print_table(results)
+
+    commit = _git_commit()
+    run = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+            "commit": commit,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "settings": settings,
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}_{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(run, f, indent=2)
+    print(f"\nSaved results to {output}")
+    if args.save_baseline:
+        shutil.copyfile(output, args.save_baseline)
+        print(f"Saved baseline to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["meta"]["settings"] != settings:
+            print("Warning: the baseline was recorded with different fake settings.", file=sys.stderr)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} scenario(s) regressed by more than {args.threshold:.0%}.")
+            sys.exit(1)
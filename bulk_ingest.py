@@ -0,0 +1,210 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import IO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from dotenv import load_dotenv
+from pydantic import ValidationError
+from models import CampaignBrief
+from pipeline import process_campaign, campaign_folder_for
+from telemetry import new_trace_id, start_trace
+from scheduler import scheduling
+
+MANIFESTS_DIR = "manifests"
+# Number of briefs in flight at once. Their variants all share the generator's
+# single bounded pool (GENERATION_CONCURRENCY), so this only controls how far
+# ahead of the model the ingester reads.
+BULK_BRIEF_CONCURRENCY = int(os.getenv("BULK_BRIEF_CONCURRENCY", "4"))
+
+def iter_brief_lines(lines: Iterable) -> Iterator[Tuple[int, Optional[Dict], Optional[str]]]:
+    """
+    Streams (line number, parsed JSON object, error) from a JSONL source one
+    line at a time. Blank lines and lines starting with '#' are skipped.
+    """
+    for line_number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield line_number, None, "Each line must be a JSON object."
+            continue
+        yield line_number, record, None
+
+class BaseImageStore:
+    """
+    Reads each referenced base image file once, however many briefs use it.
+    Paths are resolved relative to base_dir. The generator then prepares
+    identical bytes only once as well (see CreativeGenerator.prepare_base_images).
+    """
+
+    def __init__(self, base_dir: str):
+        self.base_dir = base_dir
+        self._images: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def load(self, path: str) -> bytes:
+        base_dir = os.path.realpath(self.base_dir)
+        full_path = os.path.realpath(os.path.join(base_dir, path))
+        if os.path.commonpath([base_dir, full_path]) != base_dir:
+            raise ValueError(f"Base image path '{path}' is outside {base_dir}.")
+        with self._lock:
+            if full_path not in self._images:
+                with open(full_path, "rb") as f:
+                    self._images[full_path] = f.read()
+            return self._images[full_path]
+
+def _write_manifest(manifests_dir: str, manifest: Dict) -> str:
+    os.makedirs(manifests_dir, exist_ok=True)
+    # Rejected lines never own the campaign's manifest; it may belong to an earlier, valid line.
+    if manifest["status"] == "invalid" or not manifest["campaign_folder"]:
+        name = f"line_{manifest['line']}"
+    else:
+        name = manifest["campaign_folder"].strip('/')
+    manifest_path = os.path.join(manifests_dir, f"{name}.json")
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest_path
+
+def run_bulk_ingest(
+    lines: Iterable,
+    generator,
+    storage,
+    base_dir: str = ".",
+    manifests_dir: str = MANIFESTS_DIR,
+    max_briefs_in_flight: int = BULK_BRIEF_CONCURRENCY,
+    on_brief: Optional[Callable[[Dict], None]] = None,
+    journal=None,
+) -> List[Dict]:
+    """
+    Validates every JSONL brief with CampaignBrief and runs the valid ones
+    through the normal campaign pipeline, writing a result manifest per brief
+    to manifests_dir. Each line is a CampaignBrief object with an optional
+    "base_images" list of {"path", "description"} entries (paths relative to
+    base_dir). Returns the manifests in file order; on_brief, if given, is
+    called with each manifest as soon as its brief finishes. With a journal
+    (see job_journal.JobJournal), each brief's variants are journaled so an
+    interrupted or flagged brief can be resumed later.
+    """
+    image_store = BaseImageStore(base_dir)
+    in_flight = threading.BoundedSemaphore(max(1, max_briefs_in_flight))
+    claimed_folders = set()
+    manifests: List[Dict] = []
+
+    def finish(manifest: Dict):
+        manifest["finished_at"] = datetime.utcnow().isoformat()
+        manifest["manifest_path"] = _write_manifest(manifests_dir, manifest)
+        logging.info(f"Bulk brief on line {manifest['line']} finished with status {manifest['status']}.")
+        if on_brief:
+            on_brief(manifest)
+
+    def run_one(manifest: Dict, brief: CampaignBrief, base_images_data: List[Dict]):
+        start_time = time.perf_counter()
+        try:
+            # Bulk briefs only get model quota that interactive requests leave unused.
+            with start_trace(new_trace_id(), campaign=brief.campaign_name) as trace_id, scheduling(priority="bulk"):
+                manifest["trace_id"] = trace_id
+                result = process_campaign(brief, base_images_data, generator, storage, manifest["campaign_folder"], journal=journal)
+            manifest["variants"] = result["variants"]
+            manifest["status"] = "completed" if result["image_urls"] else "no_images"
+        except Exception as e:
+            logging.error(f"Bulk brief on line {manifest['line']} failed: {e}")
+            manifest["status"] = "failed"
+            manifest["error"] = str(e)
+        finally:
+            manifest["duration_s"] = round(time.perf_counter() - start_time, 3)
+            finish(manifest)
+            in_flight.release()
+
+    with ThreadPoolExecutor(max_workers=max(1, max_briefs_in_flight), thread_name_prefix="bulk") as executor:
+        for line_number, record, error in iter_brief_lines(lines):
+            manifest = {
+                "line": line_number,
+                "campaign_name": (record or {}).get("campaign_name"),
+                "campaign_folder": None,
+                "status": "invalid",
+                "error": error,
+                "variants": [],
+                "trace_id": None,
+                "started_at": datetime.utcnow().isoformat(),
+            }
+            manifests.append(manifest)
+            if error:
+                finish(manifest)
+                continue
+
+            try:
+                base_image_specs = record.pop("base_images", []) or []
+                brief = CampaignBrief(**record)
+                manifest["campaign_folder"] = campaign_folder_for(brief.campaign_name)
+                if not manifest["campaign_folder"]:
+                    raise ValueError("Campaign name is invalid or empty.")
+                if (manifest["campaign_folder"].lower() in claimed_folders
+                        or (journal and journal.get(manifest["campaign_folder"]) is not None)
+                        or storage.exists(manifest["campaign_folder"])):
+                    raise ValueError(f"A campaign named '{brief.campaign_name}' already exists.")
+                base_images_data = generator.prepare_base_images([
+                    {"image_bytes": image_store.load(spec["path"]), "description": spec["description"]}
+                    for spec in base_image_specs
+                ])
+            except (ValidationError, ValueError, KeyError, TypeError, OSError) as e:
+                # ValueError includes ImagePreparationError for unreadable base images.
+                manifest["error"] = str(e)
+                finish(manifest)
+                continue
+
+            claimed_folders.add(manifest["campaign_folder"].lower())
+            manifest["status"] = "running"
+            # Stop reading ahead while max_briefs_in_flight briefs are still running.
+            in_flight.acquire()
+            executor.submit(run_one, manifest, brief, base_images_data)
+
+    return manifests
+
+if __name__ == "__main__":
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s', datefmt='%H:%M:%S')
+    from creative_generator import create_generator
+    from storage import create_storage
+    from agent import shutdown_agent
+    from job_journal import JobJournal
+
+    parser = argparse.ArgumentParser(description="Generate many campaigns from a JSONL file of briefs (one CampaignBrief per line).")
+    parser.add_argument("briefs", help="Path to the JSONL file, or '-' to read from stdin.")
+    parser.add_argument("--manifests-dir", default=MANIFESTS_DIR, help="Where per-brief result manifests are written.")
+    parser.add_argument("--concurrency", type=int, default=BULK_BRIEF_CONCURRENCY, help="Briefs in flight at once.")
+    args = parser.parse_args()
+
+    generator = create_generator()
+    storage = create_storage()
+    if not generator or not storage:
+        print("\n[ERROR] Gemini and storage (Dropbox, or STORAGE_BACKEND=local) must be configured in your .env file.")
+        sys.exit(1)
+
+    if args.briefs == "-":
+        source: IO = sys.stdin
+        base_dir = "."
+    else:
+        source = open(args.briefs)
+        base_dir = os.path.dirname(os.path.abspath(args.briefs))
+    with source:
+        results = run_bulk_ingest(source, generator, storage, base_dir=base_dir,
+                                  manifests_dir=args.manifests_dir, max_briefs_in_flight=args.concurrency, journal=JobJournal())
+    shutdown_agent()
+    storage.close()
+
+    for manifest in results:
+        generated = sum(1 for variant in manifest["variants"] if variant["url"])
+        print(f"line {manifest['line']:>4}  {manifest['status']:<10} {manifest['campaign_name'] or '-'}  "
+              f"{generated}/{len(manifest['variants'])} creatives  {manifest.get('error') or ''}")
@@ -0,0 +1,339 @@
+import os
+import time
+import logging
+import sqlite3
+import threading
+import dropbox
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+from resilience import call_with_resilience
+
+CATALOG_DB_PATH = os.getenv("CATALOG_DB_PATH", os.path.join("cache", "catalog.sqlite3"))
+# Minimum seconds between read-triggered syncs. Longpoll keeps the catalog fresh in between.
+CATALOG_SYNC_INTERVAL = int(os.getenv("CATALOG_SYNC_INTERVAL", "30"))
+CATALOG_LONGPOLL = os.getenv("CATALOG_LONGPOLL", "false").lower() in ("1", "true", "yes")
+CATALOG_LONGPOLL_TIMEOUT = int(os.getenv("CATALOG_LONGPOLL_TIMEOUT", "120"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    path_lower TEXT PRIMARY KEY,
+    path_display TEXT NOT NULL,
+    campaign_folder TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER,
+    server_modified TEXT,
+    url TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_assets_campaign ON assets (campaign_folder);
+CREATE TABLE IF NOT EXISTS campaigns (
+    campaign_folder TEXT PRIMARY KEY,
+    path_display TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Extra formats and downscaled renditions are exported to <ratio>/renditions/;
+# listings only show the primary creative of each variant.
+_PRIMARY_ASSETS = "path_lower NOT LIKE '%/renditions/%'"
+
+def _campaign_folder(path: str) -> str:
+    """'/Summer_Launch/1:1/a.png' -> 'summer_launch' (lower-cased, like Dropbox's path_lower)."""
+    return path.strip('/').split('/')[0].lower()
+
+def _like_escape(value: str) -> str:
+    """Escapes LIKE wildcards so 'value' matches literally (with ESCAPE '\\')."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _aspect_ratio(path: str) -> Optional[str]:
+    """'/Summer_Launch/1:1/a.png' -> '1:1'; None for files outside an aspect ratio folder."""
+    parts = path.strip('/').split('/')
+    return parts[1] if len(parts) >= 3 else None
+
+class CampaignCatalog:
+    """
+    Local SQLite mirror of the campaign assets in the Dropbox app folder,
+    including their share links. It is kept up to date incrementally from a
+    saved list_folder cursor, so the gallery and the campaign-exists check
+    don't need to walk the whole account or look up links file by file.
+    Without a Dropbox client (dbx=None) it is a plain index that its owner
+    fills with record_asset, as storage.LocalStorage does; sync is not used.
+    """
+
+    def __init__(self, dbx: Optional[dropbox.Dropbox], db_path: str = CATALOG_DB_PATH):
+        self.dbx = dbx
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.RLock()
+        self._last_sync = 0.0
+        self._longpoll_thread = None
+        self._stop = threading.Event()
+
+    # --- state -------------------------------------------------------------
+
+    def _get_state(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, key: str, value: Optional[str]):
+        self._conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, value))
+
+    # --- sync --------------------------------------------------------------
+
+    def sync(self) -> int:
+        """
+        Applies all changes since the saved cursor (or lists everything on the
+        first run), following has_more pages until the listing is complete.
+        Returns the number of entries applied.
+        """
+        with self._lock:
+            cursor = self._get_state("cursor")
+            applied = 0
+            try:
+                if cursor:
+                    result = call_with_resilience("dropbox", "dropbox_list", self.dbx.files_list_folder_continue, cursor)
+                else:
+                    result = call_with_resilience("dropbox", "dropbox_list", self.dbx.files_list_folder, "", recursive=True)
+                    self._conn.execute("DELETE FROM assets")
+                    self._conn.execute("DELETE FROM campaigns")
+            except dropbox.exceptions.ApiError as err:
+                if cursor and isinstance(err.error, dropbox.files.ListFolderContinueError) and err.error.is_reset():
+                    logging.warning("Dropbox cursor was reset; rebuilding the campaign catalog from scratch.")
+                    self._set_state("cursor", None)
+                    self._conn.commit()
+                    return self.sync()
+                raise
+
+            while True:
+                applied += self._apply_entries(result.entries)
+                self._set_state("cursor", result.cursor)
+                self._conn.commit()
+                if not result.has_more:
+                    break
+                result = call_with_resilience("dropbox", "dropbox_list", self.dbx.files_list_folder_continue, result.cursor)
+
+            # Runs whenever any asset still has no link, so links that failed on
+            # an earlier sync (rate limit, timeout) are retried rather than left
+            # hidden from query_campaigns. The cursor is already saved.
+            try:
+                self._fill_missing_links()
+            except Exception as e:
+                logging.error(f"Resolving share links failed; retrying on the next sync: {e}")
+                self._conn.commit()
+            self._last_sync = time.monotonic()
+            if applied:
+                logging.info(f"Campaign catalog synced {applied} changes from Dropbox.")
+            return applied
+
+    def sync_if_stale(self, max_age: int = CATALOG_SYNC_INTERVAL):
+        if time.monotonic() - self._last_sync >= max_age:
+            self.sync()
+
+    def _apply_entries(self, entries) -> int:
+        for entry in entries:
+            if isinstance(entry, dropbox.files.FileMetadata):
+                self._conn.execute(
+                    "INSERT INTO assets (path_lower, path_display, campaign_folder, name, size, server_modified) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(path_lower) DO UPDATE SET path_display = excluded.path_display, "
+                    "name = excluded.name, size = excluded.size, server_modified = excluded.server_modified",
+                    (entry.path_lower, entry.path_display, _campaign_folder(entry.path_lower), entry.name,
+                     entry.size, entry.server_modified.isoformat()),
+                )
+            elif isinstance(entry, dropbox.files.FolderMetadata):
+                if entry.path_lower.count('/') == 1:
+                    self._conn.execute("INSERT OR REPLACE INTO campaigns (campaign_folder, path_display) VALUES (?, ?)",
+                                       (_campaign_folder(entry.path_lower), entry.path_display))
+            elif isinstance(entry, dropbox.files.DeletedMetadata):
+                # A deleted path may be a file or a whole folder.
+                self._conn.execute(
+                    "DELETE FROM assets WHERE path_lower = ? OR path_lower LIKE ? ESCAPE '\\'",
+                    (entry.path_lower, _like_escape(entry.path_lower.rstrip('/')) + '/%'),
+                )
+                if entry.path_lower.count('/') == 1:
+                    self._conn.execute("DELETE FROM campaigns WHERE campaign_folder = ?", (_campaign_folder(entry.path_lower),))
+        return len(entries)
+
+    def _fill_missing_links(self):
+        """
+        Resolves share links for assets that don't have one cached. Existing
+        links are fetched in bulk (a few paged calls for the whole account);
+        only files that have never been shared get an individual create call.
+        """
+        missing = {row[0]: row[1] for row in self._conn.execute("SELECT path_lower, path_display FROM assets WHERE url IS NULL")}
+        if not missing:
+            return
+
+        result = call_with_resilience("dropbox", "dropbox_share_link", self.dbx.sharing_list_shared_links)
+        while True:
+            for link in result.links:
+                path_lower = getattr(link, "path_lower", None)
+                if path_lower in missing and isinstance(link, dropbox.sharing.FileLinkMetadata):
+                    self._conn.execute("UPDATE assets SET url = ? WHERE path_lower = ?", (link.url.replace("dl=0", "raw=1"), path_lower))
+                    missing.pop(path_lower)
+            if not result.has_more or not missing:
+                break
+            result = call_with_resilience("dropbox", "dropbox_share_link", self.dbx.sharing_list_shared_links, cursor=result.cursor)
+        self._conn.commit()
+
+        settings = dropbox.sharing.SharedLinkSettings(requested_visibility=dropbox.sharing.RequestedVisibility.public)
+        for path_lower, path_display in missing.items():
+            try:
+                shared_link = call_with_resilience(
+                    "dropbox", "dropbox_share_link", self.dbx.sharing_create_shared_link_with_settings,
+                    path=path_display, settings=settings,
+                )
+                self._conn.execute("UPDATE assets SET url = ? WHERE path_lower = ?", (shared_link.url.replace("dl=0", "raw=1"), path_lower))
+            except Exception as e:
+                logging.error(f"An unexpected error during shareable link creation for {path_display}: {e}")
+        self._conn.commit()
+
+    # --- longpoll ----------------------------------------------------------
+
+    def start_longpoll(self):
+        """Starts a daemon thread that syncs as soon as Dropbox reports a change."""
+        if self._longpoll_thread is not None:
+            return
+        self._longpoll_thread = threading.Thread(target=self._longpoll_loop, name="catalog-longpoll", daemon=True)
+        self._longpoll_thread.start()
+
+    def stop_longpoll(self):
+        self._stop.set()
+
+    def _longpoll_loop(self):
+        while not self._stop.is_set():
+            try:
+                cursor = self._get_state("cursor")
+                if not cursor:
+                    self.sync()
+                    continue
+                result = self.dbx.files_list_folder_longpoll(cursor, timeout=CATALOG_LONGPOLL_TIMEOUT)
+                if result.changes:
+                    self.sync()
+                if result.backoff:
+                    self._stop.wait(result.backoff)
+            except Exception as e:
+                logging.error(f"Campaign catalog longpoll failed: {e}")
+                self._stop.wait(30)
+
+    # --- queries -----------------------------------------------------------
+
+    def clear(self):
+        """Forgets every asset and campaign, e.g. before re-indexing a storage backend from scratch."""
+        with self._lock:
+            self._conn.execute("DELETE FROM assets")
+            self._conn.execute("DELETE FROM campaigns")
+            self._set_state("cursor", None)
+            self._conn.commit()
+
+    def record_asset(self, path_display: str, url: Optional[str], size: Optional[int] = None, modified: Optional[str] = None):
+        """
+        Adds a freshly uploaded asset (and its link) without waiting for the
+        next sync. modified is an ISO timestamp in UTC and defaults to now.
+        """
+        with self._lock:
+            path_lower = path_display.lower()
+            self._conn.execute(
+                "INSERT INTO assets (path_lower, path_display, campaign_folder, name, size, server_modified, url) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(path_lower) DO UPDATE SET url = COALESCE(excluded.url, assets.url)",
+                (path_lower, path_display, _campaign_folder(path_lower), path_display.rsplit('/', 1)[-1], size,
+                 modified or datetime.now(timezone.utc).replace(tzinfo=None).isoformat(timespec="seconds"), url),
+            )
+            self._conn.execute("INSERT OR IGNORE INTO campaigns (campaign_folder, path_display) VALUES (?, ?)",
+                               (_campaign_folder(path_lower), '/' + path_display.strip('/').split('/')[0]))
+            self._conn.commit()
+
+    def campaign_exists(self, folder_path: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM campaigns WHERE campaign_folder = ?", (_campaign_folder(folder_path),)).fetchone()
+            return row is not None
+
+    def get_asset(self, path: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path_display, name, size, server_modified, url FROM assets WHERE path_lower = ?", (path.lower(),)
+            ).fetchone()
+        if not row:
+            return None
+        return {"path": row[0], "filename": row[1], "size": row[2], "modified": row[3], "url": row[4], "aspect_ratio": _aspect_ratio(row[0])}
+
+    def query_campaigns(
+        self,
+        after: Optional[str] = None,
+        limit: int = 10,
+        name: Optional[str] = None,
+        aspect_ratio: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        folder: Optional[str] = None,
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Returns one page of campaigns (ordered by folder name) whose assets match
+        the filters, plus the folder to pass as 'after' for the next page (None
+        on the last page). since/until are ISO dates compared against each
+        asset's modification time; name is a case-insensitive substring match
+        and folder an exact campaign folder. Extra export renditions are left out.
+        """
+        conditions = ["url IS NOT NULL", _PRIMARY_ASSETS]
+        params: List = []
+        if after:
+            conditions.append("campaign_folder > ?")
+            params.append(after.lower())
+        if folder:
+            conditions.append("campaign_folder = ?")
+            params.append(_campaign_folder(folder))
+        if name:
+            # Folder names have spaces replaced with '_' (see pipeline.campaign_folder_for).
+            conditions.append("campaign_folder LIKE ? ESCAPE '\\'")
+            params.append(f"%{_like_escape(name.strip().lower().replace(' ', '_'))}%")
+        if aspect_ratio:
+            conditions.append("path_lower LIKE '/' || campaign_folder || '/' || ? || '/%' ESCAPE '\\'")
+            params.append(_like_escape(aspect_ratio.lower()))
+        if since:
+            conditions.append("server_modified >= ?")
+            params.append(since)
+        if until:
+            # A bare date means "through the end of that day".
+            conditions.append("server_modified <= ?")
+            params.append(until if 'T' in until else f"{until}T23:59:59")
+        where = " AND ".join(conditions)
+
+        with self._lock:
+            folders = [row[0] for row in self._conn.execute(
+                f"SELECT DISTINCT campaign_folder FROM assets WHERE {where} ORDER BY campaign_folder LIMIT ?",
+                (*params, limit + 1),
+            )]
+            next_after = folders[limit - 1] if len(folders) > limit else None
+            folders = folders[:limit]
+            rows = []
+            if folders:
+                placeholders = ", ".join("?" for _ in folders)
+                rows = self._conn.execute(
+                    f"SELECT campaign_folder, path_display, name, size, server_modified, url FROM assets "
+                    f"WHERE {where} AND campaign_folder IN ({placeholders}) ORDER BY campaign_folder, path_lower",
+                    (*params, *folders),
+                ).fetchall()
+
+        campaigns: Dict[str, Dict] = {}
+        for folder, path_display, name_, size, modified, url in rows:
+            campaign = campaigns.setdefault(folder, {
+                "id": folder,
+                "name": path_display.strip('/').split('/')[0].replace('_', ' '),
+                "created": modified,
+                "assets": [],
+            })
+            if modified and (campaign["created"] is None or modified < campaign["created"]):
+                campaign["created"] = modified
+            campaign["assets"].append({
+                "path": path_display,
+                "filename": name_,
+                "aspect_ratio": _aspect_ratio(path_display),
+                "size": size,
+                "modified": modified,
+                "url": url,
+            })
+        return [campaigns[folder] for folder in folders if folder in campaigns], next_after
@@ -5,41 +5,111 @@ from dotenv import load_dotenv
 import google.generativeai as genai
 import io
 import uuid
-from typing import Optional, List, Dict
+import time
+import threading
+import hashlib
+import re
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Optional, List, Dict, Iterator, Set, Tuple
+from generation_cache import GenerationCache
+from image_prep import prepare_image
+from resilience import call_with_resilience, CircuitOpenError, GEMINI_TIMEOUT
+from derive import derive_aspect_ratio, master_aspect_ratio
+from text_overlay import composite_text, message_variants
+from telemetry import span, submit_in_context, BYTES_TOTAL
+from scheduler import FairExecutor, QuotaWaitTimeout, get_scheduler
 
-# Load environment variables and configure logging/API
+# Load environment variables and configure logging. The Gemini client itself is
+# configured lazily (see configure_genai) so importing this module stays cheap.
 load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s', datefmt='%H:%M:%S')
 GEMINI_IMG_MODEL = os.getenv("GEMINI_IMG_MODEL")
-if not GEMINI_IMG_MODEL:
-    raise ValueError("CRITICAL: GEMINI_IMG_MODEL is not set in your .env file.")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-if not GOOGLE_API_KEY:
-    raise ValueError("GOOGLE_API_KEY not found in your .env file.")
-genai.configure(api_key=GOOGLE_API_KEY)
+# Number of distinct prepared base images kept in memory (e.g. a logo reused by many briefs).
+PREPARED_IMAGE_CACHE_SIZE = 16
+# Maximum number of product x aspect ratio variants generated in parallel. The
+# pool is shared by every brief in the process (web requests, jobs, bulk runs).
+GENERATION_CONCURRENCY = int(os.getenv("GENERATION_CONCURRENCY", "4"))
+
+_genai_configured = False
+_genai_lock = threading.Lock()
+
+def configure_genai():
+    """Configures the shared Gemini client on first use. Safe to call repeatedly."""
+    global _genai_configured
+    if _genai_configured:
+        return
+    with _genai_lock:
+        if _genai_configured:
+            return
+        if not GOOGLE_API_KEY:
+            raise ValueError("GOOGLE_API_KEY not found in your .env file.")
+        genai.configure(api_key=GOOGLE_API_KEY)
+        _genai_configured = True
 
 class ContentGenerationError(Exception):
     """Custom exception for when content fails to generate as expected."""
     pass
 
+class ContentBlockedError(ContentGenerationError):
+    """The request was blocked by the model's safety filters."""
+    pass
+
 class CreativeGenerator:
     """Generates creative assets using an advanced multimodal prompting technique."""
 
-    def __init__(self):
-        try:
-            self.model = genai.GenerativeModel(model_name=GEMINI_IMG_MODEL)
-            self.model.generate_content("test")
-            logging.info(f"Successfully connected to Gemini API with '{GEMINI_IMG_MODEL}'.")
-        except Exception as e:
-            raise RuntimeError(f"API connection failed for model '{GEMINI_IMG_MODEL}': {e}")
+    def __init__(self, max_concurrency: int = GENERATION_CONCURRENCY, cache: Optional[GenerationCache] = None):
+        if not GEMINI_IMG_MODEL:
+            raise ValueError("CRITICAL: GEMINI_IMG_MODEL is not set in your .env file.")
+        self._model = None
+        self._model_lock = threading.Lock()
 
-        self.output_dir = 'temp_outputs'
         self.aspect_ratios = ["1:1", "9:16", "16:9"]
         self.aspect_ratio_dims = {"1:1": (1024, 1024), "9:16": (720, 1280), "16:9": (1280, 720)}
-        os.makedirs(self.output_dir, exist_ok=True)
+        self.max_concurrency = max(1, max_concurrency)
+        self.cache = cache if cache is not None else GenerationCache()
+        # One bounded pool for all variants of all briefs, so concurrent and
+        # bulk submissions share the same generation capacity. Queued variants
+        # start by priority and round-robin across campaigns (see scheduler.py).
+        self._executor = FairExecutor(max_workers=self.max_concurrency, thread_name_prefix="generate")
+        self._prepared_images: "OrderedDict[str, Dict]" = OrderedDict()
+        self._prepared_images_lock = threading.Lock()
+        # Encoded once per ratio and reused by every request.
+        self._placeholder_blobs: Dict[str, Dict] = {}
+
+    @property
+    def model(self):
+        """The Gemini image model, created on first use and shared by all requests."""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    configure_genai()
+                    self._model = genai.GenerativeModel(model_name=GEMINI_IMG_MODEL)
+                    logging.info(f"Gemini image model '{GEMINI_IMG_MODEL}' initialized.")
+        return self._model
+
+    def check_health(self) -> bool:
+        """
+        Lightweight readiness probe. Fetches the model's metadata instead of
+        running a generation, so it costs no generation quota.
+        """
+        configure_genai()
+        model_name = GEMINI_IMG_MODEL if GEMINI_IMG_MODEL.startswith("models/") else f"models/{GEMINI_IMG_MODEL}"
+        genai.get_model(model_name)
+        return True
 
     def _assemble_all_in_one_prompt(self, brief, product_name, product_description, base_images_data: List[Dict]) -> str:
         brand_colors_str = ", ".join(brief.brand_colors)
+        if getattr(brief, "text_mode", "model") == "overlay":
+            # The message is composited locally afterwards (see text_overlay.py),
+            # so the background, and its cache entry, are the same for every message.
+            text_requirement = (
+                "The image MUST NOT contain any text, letters or numbers. "
+                "Keep the bottom third of the image calm and uncluttered so a headline can be placed there later."
+            )
+        else:
+            text_requirement = f"The text '{brief.message}' MUST be elegantly rendered directly onto the image."
         base_image_instructions = ""
         if base_images_data:
             base_image_instructions += "\n\n**Base Image Instructions:**\n"
@@ -53,30 +123,47 @@ class CreativeGenerator:
             f"- **Color Palette:** The image's color scheme MUST be inspired by these brand colors: {brand_colors_str}."
             f"{base_image_instructions}"
             f"\n**Execution Requirements:**\n"
-            f"1. **Text Overlay:** The text '{brief.message}' MUST be elegantly rendered directly onto the image.\n"
+            f"1. **Text Overlay:** {text_requirement}\n"
             f"2. **Aspect Ratio:** The final image's dimensions MUST strictly match the final, blank white placeholder image provided in the input.\n"
         )
         return prompt
 
-    def _generate_image(self, prompt: str, aspect_ratio: str, prepared_images: List[Image.Image]) -> Optional[Image.Image]:
+    def _placeholder_blob(self, aspect_ratio: str) -> Dict:
+        blob = self._placeholder_blobs.get(aspect_ratio)
+        if blob is None:
+            dims = self.aspect_ratio_dims.get(aspect_ratio, (1024, 1024))
+            buffer = io.BytesIO()
+            Image.new('RGB', dims, 'white').save(buffer, format="PNG", optimize=True)
+            blob = {"mime_type": "image/png", "data": buffer.getvalue()}
+            self._placeholder_blobs[aspect_ratio] = blob
+        return blob
+
+    def _generate_image(self, prompt: str, aspect_ratio: str, base_images_data: List[Dict]) -> Tuple[bytes, str]:
+        """Returns the model's image exactly as it was sent back, as (bytes, mime type)."""
         try:
             contents = [prompt]
-            contents.extend(prepared_images)
-            dims = self.aspect_ratio_dims.get(aspect_ratio, (1024, 1024))
-            placeholder_image = Image.new('RGB', dims, 'white')
-            contents.append(placeholder_image)
+            contents.extend({"mime_type": data['mime_type'], "data": data['data']} for data in base_images_data)
+            contents.append(self._placeholder_blob(aspect_ratio))
             
-            response = self.model.generate_content(contents)
+            # Rate limits, 5xx and network errors are retried; a blocked or
+            # text-only answer below is terminal and never reaches the retry loop.
+            # Every attempt first waits for the image model's shared quota.
+            with span("gemini_generate", aspect_ratio=aspect_ratio):
+                response = call_with_resilience(
+                    "gemini", "gemini_generate", get_scheduler("gemini_image").wrap(self.model.generate_content),
+                    contents, request_options={"timeout": GEMINI_TIMEOUT},
+                )
             
             if not response.candidates:
                 reason = "Unknown"
                 if response.prompt_feedback and response.prompt_feedback.block_reason:
                     reason = response.prompt_feedback.block_reason.name
-                raise ContentGenerationError(f"Request blocked by safety filters. Reason: {reason}")
+                raise ContentBlockedError(f"Request blocked by safety filters. Reason: {reason}")
 
             for part in response.candidates[0].content.parts:
                 if part.inline_data:
-                    return Image.open(io.BytesIO(part.inline_data.data))
+                    BYTES_TOTAL.labels("model_in").inc(len(part.inline_data.data))
+                    return part.inline_data.data, part.inline_data.mime_type or "image/png"
             
             text_response = response.candidates[0].content.parts[0].text
             raise ContentGenerationError(f"Model returned text instead of an image: '{text_response}'")
@@ -84,39 +171,283 @@ class CreativeGenerator:
         except Exception as e:
             if isinstance(e, ContentGenerationError):
                 raise
+            elif isinstance(e, (CircuitOpenError, QuotaWaitTimeout)):
+                raise ContentGenerationError(str(e))
             else:
                 raise ContentGenerationError(f"An unexpected API error occurred: {e}")
 
-    def process_and_save_creatives(self, brief, base_images_data: List[Dict]):
-        generated_files = []
-        
-        prepared_base_images = []
-        for data in base_images_data:
+    def _new_result(self, brief, index, product_name, aspect_ratio) -> Dict:
+        ratio_str = aspect_ratio.replace(':', 'x')
+        return {
+            "index": index,
+            "product": product_name,
+            "aspect_ratio": aspect_ratio,
+            # The export stage appends the extension of each output format.
+            "basename": f"{brief.campaign_name.replace(' ', '_')}_{product_name.replace(' ', '_')}_{ratio_str}_{str(uuid.uuid4())[:8]}",
+            "data": None,
+            "content_type": None,
+            "error": None,
+            "cache_hit": False,
+            # "generate": made by the model; "derive": cut locally from the
+            # product's master creative (see derive.py).
+            "mode": "generate",
+            "quality": None,
+            "blocked": False,
+            # Region/locale of the composited message in text overlay mode.
+            "locale": None,
+        }
+
+    def _generate_variant(self, brief, index, product_name, product_details, aspect_ratio, base_images_data, reuse: bool = False) -> Dict:
+        """
+        Generates a single product x aspect ratio creative. 'data' holds the raw
+        image bytes from the model; encoding to the output formats happens later
+        in the export stage (see export.py), off this thread. Failures are
+        captured in the returned result rather than raised, so one bad variant
+        never affects the others. With reuse (an earlier run already uploaded
+        this image), the cached image is used even under force_regenerate.
+        """
+        logging.info(f"--- Starting generation for '{product_name}' ({aspect_ratio}) ---")
+        result = self._new_result(brief, index, product_name, aspect_ratio)
+        start_time = time.perf_counter()
+        try:
+            prompt = self._assemble_all_in_one_prompt(brief, product_name, product_details.description, base_images_data)
+            cache_key = GenerationCache.make_key(
+                prompt,
+                [data['digest'].encode() for data in base_images_data],
+                self.aspect_ratio_dims.get(aspect_ratio, (1024, 1024)),
+                GEMINI_IMG_MODEL,
+            )
+            cached = None
+            if reuse or not getattr(brief, "force_regenerate", False):
+                cached = self.cache.get(cache_key)
+                result["cache_hit"] = cached is not None
+
+            if cached:
+                image_data, content_type = cached
+            else:
+                image_data, content_type = self._generate_image(prompt, aspect_ratio, base_images_data)
+                self.cache.put(cache_key, image_data, content_type)
+
+            result["data"] = image_data
+            result["content_type"] = content_type
+
+        except ContentGenerationError as e:
+            # Log the specific failure and continue to the next image.
+            logging.error(f"Failed to generate creative for '{product_name}' ({aspect_ratio}). Reason: {e}")
+            result["error"] = str(e)
+            result["blocked"] = isinstance(e, ContentBlockedError)
+        except Exception as e:
+            logging.error(f"Unexpected failure for '{product_name}' ({aspect_ratio}): {e}")
+            result["error"] = f"Unexpected error: {e}"
+
+        result["duration_s"] = round(time.perf_counter() - start_time, 3)
+        logging.info(f"--- Finished '{product_name}' ({aspect_ratio}) in {result['duration_s']}s{' (cached)' if result['cache_hit'] else ''} ---")
+        return result
+
+    def _generate_derived_product(self, brief, first_index, product_name, product_details, base_images_data, fallbacks: List[Tuple[int, str, Optional[Dict]]], reuse_master: bool = False) -> List[Dict]:
+        """
+        Derive mode for one product: generates the master aspect ratio with the
+        model and derives the other ratios from it locally. Ratios that fail the
+        quality check (see derive.derive_aspect_ratio), or all of them if the
+        master failed, are appended to 'fallbacks' as (index, aspect ratio,
+        quality) for generate_creatives to queue on the shared pool, so they
+        are generated concurrently rather than one after another on this worker.
+        reuse_master is passed on to _generate_variant for the master.
+        """
+        master_ratio = master_aspect_ratio(self.aspect_ratios)
+        indexes = {ratio: first_index + offset for offset, ratio in enumerate(self.aspect_ratios)}
+        master = self._generate_variant(brief, indexes[master_ratio], product_name, product_details, master_ratio, base_images_data, reuse_master)
+        results = [master]
+        for aspect_ratio in self.aspect_ratios:
+            if aspect_ratio == master_ratio:
+                continue
+            if not master["data"]:
+                fallbacks.append((indexes[aspect_ratio], aspect_ratio, None))
+                continue
+            start_time = time.perf_counter()
+            result = self._new_result(brief, indexes[aspect_ratio], product_name, aspect_ratio)
             try:
-                image = Image.open(io.BytesIO(data['image_bytes']))
-                prepared_base_images.append(image)
+                with span("derive", aspect_ratio=aspect_ratio):
+                    derived = derive_aspect_ratio(master["data"], self.aspect_ratio_dims[aspect_ratio], brief.brand_colors)
+                result["quality"] = {"saliency_retained": derived["saliency_retained"], "padding": derived["padding"]}
+                if derived["passed"]:
+                    result["mode"] = "derive"
+                    result["data"] = derived["data"]
+                    result["content_type"] = "image/png"
+                    result["duration_s"] = round(time.perf_counter() - start_time, 3)
+                    logging.info(f"--- Derived '{product_name}' ({aspect_ratio}) from {master_ratio} in {result['duration_s']}s ---")
+                    results.append(result)
+                    continue
+                logging.info(f"Derived '{product_name}' ({aspect_ratio}) failed the quality check {result['quality']}; generating it instead.")
             except Exception as e:
-                logging.error(f"Could not process uploaded file for description '{data['description']}': {e}")
-                continue
+                logging.error(f"Deriving '{product_name}' ({aspect_ratio}) failed, generating it instead: {e}")
+            fallbacks.append((indexes[aspect_ratio], aspect_ratio, result["quality"]))
+        return results
 
-        for product_name, product_details in brief.products.items():
-            for aspect_ratio in self.aspect_ratios:
-                logging.info(f"--- Starting generation for '{product_name}' ({aspect_ratio}) ---")
-                
-                try:
-                    prompt = self._assemble_all_in_one_prompt(brief, product_name, product_details.description, base_images_data)
-                    generated_image = self._generate_image(prompt, aspect_ratio, prepared_base_images)
-
-                    if generated_image:
-                        ratio_str = aspect_ratio.replace(':', 'x')
-                        filename = f"{brief.campaign_name.replace(' ', '_')}_{product_name.replace(' ', '_')}_{ratio_str}_{str(uuid.uuid4())[:8]}.png"
-                        output_path = os.path.join(self.output_dir, filename)
-                        generated_image.save(output_path)
-                        generated_files.append(output_path)
-
-                except ContentGenerationError as e:
-                    # Log the specific failure and continue to the next image.
-                    logging.error(f"Failed to generate creative for '{product_name}' ({aspect_ratio}). Reason: {e}")
-                    continue 
-        
-        return generated_files
\ No newline at end of file
+    def _generate_fallback(self, brief, index, product_name, product_details, aspect_ratio, base_images_data, quality, reuse) -> Dict:
+        """Derive mode: generates a ratio that could not be derived, keeping the failed quality check on the result."""
+        result = self._generate_variant(brief, index, product_name, product_details, aspect_ratio, base_images_data, reuse)
+        result["quality"] = quality
+        return result
+
+    def _localize(self, brief, results: List[Dict]) -> List[Dict]:
+        """
+        Text overlay mode: turns each text-free background into one creative per
+        message variant (see text_overlay.message_variants), composited locally.
+        Indexes are spread out so every locale keeps its own slot in brief order.
+        """
+        messages = message_variants(brief)
+        localized = []
+        for background in results:
+            for position, (locale, message) in enumerate(messages):
+                result = dict(background)
+                result["index"] = background["index"] * len(messages) + position
+                result["locale"] = locale
+                if position:
+                    safe_locale = re.sub(r'[^\w\-]', '', locale or '') or str(position)
+                    result["basename"] = f"{background['basename']}_{safe_locale}"
+                if background["data"]:
+                    start_time = time.perf_counter()
+                    try:
+                        with span("text_composite", locale=locale):
+                            result["data"] = composite_text(background["data"], message, brief.brand_colors)
+                        result["content_type"] = "image/png"
+                    except Exception as e:
+                        logging.error(f"Compositing the '{locale}' message onto '{background['product']}' ({background['aspect_ratio']}) failed: {e}")
+                        result["data"] = None
+                        result["error"] = f"Text compositing failed: {e}"
+                    result["duration_s"] = round(background["duration_s"] + time.perf_counter() - start_time, 3)
+                localized.append(result)
+        return localized
+
+    def _run_task(self, brief, task, *args) -> List[Dict]:
+        results = task(brief, *args)
+        results = results if isinstance(results, list) else [results]
+        if getattr(brief, "text_mode", "model") == "overlay":
+            results = self._localize(brief, results)
+        return results
+
+    def prepare_base_images(self, base_images_data: List[Dict]) -> List[Dict]:
+        """
+        Turns uploaded base images ({"image_bytes", "description"}) into compact,
+        model-ready payloads ({"description", "digest", "mime_type", "data"}, see
+        image_prep.prepare_image). Each distinct image is decoded and re-encoded
+        once; the result is reused by every variant and by later briefs that
+        upload the same bytes. Raises ImagePreparationError for unreadable images.
+        """
+        prepared = []
+        for data in base_images_data:
+            digest = hashlib.sha256(data['image_bytes']).hexdigest()
+            with self._prepared_images_lock:
+                payload = self._prepared_images.get(digest)
+                if payload is not None:
+                    self._prepared_images.move_to_end(digest)
+            if payload is None:
+                BYTES_TOTAL.labels("client_in").inc(len(data['image_bytes']))
+                with span("base_image_prepare"):
+                    payload = prepare_image(data['image_bytes'])
+                with self._prepared_images_lock:
+                    self._prepared_images[digest] = payload
+                    while len(self._prepared_images) > PREPARED_IMAGE_CACHE_SIZE:
+                        self._prepared_images.popitem(last=False)
+            prepared.append({"description": data['description'], **payload})
+        return prepared
+
+    def queue_stats(self) -> Dict:
+        """Workers, running variants and queued variants per priority class of the shared generation pool."""
+        return self._executor.stats()
+
+    def variant_keys(self, brief) -> List[Tuple[str, str, Optional[str]]]:
+        """(product, aspect ratio, locale) of every result generate_creatives yields for this brief, in brief order."""
+        locales = [locale or None for locale, _ in message_variants(brief)] if getattr(brief, "text_mode", "model") == "overlay" else [None]
+        return [
+            (product_name, aspect_ratio, locale)
+            for product_name in brief.products
+            for aspect_ratio in self.aspect_ratios
+            for locale in locales
+        ]
+
+    def variant_count(self, brief) -> int:
+        """Number of results generate_creatives yields for this brief."""
+        return len(self.variant_keys(brief))
+
+    def generate_creatives(self, brief, base_images_data: List[Dict], only: Optional[Set[Tuple[str, str, Optional[str]]]] = None) -> Iterator[Dict]:
+        """
+        Generates every product x aspect ratio variant and yields each result as
+        soon as it finishes, so callers can start uploading while the rest are
+        still generating. base_images_data must come from prepare_base_images.
+        Results carry the raw image bytes ('data') plus their product/ratio
+        metadata and the 'mode' that produced them; 'index' gives the variant's
+        position in brief order, and 'data' is None when the variant failed.
+        The instance is shared between requests, so no per-run state is kept
+        on self.
+        If 'only' is given, just the variants with those keys (see
+        variant_keys) are generated and yielded, e.g. to resume a campaign.
+        """
+        # Every product x aspect ratio pair is an independent variant, generated
+        # concurrently on the generator's shared, bounded pool. In derive mode
+        # each product is one task instead: its master, then the ratios cut
+        # from it; ratios that can't be cut are queued as variants of their own.
+        variants = [
+            (product_name, product_details, aspect_ratio)
+            for product_name, product_details in brief.products.items()
+            for aspect_ratio in self.aspect_ratios
+        ]
+        wanted = None if only is None else {(product, aspect_ratio) for product, aspect_ratio, _ in only}
+        # Model outputs an earlier run already uploaded a creative from: a
+        # resumed derive master, or an overlay background with some locales
+        # missing. They are reused rather than paid for again.
+        uploaded = set() if only is None else {
+            (product, aspect_ratio) for product, aspect_ratio, locale in self.variant_keys(brief) if (product, aspect_ratio, locale) not in only
+        }
+        run_start = time.perf_counter()
+        succeeded = 0
+        # Futures of derive tasks map to (product name, details, fallbacks).
+        pending = {}
+        if getattr(brief, "generation_mode", "generate") == "derive":
+            ratios_per_product = len(self.aspect_ratios)
+            master_ratio = master_aspect_ratio(self.aspect_ratios)
+            for position, (product_name, product_details) in enumerate(brief.products.items()):
+                if wanted is not None and not any(product == product_name for product, _ in wanted):
+                    continue
+                fallbacks = []
+                future = submit_in_context(self._executor, self._run_task, brief, self._generate_derived_product, position * ratios_per_product, product_name, product_details, base_images_data, fallbacks, (product_name, master_ratio) in uploaded)
+                pending[future] = (product_name, product_details, fallbacks)
+        else:
+            for index, (product_name, product_details, aspect_ratio) in enumerate(variants):
+                if wanted is None or (product_name, aspect_ratio) in wanted:
+                    pending[submit_in_context(self._executor, self._run_task, brief, self._generate_variant, index, product_name, product_details, aspect_ratio, base_images_data, (product_name, aspect_ratio) in uploaded)] = None
+        produced = 0
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                derived = pending.pop(future)
+                if derived:
+                    # Ratios the derive task could not cut from its master join
+                    # the pool as ordinary variants.
+                    product_name, product_details, fallbacks = derived
+                    for index, aspect_ratio, quality in fallbacks:
+                        if wanted is None or (product_name, aspect_ratio) in wanted:
+                            pending[submit_in_context(self._executor, self._run_task, brief, self._generate_fallback, index, product_name, product_details, aspect_ratio, base_images_data, quality, (product_name, aspect_ratio) in uploaded)] = None
+                for result in future.result():
+                    # Derive and overlay tasks produce sibling variants too; only the requested ones are yielded.
+                    if only is not None and (result["product"], result["aspect_ratio"], result["locale"] or None) not in only:
+                        continue
+                    produced += 1
+                    if result["data"]:
+                        succeeded += 1
+                    yield result
+
+        logging.info(
+            f"Generated {succeeded}/{produced} variants in {time.perf_counter() - run_start:.2f}s "
+            f"(concurrency={self.max_concurrency})."
+        )
+
+
+def create_generator() -> Optional[CreativeGenerator]:
+    """Builds a CreativeGenerator from the environment, or None if it is not configured."""
+    try:
+        return CreativeGenerator()
+    except ValueError as e:
+        logging.error(f"Creative generator is not configured: {e}")
+        return None
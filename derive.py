@@ -0,0 +1,143 @@
+import io
+import os
+from PIL import Image, ImageColor, ImageDraw, ImageFilter, ImageOps, ImageStat
+from typing import Dict, List, Optional, Tuple
+from export import encode_intermediate
+
+# Aspect ratio generated by the model in derive mode; the others are cut from it.
+DERIVE_MASTER_ASPECT_RATIO = os.getenv("DERIVE_MASTER_ASPECT_RATIO", "1:1")
+# Largest share of the master's width (or height) that may be cropped away;
+# beyond this the rest of the ratio change is made up with padding.
+DERIVE_MAX_CROP = float(os.getenv("DERIVE_MAX_CROP", "0.3"))
+# Quality check: a derived creative must keep at least this share of the
+# master's visual detail and be at most this share padding, or it is
+# generated by the model instead. A master with evenly spread detail keeps
+# about 1 - DERIVE_MAX_CROP of it, so the minimum must sit below that for
+# such an image to pass; 0.65 still rejects crops that cut the subject off.
+DERIVE_MIN_SALIENCY = float(os.getenv("DERIVE_MIN_SALIENCY", "0.65"))
+DERIVE_MAX_PADDING = float(os.getenv("DERIVE_MAX_PADDING", "0.25"))
+# Edge strips whose colour varies less than this (stddev per channel) are
+# extended with their own average colour, which blends in seamlessly.
+UNIFORM_EDGE_STDDEV = 12.0
+SALIENCY_MAP_SIZE = 128
+
+def _saliency_profile(image: Image.Image, horizontal: bool) -> List[float]:
+    """
+    Per-column (horizontal=True) or per-row visual detail of the image: edge
+    strength, which text, products and faces have and flat backgrounds do not.
+    """
+    small = image.convert("L")
+    small.thumbnail((SALIENCY_MAP_SIZE, SALIENCY_MAP_SIZE))
+    edges = small.filter(ImageFilter.FIND_EDGES)
+    # The filter treats the image border as an edge; blank it out.
+    ImageDraw.Draw(edges).rectangle((0, 0, edges.width - 1, edges.height - 1), outline=0)
+    # Averaging the edge map down to a single row (or column) gives the profile.
+    strip = edges.resize((edges.width, 1) if horizontal else (1, edges.height), Image.BOX)
+    return [float(value) for value in strip.getdata()]
+
+def _best_window(profile: List[float], window: int) -> Tuple[int, float]:
+    """
+    Start index of the window with the most detail, and the share of the
+    total detail it keeps (1.0 for an image without any). Ties, such as flat
+    areas, are broken towards the centre.
+    """
+    count = len(profile)
+    centre = (count - window) / 2
+    best_start, best_score, best_sum = 0, None, 0.0
+    current = sum(profile[:window])
+    for start in range(count - window + 1):
+        if start:
+            current += profile[start + window - 1] - profile[start - 1]
+        score = (round(current, 6), -abs(start - centre))
+        if best_score is None or score > best_score:
+            best_start, best_score, best_sum = start, score, current
+    total = sum(profile)
+    return best_start, (best_sum / total) if total else 1.0
+
+def _edge_colour(image: Image.Image, side: str) -> Tuple[Tuple[int, int, int], float]:
+    """Average colour of a thin strip along one side of the image, and how much it varies."""
+    width, height = image.size
+    strip_size = max(1, min(width, height) // 50)
+    boxes = {
+        "left": (0, 0, strip_size, height),
+        "right": (width - strip_size, 0, width, height),
+        "top": (0, 0, width, strip_size),
+        "bottom": (0, height - strip_size, width, height),
+    }
+    stat = ImageStat.Stat(image.crop(boxes[side]).convert("RGB"))
+    return tuple(int(round(c)) for c in stat.mean), max(stat.stddev)
+
+def _fill_colour(image: Image.Image, sides: Tuple[str, str], brand_colors: List[str]) -> Tuple[int, int, int]:
+    """
+    Colour used to extend the image past 'sides'. A near-uniform edge is
+    continued with its own colour; otherwise the first brand colour Pillow
+    understands is used, falling back to the edges' average colour.
+    """
+    edges = [_edge_colour(image, side) for side in sides]
+    average = tuple(sum(colour[i] for colour, _ in edges) // len(edges) for i in range(3))
+    if all(stddev <= UNIFORM_EDGE_STDDEV for _, stddev in edges):
+        return average
+    for name in brand_colors:
+        try:
+            return ImageColor.getrgb(name.strip())[:3]
+        except ValueError:
+            continue
+    return average
+
+def derive_aspect_ratio(master_bytes: bytes, target_size: Tuple[int, int], brand_colors: List[str]) -> Dict:
+    """
+    Cuts a creative of target_size out of the master: the most detailed window
+    is kept when cropping, at most DERIVE_MAX_CROP of the master is cropped
+    away, and any remaining difference is padded with a brand or edge colour.
+
+    Returns {"data" (PNG bytes), "saliency_retained", "padding", "passed"},
+    where passed is the outcome of the quality check.
+    """
+    master = ImageOps.exif_transpose(Image.open(io.BytesIO(master_bytes)))
+    master = master.convert("RGB")
+    master_w, master_h = master.size
+    target_w, target_h = target_size
+    target_ratio = target_w / target_h
+    horizontal = target_ratio < master_w / master_h
+
+    if horizontal:
+        # Target is narrower: crop columns, then pad top and bottom if needed.
+        crop_w = max(round(master_h * target_ratio), round(master_w * (1 - DERIVE_MAX_CROP)))
+        profile = _saliency_profile(master, horizontal=True)
+        window = max(1, round(len(profile) * crop_w / master_w))
+        start, retained = _best_window(profile, window)
+        left = min(master_w - crop_w, round(start * master_w / len(profile)))
+        cropped = master.crop((left, 0, left + crop_w, master_h))
+        canvas_size = (crop_w, max(master_h, round(crop_w / target_ratio)))
+        pad_sides = ("top", "bottom")
+    else:
+        # Target is wider (or the same shape): crop rows, then pad left and right if needed.
+        crop_h = max(round(master_w / target_ratio), round(master_h * (1 - DERIVE_MAX_CROP)))
+        profile = _saliency_profile(master, horizontal=False)
+        window = max(1, round(len(profile) * crop_h / master_h))
+        start, retained = _best_window(profile, window)
+        top = min(master_h - crop_h, round(start * master_h / len(profile)))
+        cropped = master.crop((0, top, master_w, top + crop_h))
+        canvas_size = (max(master_w, round(crop_h * target_ratio)), crop_h)
+        pad_sides = ("left", "right")
+
+    if canvas_size != cropped.size:
+        canvas = Image.new("RGB", canvas_size, _fill_colour(cropped, pad_sides, brand_colors))
+        canvas.paste(cropped, ((canvas_size[0] - cropped.width) // 2, (canvas_size[1] - cropped.height) // 2))
+    else:
+        canvas = cropped
+    padding = 1 - (cropped.width * cropped.height) / (canvas_size[0] * canvas_size[1])
+
+    derived = canvas.resize(target_size, Image.LANCZOS)
+    return {
+        "data": encode_intermediate(derived),
+        "saliency_retained": round(retained, 3),
+        "padding": round(padding, 3),
+        "passed": retained >= DERIVE_MIN_SALIENCY and padding <= DERIVE_MAX_PADDING,
+    }
+
+def master_aspect_ratio(aspect_ratios: List[str]) -> Optional[str]:
+    """The ratio to generate with the model in derive mode."""
+    if DERIVE_MASTER_ASPECT_RATIO in aspect_ratios:
+        return DERIVE_MASTER_ASPECT_RATIO
+    return aspect_ratios[0] if aspect_ratios else None
@@ -1,5 +1,6 @@
 import dropbox
 import os
+import time
 import logging
 import webbrowser
 import requests
@@ -7,19 +8,62 @@ import secrets
 import hashlib
 import base64
 from dotenv import load_dotenv, find_dotenv, set_key
-from typing import Dict, List
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+from campaign_catalog import CampaignCatalog, CATALOG_DB_PATH, CATALOG_LONGPOLL
+from generation_cache import GenerationCache
+from resilience import call_with_resilience, DROPBOX_TIMEOUT
+from telemetry import span, submit_in_context, BYTES_TOTAL
+
+# Size of the pooled HTTP connection pool shared by all requests using this client.
+DROPBOX_MAX_CONNECTIONS = int(os.getenv("DROPBOX_MAX_CONNECTIONS", "16"))
+THUMBNAIL_CACHE_DIR = os.getenv("THUMBNAIL_CACHE_DIR", os.path.join("cache", "thumbnails"))
+THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv("THUMBNAIL_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+# Upload sessions send files in chunks of this size (Dropbox takes at most 150 MB per call).
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+# files_upload_session_finish_batch accepts at most this many files per call.
+MAX_FINISH_BATCH = 1000
+THUMBNAIL_SIZES = ("w64h64", "w128h128", "w256h256", "w480h320", "w640h480", "w960h640", "w1024h768")
+
+class CatalogUnavailableError(Exception):
+    """Raised by queries that need the campaign catalog when it is disabled."""
+    pass
 
 class DropboxHelper:
-    def __init__(self, app_key, app_secret, refresh_token):
+    def __init__(self, app_key, app_secret, refresh_token, max_connections: int = DROPBOX_MAX_CONNECTIONS,
+                 catalog_db_path: Optional[str] = CATALOG_DB_PATH):
+        # No network calls here: the SDK refreshes the short-lived access token
+        # from the refresh token on the first request and whenever it expires.
         try:
-            self.dbx = dropbox.Dropbox(app_key=app_key, app_secret=app_secret, oauth2_refresh_token=refresh_token)
-            self.dbx.users_get_current_account()
-            logging.info("Dropbox client authenticated.")
+            session = dropbox.create_session(max_connections=max_connections)
+            self.dbx = dropbox.Dropbox(app_key=app_key, app_secret=app_secret, oauth2_refresh_token=refresh_token,
+                                       session=session, timeout=DROPBOX_TIMEOUT)
+            logging.info("Dropbox client created.")
         except Exception as e:
             logging.error(f"Failed to initialize Dropbox client: {e}")
             raise
+        # Local mirror of campaigns and share links; None disables it (every call goes to Dropbox).
+        self.catalog = CampaignCatalog(self.dbx, catalog_db_path) if catalog_db_path else None
+        if self.catalog and CATALOG_LONGPOLL:
+            self.catalog.start_longpoll()
+        # Thumbnails are immutable per file revision, so they are cached on disk
+        # and reused across gallery views.
+        self.thumbnail_cache = GenerationCache(THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_BYTES)
+        self.max_connections = max_connections
+        # Folders this client has already created, so each is only requested once.
+        self._known_folders = set()
+
+    def check_health(self) -> bool:
+        """Readiness probe: verifies the credentials by fetching the current account."""
+        self.dbx.users_get_current_account()
+        return True
 
     def folder_exists(self, path: str) -> bool:
+        if self.catalog:
+            # One incremental list_folder/continue call instead of a probe per folder.
+            self.catalog.sync()
+            return self.catalog.campaign_exists(path)
         try:
             self.dbx.files_list_folder(path, limit=1)
             return True
@@ -28,64 +72,205 @@ class DropboxHelper:
                 return False
             raise err
 
-    def upload_file(self, file_path, dropbox_path):
+    def upload_bytes(self, data: bytes, dropbox_path):
+        """
+        Uploads an in-memory file and returns its shareable link. Transient
+        failures are retried (see resilience.call_with_resilience); anything
+        still failing afterwards is raised so the caller can record why.
+        Files larger than UPLOAD_CHUNK_SIZE go through an upload session.
+        """
+        if len(data) > UPLOAD_CHUNK_SIZE:
+            outcome = self.commit_uploads([self.start_upload(data, dropbox_path)])[dropbox_path]
+            if outcome["error"]:
+                raise RuntimeError(outcome["error"])
+            return outcome["url"]
+        with span("dropbox_upload", bytes=len(data)):
+            call_with_resilience(
+                "dropbox", "dropbox_upload", self.dbx.files_upload,
+                data, dropbox_path, mode=dropbox.files.WriteMode('overwrite'),
+            )
+        BYTES_TOTAL.labels("dropbox_out").inc(len(data))
+        shareable_link = self._get_shareable_link(dropbox_path)
+        if self.catalog:
+            self.catalog.record_asset(dropbox_path, shareable_link, len(data))
+        return shareable_link
+
+    def start_upload(self, data: bytes, dropbox_path: str) -> dropbox.files.UploadSessionFinishArg:
+        """
+        Sends a file to Dropbox in an upload session, UPLOAD_CHUNK_SIZE bytes per
+        call, without committing it. Returns the finish entry to pass to
+        commit_uploads. Raises if the upload still fails after retries.
+        """
+        size = len(data)
+        with span("dropbox_upload", bytes=size):
+            session = call_with_resilience(
+                "dropbox", "dropbox_upload", self.dbx.files_upload_session_start,
+                data[:UPLOAD_CHUNK_SIZE], close=size <= UPLOAD_CHUNK_SIZE,
+            )
+            offset = min(size, UPLOAD_CHUNK_SIZE)
+            while offset < size:
+                chunk = data[offset:offset + UPLOAD_CHUNK_SIZE]
+                cursor = dropbox.files.UploadSessionCursor(session_id=session.session_id, offset=offset)
+                call_with_resilience(
+                    "dropbox", "dropbox_upload", self.dbx.files_upload_session_append_v2,
+                    chunk, cursor, close=offset + len(chunk) >= size,
+                )
+                offset += len(chunk)
+        BYTES_TOTAL.labels("dropbox_out").inc(size)
+        return dropbox.files.UploadSessionFinishArg(
+            cursor=dropbox.files.UploadSessionCursor(session_id=session.session_id, offset=size),
+            commit=dropbox.files.CommitInfo(path=dropbox_path, mode=dropbox.files.WriteMode('overwrite')),
+        )
+
+    def create_folders(self, paths: Iterable[str]):
+        """
+        Creates every folder in 'paths' that this client hasn't created yet, in
+        one batch call. Folders that already exist are fine. Failures are only
+        logged: committing files creates their parent folders anyway.
+        """
+        folders = sorted({path for path in paths if path and path != "/"} - self._known_folders)
+        if not folders:
+            return
         try:
-            with open(file_path, "rb") as f:
-                self.dbx.files_upload(f.read(), dropbox_path, mode=dropbox.files.WriteMode('overwrite'))
-            return self._get_shareable_link(dropbox_path)
+            with span("dropbox_create_folders", folders=len(folders)):
+                launch = call_with_resilience(
+                    "dropbox", "dropbox_create_folders", self.dbx.files_create_folder_batch, folders, autorename=False,
+                )
+                if launch.is_async_job_id():
+                    job_id = launch.get_async_job_id()
+                    while call_with_resilience(
+                        "dropbox", "dropbox_create_folders", self.dbx.files_create_folder_batch_check, job_id,
+                    ).is_in_progress():
+                        time.sleep(0.2)
+            self._known_folders.update(folders)
         except Exception as e:
-            logging.error(f"An unexpected error occurred during Dropbox upload: {e}")
-            return None
+            logging.warning(f"Could not create folders up front, leaving it to the upload commit: {e}")
+
+    def commit_uploads(self, entries: List[dropbox.files.UploadSessionFinishArg]) -> Dict[str, Dict[str, Optional[str]]]:
+        """
+        Commits uploads started with start_upload: their folders are created
+        first in one call, the files are committed MAX_FINISH_BATCH at a time
+        with files_upload_session_finish_batch_v2, and share links are then
+        created concurrently. Returns {path: {"url", "error"}} for every entry.
+        """
+        self.create_folders(posixpath.dirname(entry.commit.path) for entry in entries)
+        outcomes: Dict[str, Dict[str, Optional[str]]] = {}
+        committed = []
+        for start in range(0, len(entries), MAX_FINISH_BATCH):
+            batch = entries[start:start + MAX_FINISH_BATCH]
+            try:
+                with span("dropbox_commit", files=len(batch)):
+                    result = call_with_resilience(
+                        "dropbox", "dropbox_commit", self.dbx.files_upload_session_finish_batch_v2, batch,
+                    )
+            except Exception as e:
+                logging.error(f"Committing {len(batch)} uploads failed: {e}")
+                outcomes.update({entry.commit.path: {"url": None, "error": f"Upload to Dropbox failed: {e}"} for entry in batch})
+                continue
+            for entry, outcome in zip(batch, result.entries):
+                if outcome.is_success():
+                    committed.append((entry.commit.path, outcome.get_success().size))
+                else:
+                    outcomes[entry.commit.path] = {"url": None, "error": f"Upload to Dropbox failed: {outcome.get_failure()}"}
+
+        def link(path: str, size: int):
+            try:
+                url = self._create_shareable_link(path)
+            except Exception as e:
+                logging.error(f"Share link creation for {path} failed: {e}")
+                outcomes[path] = {"url": None, "error": f"Share link creation failed: {e}"}
+                return
+            outcomes[path] = {"url": url, "error": None}
+            if self.catalog:
+                self.catalog.record_asset(path, url, size)
+
+        if committed:
+            with ThreadPoolExecutor(max_workers=min(len(committed), self.max_connections)) as executor:
+                for future in [submit_in_context(executor, link, path, size) for path, size in committed]:
+                    future.result()
+        return outcomes
+
+    def _create_shareable_link(self, dropbox_path):
+        """
+        Link for a file that was just uploaded: it can't have one yet, so the
+        link is created straight away instead of listing existing links first.
+        """
+        with span("dropbox_share_link"):
+            settings = dropbox.sharing.SharedLinkSettings(requested_visibility=dropbox.sharing.RequestedVisibility.public)
+            try:
+                shared_link = call_with_resilience(
+                    "dropbox", "dropbox_share_link", self.dbx.sharing_create_shared_link_with_settings,
+                    path=dropbox_path, settings=settings,
+                )
+            except dropbox.exceptions.ApiError as err:
+                if isinstance(err.error, dropbox.sharing.CreateSharedLinkWithSettingsError) and err.error.is_shared_link_already_exists():
+                    return self._lookup_shareable_link(dropbox_path)
+                raise
+            return shared_link.url.replace("dl=0", "raw=1")
 
     def _get_shareable_link(self, dropbox_path):
+        with span("dropbox_share_link"):
+            return self._lookup_shareable_link(dropbox_path)
+
+    def _lookup_shareable_link(self, dropbox_path):
+        links = call_with_resilience(
+            "dropbox", "dropbox_share_link", self.dbx.sharing_list_shared_links,
+            path=dropbox_path, direct_only=True,
+        ).links
+        if links:
+            return links[0].url.replace("dl=0", "raw=1")
+        settings = dropbox.sharing.SharedLinkSettings(requested_visibility=dropbox.sharing.RequestedVisibility.public)
+        shared_link = call_with_resilience(
+            "dropbox", "dropbox_share_link", self.dbx.sharing_create_shared_link_with_settings,
+            path=dropbox_path, settings=settings,
+        )
+        return shared_link.url.replace("dl=0", "raw=1")
+
+    def _require_catalog(self) -> CampaignCatalog:
+        if not self.catalog:
+            raise CatalogUnavailableError("The campaign catalog is disabled.")
         try:
-            links = self.dbx.sharing_list_shared_links(path=dropbox_path, direct_only=True).links
-            if links:
-                return links[0].url.replace("dl=0", "raw=1")
-            else:
-                settings = dropbox.sharing.SharedLinkSettings(requested_visibility=dropbox.sharing.RequestedVisibility.public)
-                shared_link = self.dbx.sharing_create_shared_link_with_settings(path=dropbox_path, settings=settings)
-                return shared_link.url.replace("dl=0", "raw=1")
+            self.catalog.sync_if_stale()
         except Exception as e:
-            logging.error(f"An unexpected error during shareable link retrieval for {dropbox_path}: {e}")
+            logging.error(f"Campaign catalog sync failed, serving cached data: {e}")
+        return self.catalog
+
+    def query_campaigns(self, **filters):
+        """Paginated, filtered campaign listing. See CampaignCatalog.query_campaigns."""
+        return self._require_catalog().query_campaigns(**filters)
+
+    def get_thumbnail(self, dropbox_path: str, size: str = "w256h256") -> Optional[bytes]:
+        """
+        Returns a JPEG thumbnail rendered by Dropbox, or None if the asset is not
+        in the catalog. Renditions are cached per path, modification time and size.
+        """
+        asset = self._require_catalog().get_asset(dropbox_path)
+        if not asset:
             return None
+        cache_key = hashlib.sha256(f"{asset['path'].lower()}|{asset['modified']}|{size}".encode("utf-8")).hexdigest()
+        cached = self.thumbnail_cache.get(cache_key)
+        if cached:
+            data, _ = cached
+        else:
+            _, response = self.dbx.files_get_thumbnail(
+                asset['path'],
+                format=dropbox.files.ThumbnailFormat.jpeg,
+                size=getattr(dropbox.files.ThumbnailSize, size),
+            )
+            data = response.content
+            self.thumbnail_cache.put(cache_key, data, "image/jpeg")
+        return data
+
+def create_dropbox_helper() -> Optional[DropboxHelper]:
+    """Builds a DropboxHelper from the DROPBOX_* environment variables, or None if they are missing."""
+    dropbox_app_key = os.getenv("DROPBOX_APP_KEY")
+    dropbox_app_secret = os.getenv("DROPBOX_APP_SECRET")
+    dropbox_refresh_token = os.getenv("DROPBOX_REFRESH_TOKEN")
+    if not all([dropbox_app_key, dropbox_app_secret, dropbox_refresh_token]):
+        logging.error("Dropbox environment variables are not configured.")
+        return None
+    return DropboxHelper(app_key=dropbox_app_key, app_secret=dropbox_app_secret, refresh_token=dropbox_refresh_token)
 
-    def list_campaign_assets(self) -> dict:
-        logging.info("Fetching all campaign assets from Dropbox...")
-        campaigns = {}
-        try:
-            # Recursively find all items in the root folder
-            result = self.dbx.files_list_folder("", recursive=True)
-            # Filter to get only the files, not folders
-            files_metadata = [entry for entry in result.entries if isinstance(entry, dropbox.files.FileMetadata)]
-
-            if not files_metadata:
-                logging.info("No campaign files found in Dropbox.")
-                return {}
-
-            # Process each file one by one
-            for entry in files_metadata:
-                path_parts = entry.path_display.strip('/').split('/')
-                if not path_parts: continue
-                
-                campaign_name = path_parts[0].replace('_', ' ')
-                if campaign_name not in campaigns:
-                    campaigns[campaign_name] = []
-                
-                # Get the shareable link for this specific file
-                image_url = self._get_shareable_link(entry.path_display)
-
-                if image_url:
-                    campaigns[campaign_name].append({
-                        "url": image_url,
-                        "filename": entry.name
-                    })
-
-            logging.info(f"Successfully found and organized {len(campaigns)} campaigns.")
-            return campaigns
-        except Exception as e:
-            logging.error(f"A critical error occurred while listing campaign assets: {e}")
-            return {}
 if __name__ == "__main__":
     print("--- Dropbox Refresh Token Generator (PKCE Secure Flow) ---")
 
@@ -0,0 +1,141 @@
+import io
+import os
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+from PIL import Image
+
+# Formats every creative is exported in, in order; the first is the primary
+# asset whose link is returned to the client. Supported: png, webp, jpeg.
+OUTPUT_FORMATS = [f.strip().lower() for f in os.getenv("OUTPUT_FORMATS", "png").split(",") if f.strip()]
+# Widths, in pixels, of extra downscaled renditions exported alongside the full-size creative.
+RENDITION_WIDTHS = sorted({int(w) for w in os.getenv("RENDITION_WIDTHS", "").split(",") if w.strip()}, reverse=True)
+# Worker processes used for encoding, so it neither blocks the event loop nor holds the GIL.
+EXPORT_PROCESSES = int(os.getenv("EXPORT_PROCESSES", str(min(4, os.cpu_count() or 1))))
+JPEG_QUALITY = int(os.getenv("JPEG_QUALITY", "88"))
+WEBP_QUALITY = int(os.getenv("WEBP_QUALITY", "85"))
+
+# format name -> (Pillow format, content type, file extension)
+FORMATS = {
+    "png": ("PNG", "image/png", "png"),
+    "webp": ("WEBP", "image/webp", "webp"),
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+    "jpg": ("JPEG", "image/jpeg", "jpg"),
+}
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def _encode(image: Image.Image, image_format: str) -> bytes:
+    buffer = io.BytesIO()
+    if image_format == "PNG":
+        image.save(buffer, format="PNG", optimize=True)
+    elif image_format == "WEBP":
+        image.save(buffer, format="WEBP", quality=WEBP_QUALITY, method=4)
+    else:
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.save(buffer, format="JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+def encode_intermediate(image: Image.Image) -> bytes:
+    """
+    PNG for images made locally between generation and export (derived
+    ratios, text overlays). The export stage decodes and re-encodes them in
+    every output format anyway, so this favours speed over size.
+    """
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+def encode_renditions(image_bytes: bytes, formats: List[str], widths: List[int]) -> List[Dict]:
+    """
+    Decodes the model's raw image once and encodes it in every format, at full
+    size and at each width in 'widths' narrower than the image. Runs in a
+    worker process. Returns one entry per file, full size first:
+    {"format", "rendition", "width", "height", "content_type", "extension", "data", "bytes", "encode_s"}.
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    image.load()
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+
+    sizes = [("full", image)]
+    for width in widths:
+        if width < image.width:
+            height = max(1, round(image.height * width / image.width))
+            sizes.append((f"w{width}", image.resize((width, height), Image.LANCZOS)))
+
+    outputs = []
+    for rendition, sized_image in sizes:
+        for name in formats:
+            image_format, content_type, extension = FORMATS[name]
+            start_time = time.perf_counter()
+            data = _encode(sized_image, image_format)
+            outputs.append({
+                "format": name,
+                "rendition": rendition,
+                "width": sized_image.width,
+                "height": sized_image.height,
+                "content_type": content_type,
+                "extension": extension,
+                "data": data,
+                "bytes": len(data),
+                "encode_s": round(time.perf_counter() - start_time, 3),
+            })
+    return outputs
+
+def output_formats() -> List[str]:
+    """OUTPUT_FORMATS with unknown entries dropped; falls back to PNG if nothing usable is left."""
+    formats = []
+    for name in OUTPUT_FORMATS:
+        if name not in FORMATS:
+            logging.warning(f"Ignoring unsupported output format '{name}'.")
+        elif name not in formats:
+            formats.append(name)
+    return formats or ["png"]
+
+def get_export_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # 'spawn' keeps the workers clear of the locks held by the server's threads at fork time.
+            _pool = ProcessPoolExecutor(max_workers=EXPORT_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def shutdown_export_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+def _discard_broken_pool(pool: ProcessPoolExecutor):
+    """Drops 'pool' if it is still the current one, so the next get_export_pool() starts a fresh pool."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def export_creative(image_bytes: bytes) -> List[Dict]:
+    """
+    Encodes a generated creative in every configured format and rendition on
+    the export process pool, blocking the calling thread (not the process)
+    until it is done. The primary output (first format, full size) comes first.
+    If a worker died (OOM kill, crash in an encoder), the broken pool is
+    replaced and the export retried once.
+    """
+    for attempt in range(2):
+        pool = get_export_pool()
+        try:
+            return pool.submit(encode_renditions, image_bytes, output_formats(), RENDITION_WIDTHS).result()
+        except BrokenProcessPool:
+            if attempt:
+                raise
+            logging.warning("An export worker died; restarting the export pool and retrying.")
+            _discard_broken_pool(pool)
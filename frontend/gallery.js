@@ -1,60 +1,103 @@
-document.addEventListener('DOMContentLoaded', async () => {
+document.addEventListener('DOMContentLoaded', () => {
     const galleryContainer = document.getElementById('gallery-container');
     const loadingMessage = document.getElementById('loading-message');
+    const filterForm = document.getElementById('filter-form');
+    const loadMoreContainer = document.getElementById('load-more-container');
+    const loadMoreBtn = document.getElementById('load-more-btn');
 
-    try {
-        const response = await fetch('/list-campaigns');
-        const campaigns = await response.json();
+    const PAGE_SIZE = 10;
+    let nextCursor = null;
 
-        if (!response.ok) {
-            throw new Error(campaigns.detail || 'Failed to fetch campaign data.');
-        }
+    function currentFilters() {
+        const filters = {
+            campaign: document.getElementById('filter-campaign').value.trim(),
+            aspect_ratio: document.getElementById('filter-aspect-ratio').value,
+            since: document.getElementById('filter-since').value,
+            until: document.getElementById('filter-until').value,
+        };
+        return Object.fromEntries(Object.entries(filters).filter(([, value]) => value));
+    }
 
-        loadingMessage.style.display = 'none';
+    function renderCampaign(campaign) {
+        const campaignSection = document.createElement('div');
+        campaignSection.className = 'mb-6';
 
-        if (Object.keys(campaigns).length === 0) {
-            galleryContainer.innerHTML = '<p class="has-text-centered is-size-4">No campaigns found. Go generate some creatives!</p>';
-            return;
-        }
+        const imageGrid = document.createElement('div');
+        imageGrid.className = 'image-gallery';
 
-        for (const campaignName in campaigns) {
-            const campaignSection = document.createElement('div');
-            campaignSection.className = 'mb-6';
-
-            const imageGrid = document.createElement('div');
-            imageGrid.className = 'image-gallery'; 
-            
-            campaigns[campaignName].forEach(asset => {
-                const card = document.createElement('div');
-                card.className = 'card';
-                card.innerHTML = `
-                    <div class="card-image">
-                        <figure class="image">
-                            <img src="${asset.url}" alt="${asset.filename}">
-                        </figure>
-                    </div>
-                    <footer class="card-footer">
-                        <a href="${asset.url.replace('raw=1', 'dl=1')}" class="card-footer-item button is-primary is-fullwidth download-button" download="${asset.filename}">
-                            <span class="icon is-small"><i class="fas fa-download"></i></span>
-                            <span>Download</span>
+        campaign.assets.forEach(asset => {
+            const card = document.createElement('div');
+            card.className = 'card';
+            // Only the thumbnail is loaded (lazily, as it scrolls into view);
+            // the full-size creative is fetched when the user opens or downloads it.
+            card.innerHTML = `
+                <header class="card-header"><p class="card-header-title is-centered">${asset.aspect_ratio || 'Creative'}</p></header>
+                <div class="card-image">
+                    <figure class="image">
+                        <a href="${asset.url}" target="_blank" rel="noopener" title="Open full size">
+                            <img src="${asset.thumbnail_url}" alt="${asset.filename}" loading="lazy" decoding="async">
                         </a>
-                    </footer>
-                `;
-                imageGrid.appendChild(card);
-            });
-
-            if (campaigns[campaignName].length > 0) {
-                 campaignSection.innerHTML = `
-                    <h2 class="title is-4 is-capitalized">${campaignName}</h2>
-                    <div class="is-divider" style="border-top: 1px solid #dbdbdb; height: 1px; margin: 1.5rem 0;"></div>
-                `;
-                campaignSection.appendChild(imageGrid);
-                galleryContainer.appendChild(campaignSection);
+                    </figure>
+                </div>
+                <footer class="card-footer">
+                    <a href="${asset.url.replace('raw=1', 'dl=1')}" class="card-footer-item button is-primary is-fullwidth download-button" download="${asset.filename}">
+                        <span class="icon is-small"><i class="fas fa-download"></i></span>
+                        <span>Download</span>
+                    </a>
+                </footer>
+            `;
+            imageGrid.appendChild(card);
+        });
+
+        campaignSection.innerHTML = `
+            <h2 class="title is-4 is-capitalized">${campaign.name}</h2>
+            <div class="is-divider" style="border-top: 1px solid #dbdbdb; height: 1px; margin: 1.5rem 0;"></div>
+        `;
+        campaignSection.appendChild(imageGrid);
+        galleryContainer.appendChild(campaignSection);
+    }
+
+    async function loadPage(reset) {
+        if (reset) {
+            nextCursor = null;
+            galleryContainer.querySelectorAll('.mb-6, .no-campaigns').forEach(el => el.remove());
+        }
+        loadMoreBtn.classList.add('is-loading');
+
+        try {
+            const params = new URLSearchParams({ limit: PAGE_SIZE, ...currentFilters() });
+            if (nextCursor) params.set('cursor', nextCursor);
+            const response = await fetch(`/list-campaigns?${params}`);
+            const page = await response.json();
+
+            if (!response.ok) {
+                throw new Error(page.detail || 'Failed to fetch campaign data.');
+            }
+
+            loadingMessage.style.display = 'none';
+
+            if (reset && page.campaigns.length === 0) {
+                galleryContainer.insertAdjacentHTML('beforeend', '<p class="has-text-centered is-size-4 no-campaigns">No campaigns found. Go generate some creatives!</p>');
             }
+            page.campaigns.forEach(renderCampaign);
+
+            nextCursor = page.next_cursor;
+            loadMoreContainer.style.display = nextCursor ? 'flex' : 'none';
+        } catch (error) {
+            loadingMessage.style.display = 'block';
+            loadingMessage.className = 'notification is-danger';
+            loadingMessage.innerHTML = `<strong>Error:</strong> ${error.message}`;
+            console.error('Error fetching campaigns:', error);
+        } finally {
+            loadMoreBtn.classList.remove('is-loading');
         }
-    } catch (error) {
-        loadingMessage.className = 'notification is-danger';
-        loadingMessage.innerHTML = `<strong>Error:</strong> ${error.message}`;
-        console.error('Error fetching campaigns:', error);
     }
-});
\ No newline at end of file
+
+    filterForm.addEventListener('submit', (e) => {
+        e.preventDefault();
+        loadPage(true);
+    });
+    loadMoreBtn.addEventListener('click', () => loadPage(false));
+
+    loadPage(true);
+});
@@ -122,6 +122,8 @@ document.addEventListener('DOMContentLoaded', () => {
             message: document.getElementById('message').value,
             brand_colors: brandColors,
             products: products,
+            force_regenerate: document.getElementById('force-regenerate').checked,
+            generation_mode: document.getElementById('derive-mode').checked ? 'derive' : 'generate',
         };
         
         const formData = new FormData();
@@ -137,46 +139,81 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         try {
-            const response = await fetch('/process-brief', { method: 'POST', body: formData });
-            const result = await response.json();
+            const response = await fetch('/jobs', { method: 'POST', body: formData });
+            const job = await response.json();
 
             if (!response.ok) {
-                throw new Error(result.detail || 'An unknown error occurred.');
-            }
-            
-            if (result.image_urls && result.image_urls.length > 0) {
-                result.image_urls.forEach(url => {
-                    const card = document.createElement('div');
-                    card.className = 'card';
-                    const filename = new URL(url).pathname.split('/').pop();
-                    const prettyFilename = decodeURIComponent(filename);
-                    const match = prettyFilename.match(/_(\d+x\d+)_/);
-                    const aspectRatioLabel = match ? match[1].replace('x', ':') : 'Creative';
-                    
-                    card.innerHTML = `
-                        <header class="card-header"><p class="card-header-title is-centered">${aspectRatioLabel}</p></header>
-                        <div class="card-image"><figure class="image"><img src="${url}" alt="Generated Creative"></figure></div>
-                        <footer class="card-footer">
-                            <a href="${url.replace('raw=1', 'dl=1')}" class="card-footer-item button is-primary is-fullwidth download-button" download="${prettyFilename}">
-                                <span class="icon is-small"><i class="fas fa-download"></i></span>
-                                <span>Download</span>
-                            </a>
-                        </footer>
-                    `;
-                    imageGallery.appendChild(card);
-                });
-                showNotification('Assets generated and uploaded successfully!', 'is-success');
-            } else {
-                showNotification(result.message || 'No images were generated for this brief.', 'is-warning');
+                throw new Error(job.detail || 'An unknown error occurred.');
             }
+
+            showNotification(`Generating ${job.total_variants} creatives. They will appear below as they finish.`, 'is-info');
+            followJob(job);
         } catch (error) {
             console.error('Error:', error);
             showNotification(`An error occurred: ${error.message}`, 'is-danger');
-        } finally {
             submitBtn.classList.remove('is-loading');
         }
     });
 
+    // Streams the job's progress and renders each creative as soon as it is uploaded.
+    function followJob(job) {
+        const events = new EventSource(job.events_url);
+        let createdCount = 0;
+
+        events.addEventListener('variant', (e) => {
+            const variant = JSON.parse(e.data);
+            if (variant.url) {
+                addCreativeCard(variant);
+                createdCount++;
+            } else {
+                showNotification(`Could not generate '${variant.product}' (${variant.aspect_ratio}): ${variant.error}`, 'is-warning');
+            }
+        });
+        events.addEventListener('completed', () => {
+            events.close();
+            submitBtn.classList.remove('is-loading');
+            if (createdCount > 0) {
+                showNotification('Assets generated and uploaded successfully!', 'is-success');
+            } else {
+                showNotification('No images were generated for this brief.', 'is-warning');
+            }
+        });
+        events.addEventListener('failed', (e) => {
+            events.close();
+            submitBtn.classList.remove('is-loading');
+            const data = JSON.parse(e.data);
+            showNotification(`An error occurred: ${data.error}`, 'is-danger');
+        });
+        events.onerror = () => {
+            // The browser reconnects automatically; only give up once the stream is closed for good.
+            if (events.readyState === EventSource.CLOSED) {
+                submitBtn.classList.remove('is-loading');
+                showNotification('Lost connection to the job progress stream.', 'is-danger');
+            }
+        };
+    }
+
+    function addCreativeCard(variant) {
+        const url = variant.url;
+        const card = document.createElement('div');
+        card.className = 'card';
+        const filename = new URL(url, window.location.href).pathname.split('/').pop();
+        const prettyFilename = decodeURIComponent(filename);
+        const aspectRatioLabel = variant.aspect_ratio || 'Creative';
+
+        card.innerHTML = `
+            <header class="card-header"><p class="card-header-title is-centered">${variant.product} · ${aspectRatioLabel}</p></header>
+            <div class="card-image"><figure class="image"><img src="${url}" alt="Generated Creative"></figure></div>
+            <footer class="card-footer">
+                <a href="${url.replace('raw=1', 'dl=1')}" class="card-footer-item button is-primary is-fullwidth download-button" download="${prettyFilename}">
+                    <span class="icon is-small"><i class="fas fa-download"></i></span>
+                    <span>Download</span>
+                </a>
+            </footer>
+        `;
+        imageGallery.appendChild(card);
+    }
+
     function showNotification(message, type) {
         const notification = document.createElement('div');
         notification.className = `notification ${type}`;
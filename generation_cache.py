@@ -0,0 +1,137 @@
+import os
+import logging
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+GENERATION_CACHE_DIR = os.getenv("GENERATION_CACHE_DIR", os.path.join("cache", "generations"))
+# Total size of cached creatives before the least recently used ones are evicted.
+GENERATION_CACHE_MAX_BYTES = int(os.getenv("GENERATION_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Entries are stored under the extension of their MIME type, so the type
+# survives restarts and is returned on a hit.
+CONTENT_TYPE_EXTENSIONS = {"image/png": ".png", "image/jpeg": ".jpg", "image/webp": ".webp", "image/gif": ".gif"}
+CONTENT_TYPES = {extension: content_type for content_type, extension in CONTENT_TYPE_EXTENSIONS.items()}
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
+
+class GenerationCache:
+    """
+    Content-addressed, on-disk store of generated creatives. Entries are keyed
+    on everything that determines the model's output, so resubmitting an
+    unchanged product/ratio reuses the earlier image instead of calling Gemini.
+    Each entry keeps its MIME type. The store is capped at max_bytes and
+    evicts least recently used entries.
+    """
+
+    def __init__(self, cache_dir: str = GENERATION_CACHE_DIR, max_bytes: int = GENERATION_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # key -> (size, file extension)
+        self._entries: "OrderedDict[str, Tuple[int, str]]" = OrderedDict()
+        self._total_bytes = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def make_key(prompt: str, base_image_bytes: List[bytes], dims: Tuple[int, int], model_name: str) -> str:
+        """Hashes the generation inputs. Each field is length-prefixed so boundaries can't collide."""
+        digest = hashlib.sha256()
+        fields = [prompt.encode("utf-8"), *base_image_bytes, f"{dims[0]}x{dims[1]}".encode(), (model_name or "").encode()]
+        for field in fields:
+            digest.update(len(field).to_bytes(8, "big"))
+            digest.update(field)
+        return digest.hexdigest()
+
+    def _path(self, key: str, extension: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}{extension}")
+
+    def _load_index(self):
+        # Rebuild LRU order from file modification times, which get() refreshes on every hit.
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            key, extension = os.path.splitext(name)
+            if extension == ".tmp" or not extension:
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, name))
+            entries.append((stat.st_mtime, key, extension, stat.st_size))
+        for _, key, extension, size in sorted(entries):
+            self._entries[key] = (size, extension)
+            self._total_bytes += size
+        logging.info(f"Generation cache loaded {len(self._entries)} entries ({self._total_bytes} bytes) from '{self.cache_dir}'.")
+
+    def get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        """The entry's (bytes, MIME type), or None on a miss."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            size, extension = self._entries[key]
+            path = self._path(key, extension)
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                os.utime(path)
+            except OSError as e:
+                logging.warning(f"Generation cache entry {key} is unreadable, dropping it: {e}")
+                del self._entries[key]
+                self._total_bytes -= size
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return data, CONTENT_TYPES.get(extension, DEFAULT_CONTENT_TYPE)
+
+    def put(self, key: str, data: bytes, content_type: str = DEFAULT_CONTENT_TYPE):
+        if self.max_bytes <= 0 or len(data) > self.max_bytes:
+            return
+        extension = CONTENT_TYPE_EXTENSIONS.get(content_type, ".bin")
+        with self._lock:
+            # Write to a temp file and rename, so readers never see a partial entry.
+            path = self._path(key, extension)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logging.warning(f"Could not write generation cache entry {key}: {e}")
+                return
+            if key in self._entries:
+                old_size, old_extension = self._entries[key]
+                self._total_bytes -= old_size
+                if old_extension != extension:
+                    self._remove(key, old_extension)
+            self._entries[key] = (len(data), extension)
+            self._entries.move_to_end(key)
+            self._total_bytes += len(data)
+            self._evict()
+
+    def _remove(self, key: str, extension: str):
+        try:
+            os.remove(self._path(key, extension))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, (size, extension) = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            self._remove(key, extension)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
@@ -0,0 +1,54 @@
+import io
+import os
+import hashlib
+from PIL import Image, ImageOps
+from typing import Dict
+
+# Uploaded base images larger than this are rejected (requests that can't fit
+# two of them are turned away before they are received, see main.py).
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+# Longest side, in pixels, of a base image after preprocessing. The model does
+# not benefit from larger inputs, they only make every request bigger.
+BASE_IMAGE_MAX_SIDE = int(os.getenv("BASE_IMAGE_MAX_SIDE", "1024"))
+BASE_IMAGE_JPEG_QUALITY = 90
+
+class ImagePreparationError(ValueError):
+    """Raised when an uploaded base image cannot be decoded."""
+    pass
+
+def prepare_image(image_bytes: bytes, max_side: int = BASE_IMAGE_MAX_SIDE) -> Dict:
+    """
+    Decodes an uploaded image once and returns a compact payload ready to be
+    sent to the model: EXIF rotation applied, downscaled so its longest side is
+    at most max_side, and re-encoded as JPEG (or PNG when it has transparency).
+
+    Returns {"digest", "mime_type", "data", "size"}, where digest is the SHA-256
+    of the original bytes, so callers can key caches on the upload's content.
+    """
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        # For JPEGs this lets the decoder downscale by up to 8x while decoding.
+        image.draft("RGB", (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    except Exception as e:
+        raise ImagePreparationError(f"Could not decode image: {e}")
+
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+    image = image.convert("RGBA" if has_alpha else "RGB")
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    if has_alpha:
+        image.save(buffer, format="PNG", optimize=True)
+        mime_type = "image/png"
+    else:
+        image.save(buffer, format="JPEG", quality=BASE_IMAGE_JPEG_QUALITY, optimize=True)
+        mime_type = "image/jpeg"
+
+    return {
+        "digest": hashlib.sha256(image_bytes).hexdigest(),
+        "mime_type": mime_type,
+        "data": buffer.getvalue(),
+        "size": image.size,
+    }
@@ -0,0 +1,235 @@
+import os
+import json
+import socket
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from models import CampaignBrief
+
+JOURNAL_DB_PATH = os.getenv("JOURNAL_DB_PATH", os.path.join("cache", "journal.sqlite3"))
+# Prepared base images of journaled campaigns, stored once per digest so a
+# resumed run sends the model exactly what the first run sent.
+JOURNAL_BASE_IMAGE_DIR = os.getenv("JOURNAL_BASE_IMAGE_DIR", os.path.join("cache", "journal_base_images"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    campaign_folder TEXT PRIMARY KEY,
+    folder_display TEXT NOT NULL,
+    campaign_name TEXT NOT NULL,
+    brief TEXT NOT NULL,
+    base_images TEXT NOT NULL,
+    status TEXT NOT NULL,
+    owner TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS variants (
+    campaign_folder TEXT NOT NULL,
+    product TEXT NOT NULL,
+    aspect_ratio TEXT NOT NULL,
+    locale TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    url TEXT,
+    summary TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (campaign_folder, product, aspect_ratio, locale)
+);
+"""
+
+# (product, aspect ratio, locale); locale is None outside text overlay mode.
+VariantKey = Tuple[str, str, Optional[str]]
+
+_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+def _folder_key(campaign_folder: str) -> str:
+    """'/Summer_Launch' or 'Summer_Launch' -> 'summer_launch'."""
+    return campaign_folder.strip('/').lower()
+
+def _now() -> str:
+    return datetime.utcnow().isoformat(timespec="seconds")
+
+def _owner_alive(owner: Optional[str]) -> bool:
+    """Whether the process that owns a running campaign still exists. Owners on other hosts are assumed alive."""
+    if not owner:
+        return False
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    return True
+
+def pending_summary(key: VariantKey, error: str = "Not generated yet.") -> Dict:
+    """Variant summary (see pipeline.variant_summary) for a variant without an outcome."""
+    product, aspect_ratio, locale = key
+    return {
+        "product": product, "aspect_ratio": aspect_ratio, "duration_s": None, "cache_hit": False, "mode": None,
+        "locale": locale, "quality": None, "url": None, "error": error, "exports": [],
+    }
+
+class JobJournal:
+    """
+    Durable record of every campaign run: the brief, its prepared base images
+    and the outcome of each product x aspect ratio (x locale) variant, written
+    as each variant is uploaded. A run that was interrupted, or that finished
+    with failed variants, can then be resumed, regenerating only the variants
+    that have no uploaded creative yet.
+    """
+
+    def __init__(self, db_path: str = JOURNAL_DB_PATH, base_image_dir: str = JOURNAL_BASE_IMAGE_DIR):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        os.makedirs(base_image_dir, exist_ok=True)
+        self.base_image_dir = base_image_dir
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        # Campaigns this process is running right now.
+        self._active: Set[str] = set()
+
+    def _base_image_path(self, digest: str) -> str:
+        return os.path.join(self.base_image_dir, digest)
+
+    def begin(self, brief, campaign_folder: str, base_images_data: List[Dict], keys: Iterable[VariantKey]):
+        """
+        Records that a run of 'brief' into campaign_folder is starting, with
+        'keys' as its variants. New variants start out pending; variants
+        already uploaded by an earlier run keep their outcome.
+        """
+        for image in base_images_data:
+            path = self._base_image_path(image["digest"])
+            if not os.path.exists(path):
+                with open(f"{path}.tmp", "wb") as f:
+                    f.write(image["data"])
+                os.replace(f"{path}.tmp", path)
+        base_images = [{key: image[key] for key in ("description", "digest", "mime_type")} for image in base_images_data]
+        folder = _folder_key(campaign_folder)
+        now = _now()
+        with self._lock:
+            self._active.add(folder)
+            self._conn.execute(
+                "INSERT INTO runs (campaign_folder, folder_display, campaign_name, brief, base_images, status, owner, attempts, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, 'running', ?, 1, ?, ?) "
+                "ON CONFLICT(campaign_folder) DO UPDATE SET status = 'running', owner = excluded.owner, "
+                "attempts = runs.attempts + 1, updated_at = excluded.updated_at",
+                (folder, campaign_folder, brief.campaign_name, brief.model_dump_json(), json.dumps(base_images), _OWNER, now, now),
+            )
+            for position, (product, aspect_ratio, locale) in enumerate(keys):
+                self._conn.execute(
+                    "INSERT INTO variants (campaign_folder, product, aspect_ratio, locale, position, status, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, 'pending', ?) "
+                    "ON CONFLICT(campaign_folder, product, aspect_ratio, locale) DO UPDATE SET position = excluded.position",
+                    (folder, product, aspect_ratio, locale or "", position, now),
+                )
+            self._conn.commit()
+
+    def record_variant(self, campaign_folder: str, summary: Dict):
+        """Stores a finished variant's summary (see pipeline.variant_summary) as uploaded or failed."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE variants SET status = ?, error = ?, url = ?, summary = ?, updated_at = ? "
+                "WHERE campaign_folder = ? AND product = ? AND aspect_ratio = ? AND locale = ?",
+                ("uploaded" if summary["url"] else "failed", summary["error"], summary["url"], json.dumps(summary), _now(),
+                 _folder_key(campaign_folder), summary["product"], summary["aspect_ratio"], summary["locale"] or ""),
+            )
+            self._conn.commit()
+
+    def finish(self, campaign_folder: str, status: str):
+        """Marks the run 'completed', 'flagged' (some variants failed) or 'failed' (the run itself crashed)."""
+        folder = _folder_key(campaign_folder)
+        with self._lock:
+            self._active.discard(folder)
+            self._conn.execute(
+                "UPDATE runs SET status = ?, owner = NULL, updated_at = ? WHERE campaign_folder = ?", (status, _now(), folder),
+            )
+            self._conn.commit()
+
+    def is_active(self, campaign_folder: str) -> bool:
+        """Whether a run of the campaign is in progress, in this process or in another live one."""
+        folder = _folder_key(campaign_folder)
+        with self._lock:
+            if folder in self._active:
+                return True
+            row = self._conn.execute("SELECT status, owner FROM runs WHERE campaign_folder = ?", (folder,)).fetchone()
+        return bool(row) and row[0] == "running" and row[1] != _OWNER and _owner_alive(row[1])
+
+    def get(self, campaign_folder: str) -> Optional[Dict]:
+        """The run's state and per-variant outcomes, or None if the campaign was never journaled."""
+        folder = _folder_key(campaign_folder)
+        with self._lock:
+            run = self._conn.execute(
+                "SELECT folder_display, campaign_name, status, owner, attempts, created_at, updated_at FROM runs WHERE campaign_folder = ?",
+                (folder,),
+            ).fetchone()
+            if not run:
+                return None
+            rows = self._conn.execute(
+                "SELECT product, aspect_ratio, locale, status, error, url FROM variants WHERE campaign_folder = ? ORDER BY position",
+                (folder,),
+            ).fetchall()
+        status = run[2]
+        if status == "running" and folder not in self._active and (run[3] == _OWNER or not _owner_alive(run[3])):
+            # The process running it died (or restarted) before the run finished.
+            status = "interrupted"
+        variants = [
+            {"product": product, "aspect_ratio": aspect_ratio, "locale": locale or None, "status": variant_status, "error": error, "url": url}
+            for product, aspect_ratio, locale, variant_status, error, url in rows
+        ]
+        return {
+            "campaign_folder": run[0],
+            "campaign_name": run[1],
+            "status": status,
+            "attempts": run[4],
+            "created_at": run[5],
+            "updated_at": run[6],
+            "total_variants": len(variants),
+            "uploaded_variants": sum(1 for variant in variants if variant["status"] == "uploaded"),
+            "variants": variants,
+        }
+
+    def load(self, campaign_folder: str) -> Optional[Tuple[CampaignBrief, str, List[Dict]]]:
+        """
+        The brief, Dropbox folder and prepared base images (as
+        CreativeGenerator.prepare_base_images returns them) of a journaled
+        campaign, or None if it was never journaled. Raises OSError if a
+        stored base image is missing.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT brief, folder_display, base_images FROM runs WHERE campaign_folder = ?", (_folder_key(campaign_folder),),
+            ).fetchone()
+        if not row:
+            return None
+        base_images_data = []
+        for image in json.loads(row[2]):
+            with open(self._base_image_path(image["digest"]), "rb") as f:
+                base_images_data.append({**image, "data": f.read()})
+        return CampaignBrief.model_validate_json(row[0]), row[1], base_images_data
+
+    def missing_variants(self, campaign_folder: str) -> Set[VariantKey]:
+        """Variants without an uploaded creative: never started, interrupted or failed."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT product, aspect_ratio, locale FROM variants WHERE campaign_folder = ? AND status != 'uploaded'",
+                (_folder_key(campaign_folder),),
+            ).fetchall()
+        return {(product, aspect_ratio, locale or None) for product, aspect_ratio, locale in rows}
+
+    def variant_summaries(self, campaign_folder: str) -> List[Dict]:
+        """The latest summary of every variant of the campaign, in brief order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT product, aspect_ratio, locale, summary FROM variants WHERE campaign_folder = ? ORDER BY position",
+                (_folder_key(campaign_folder),),
+            ).fetchall()
+        return [
+            json.loads(summary) if summary else pending_summary((product, aspect_ratio, locale or None))
+            for product, aspect_ratio, locale, summary in rows
+        ]
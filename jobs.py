@@ -0,0 +1,161 @@
+import os
+import time
+import asyncio
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from telemetry import JOBS_IN_FLIGHT, start_trace, submit_in_context
+
+# Number of briefs processed at the same time in the background.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Finished jobs are forgotten after this many seconds.
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+
+class JobManager:
+    """
+    Runs campaign briefs on a background executor and records their progress
+    as an append-only list of events, which clients can poll or stream.
+
+    A job function is called as fn(emit, *args), where emit(event_type, data)
+    appends a progress event; its return value becomes the job's result.
+    """
+
+    def __init__(self, max_workers: int = JOB_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._condition = threading.Condition()
+        # Event-stream clients waiting on the server's event loop, per job: (loop, asyncio.Event).
+        self._listeners: Dict[str, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+
+    def submit(self, campaign_name: str, campaign_folder: str, total_variants: int, fn: Callable, *args,
+               job_id: Optional[str] = None) -> Dict[str, Any]:
+        """Queues fn; job_id defaults to a fresh ID and also names the job's trace."""
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        job = {
+            "id": job_id,
+            "campaign_name": campaign_name,
+            "campaign_folder": campaign_folder,
+            "status": "queued",
+            "created_at": now,
+            "updated_at": now,
+            "total_variants": total_variants,
+            "completed_variants": 0,
+            "variants": [],
+            "result": None,
+            "error": None,
+            "events": [],
+        }
+        with self._condition:
+            self._prune()
+            self._jobs[job_id] = job
+        JOBS_IN_FLIGHT.labels("queued").inc()
+        submit_in_context(self._executor, self._run, job_id, fn, args)
+        logging.info(f"Queued job {job_id} for campaign '{campaign_name}'.")
+        return self.get(job_id)
+
+    def _run(self, job_id: str, fn: Callable, args: Tuple):
+        JOBS_IN_FLIGHT.labels("queued").dec()
+        JOBS_IN_FLIGHT.labels("running").inc()
+        self._update(job_id, "running")
+        try:
+            with start_trace(job_id, campaign=self._jobs[job_id]["campaign_name"]):
+                result = fn(lambda event_type, data: self._emit(job_id, event_type, data), *args)
+            self._update(job_id, "completed", result=result)
+        except Exception as e:
+            logging.error(f"Job {job_id} failed: {e}")
+            self._update(job_id, "failed", error=getattr(e, "detail", None) or str(e))
+        finally:
+            JOBS_IN_FLIGHT.labels("running").dec()
+
+    def _emit(self, job_id: str, event_type: str, data: Dict[str, Any]):
+        with self._condition:
+            job = self._jobs[job_id]
+            if event_type == "variant":
+                job["variants"].append(data)
+                job["completed_variants"] += 1
+            job["events"].append({"type": event_type, "data": data})
+            job["updated_at"] = time.time()
+            self._condition.notify_all()
+            self._wake_listeners(job_id)
+
+    def _update(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None):
+        with self._condition:
+            job = self._jobs[job_id]
+            job["status"] = status
+            job["result"] = result
+            job["error"] = error
+            job["updated_at"] = time.time()
+            job["events"].append({"type": status, "data": {"result": result, "error": error}})
+            self._condition.notify_all()
+            self._wake_listeners(job_id)
+
+    def _wake_listeners(self, job_id: str):
+        """Wakes the event-stream clients of a job from whichever thread emitted. Callers hold the lock."""
+        for loop, event in self._listeners.get(job_id, ()):
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The loop has closed; its listener is removed when its stream ends.
+                pass
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id in [j for j, job in self._jobs.items() if job["status"] in ("completed", "failed") and job["updated_at"] < cutoff]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Returns a snapshot of the job without its event log, or None if unknown."""
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {key: (list(value) if isinstance(value, list) else value) for key, value in job.items() if key != "events"}
+
+    def is_active(self, campaign_folder: str) -> bool:
+        """True if a queued or running job is already producing this campaign folder."""
+        with self._condition:
+            return any(
+                job["campaign_folder"].lower() == campaign_folder.lower() and job["status"] in ("queued", "running")
+                for job in self._jobs.values()
+            )
+
+    def events_since(self, job_id: str, since: int) -> Tuple[List[Dict[str, Any]], bool]:
+        """Returns (events past index 'since', finished), where finished means no more will follow."""
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return [], True
+            return list(job["events"][since:]), job["status"] in ("completed", "failed")
+
+    async def wait_for_events(self, job_id: str, since: int, timeout: float) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        Waits on the event loop, without holding a thread, until the job has
+        events past index 'since' or the timeout expires. Returns the same as
+        events_since.
+        """
+        listener = (asyncio.get_running_loop(), asyncio.Event())
+        # Registered before checking, so an event emitted in between still wakes us.
+        with self._condition:
+            self._listeners.setdefault(job_id, set()).add(listener)
+        try:
+            events, finished = self.events_since(job_id, since)
+            if events or finished:
+                return events, finished
+            try:
+                await asyncio.wait_for(listener[1].wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return self.events_since(job_id, since)
+        finally:
+            with self._condition:
+                listeners = self._listeners.get(job_id)
+                if listeners is not None:
+                    listeners.discard(listener)
+                    if not listeners:
+                        del self._listeners[job_id]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,36 +1,213 @@
 import os
 import logging
 import json
-import re
-from creative_generator import CreativeGenerator, ContentGenerationError
-from dropbox_helper import DropboxHelper
+import asyncio
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+from contextlib import asynccontextmanager
+from creative_generator import CreativeGenerator, create_generator
+from dropbox_helper import THUMBNAIL_SIZES
+from storage import StorageBackend, create_storage
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Form, UploadFile, File
-from pydantic import BaseModel
-from typing import Dict, Any, List, Optional
+from fastapi import FastAPI, HTTPException, Form, UploadFile, File, Query, Request
+from typing import Dict, Any, List, Optional, Tuple
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from starlette.staticfiles import StaticFiles
-from agent import run_post_process_checks
+from pipeline import process_campaign, resume_campaign, campaign_folder_for
+from jobs import JobManager
+from job_journal import JobJournal
+from bulk_ingest import run_bulk_ingest
+from models import CampaignBrief
+from image_prep import ImagePreparationError, MAX_UPLOAD_BYTES
+from resilience import resilience_stats
+from scheduler import scheduler_stats
+from export import shutdown_export_pool
+from agent import shutdown_agent
+from telemetry import get_trace, metrics_payload, new_trace_id, span, start_trace
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s', datefmt='%H:%M:%S')
 
-app = FastAPI()
+# Seconds between background readiness probes of Gemini and storage.
+READINESS_CHECK_INTERVAL = int(os.getenv("READINESS_CHECK_INTERVAL", "60"))
+# Directory that base image paths in bulk JSONL briefs are resolved against.
+BULK_BASE_DIR = os.getenv("BULK_BASE_DIR", ".")
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Largest /process-brief or /jobs request accepted: two base images plus the brief.
+MAX_BRIEF_REQUEST_BYTES = 2 * MAX_UPLOAD_BYTES + 1024 * 1024
+# Seconds of silence before a keepalive comment is sent on a job's event stream.
+SSE_KEEPALIVE_SECONDS = 15
+# Browser/CDN cache lifetime of files served from /assets. Creative file names
+# are unique per generation, so a stored file never changes.
+ASSET_CACHE_MAX_AGE = int(os.getenv("ASSET_CACHE_MAX_AGE", str(365 * 24 * 3600)))
+
+async def _run_readiness_checks(app: FastAPI):
+    """Probes every shared client and caches the outcome on app.state.readiness."""
+    checks = {}
+    storage_name = app.state.storage.name if app.state.storage else "storage"
+    for name, client in (("gemini", app.state.generator), (storage_name, app.state.storage)):
+        if client is None:
+            checks[name] = {"ok": False, "error": "Not configured."}
+            continue
+        try:
+            await run_in_threadpool(client.check_health)
+            checks[name] = {"ok": True, "error": None}
+        except Exception as e:
+            logging.error(f"Readiness check failed for {name}: {e}")
+            checks[name] = {"ok": False, "error": str(e)}
+    app.state.readiness = {
+        "ready": all(check["ok"] for check in checks.values()),
+        "checked_at": time.time(),
+        "checks": checks,
+    }
+
+async def _readiness_loop(app: FastAPI):
+    while True:
+        await _run_readiness_checks(app)
+        await asyncio.sleep(READINESS_CHECK_INTERVAL)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Clients are created once per worker and shared by every request. Neither
+    # constructor touches the network, so startup stays fast.
+    app.state.storage = create_storage()
+    app.state.generator = create_generator()
+    app.state.jobs = JobManager()
+    app.state.journal = JobJournal()
+    app.state.readiness = {"ready": False, "checked_at": None, "checks": {}}
+    readiness_task = asyncio.create_task(_readiness_loop(app))
+    try:
+        yield
+    finally:
+        readiness_task.cancel()
+        app.state.jobs.shutdown()
+        shutdown_export_pool()
+        # Flushes queued run records and any pending alert digest.
+        shutdown_agent()
+        if app.state.storage:
+            app.state.storage.close()
+
+def _require_storage() -> StorageBackend:
+    if app.state.storage is None:
+        raise HTTPException(status_code=500, detail="Storage is not configured: set the Dropbox environment variables, or STORAGE_BACKEND=local.")
+    return app.state.storage
+
+def _require_generator() -> CreativeGenerator:
+    if app.state.generator is None:
+        raise HTTPException(status_code=500, detail="Gemini environment variables are not configured.")
+    return app.state.generator
+
+class BriefSizeLimitMiddleware:
+    """
+    Rejects brief submissions whose body is larger than max_bytes with a 413
+    before it is received: up front from Content-Length, or as soon as a
+    chunked body passes the limit. Form parsing would otherwise spool the
+    whole upload to disk before any endpoint code runs.
+    """
+
+    def __init__(self, app, max_bytes: int, paths: Tuple[str, ...]):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = paths
+        self.detail = f"The request is larger than the {max_bytes / (1024 * 1024):g} MB limit for a brief and its base images."
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            await JSONResponse(status_code=413, content={"detail": self.detail})(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail=self.detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"],
 )
+app.add_middleware(BriefSizeLimitMiddleware, max_bytes=MAX_BRIEF_REQUEST_BYTES, paths=("/process-brief", "/jobs"))
+
+async def _read_upload_limited(upload: UploadFile, label: str) -> bytes:
+    """
+    Reads an already received upload in chunks, rejecting it with a 413 once
+    it exceeds MAX_UPLOAD_BYTES. Oversized requests as a whole are turned away
+    earlier, before they are received (see BriefSizeLimitMiddleware).
+    """
+    chunks = []
+    total = 0
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"{label} is larger than the {MAX_UPLOAD_BYTES / (1024 * 1024):g} MB limit.")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+async def _prepare_brief(brief_data, base_image_1, base_image_desc_1, base_image_2, base_image_desc_2):
+    """Validates a submitted brief and reads its base images. Returns (brief, campaign folder, base images)."""
+    try:
+        with span("brief_parse"):
+            brief = CampaignBrief(**json.loads(brief_data))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid brief format: {e}")
 
-class ProductBrief(BaseModel):
-    description: str
+    campaign_folder_path = campaign_folder_for(brief.campaign_name)
+    if not campaign_folder_path:
+        raise HTTPException(status_code=400, detail="Campaign name is invalid or empty.")
+
+    storage = _require_storage()
+    _require_generator()
+
+    if app.state.jobs.is_active(campaign_folder_path) or app.state.journal.is_active(campaign_folder_path):
+        raise HTTPException(status_code=409, detail=f"A campaign named '{brief.campaign_name}' is already running. Please use a unique name.")
+    if app.state.journal.get(campaign_folder_path) is not None:
+        raise HTTPException(
+            status_code=409,
+            detail=f"A campaign named '{brief.campaign_name}' already exists. Use a unique name, or "
+                   f"POST /campaigns/{campaign_folder_path.strip('/')}/resume to generate its missing creatives.",
+        )
+    if await run_in_threadpool(storage.exists, campaign_folder_path):
+        raise HTTPException(status_code=409, detail=f"A campaign named '{brief.campaign_name}' already exists. Please use a unique name.")
+
+    base_images_data = []
+    for upload, description, label in ((base_image_1, base_image_desc_1, "Base image 1"), (base_image_2, base_image_desc_2, "Base image 2")):
+        if upload and description:
+            base_images_data.append({
+                "image_bytes": await _read_upload_limited(upload, label),
+                "description": description
+            })
+    # Decode, downscale and re-encode once here, so only the compact payloads
+    # stay in memory for the rest of the brief.
+    try:
+        base_images_data = await run_in_threadpool(app.state.generator.prepare_base_images, base_images_data)
+    except ImagePreparationError as e:
+        raise HTTPException(status_code=400, detail=f"Could not read base image: {e}")
+    return brief, campaign_folder_path, base_images_data
 
-class CampaignBrief(BaseModel):
-    campaign_name: str
-    region: str
-    audience: str
-    message: str
-    brand_colors: List[str]
-    products: Dict[str, ProductBrief]
+def _run_brief(brief, campaign_folder_path: str, base_images_data: List[Dict], on_variant=None) -> Dict[str, Any]:
+    """Runs the full pipeline for a validated brief (blocking) and returns the response body."""
+    return process_campaign(
+        brief, base_images_data, app.state.generator, app.state.storage, campaign_folder_path,
+        on_variant=on_variant, journal=app.state.journal,
+    )
 
 @app.post("/process-brief")
 async def process_brief_endpoint(
@@ -42,91 +219,314 @@ async def process_brief_endpoint(
 ):
     logging.info("New campaign request received. Starting pipeline...")
     try:
-        brief = CampaignBrief(**json.loads(brief_data))
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Invalid brief format: {e}")
+        with start_trace(new_trace_id()) as trace_id:
+            brief, campaign_folder_path, base_images_data = await _prepare_brief(
+                brief_data, base_image_1, base_image_desc_1, base_image_2, base_image_desc_2
+            )
+            # run_in_threadpool copies the context, so the worker thread's spans land in this trace.
+            result = await run_in_threadpool(_run_brief, brief, campaign_folder_path, base_images_data)
+        return {**result, "trace_id": trace_id}
 
-    safe_campaign_name = re.sub(r'[^\w\-_\. ]', '', brief.campaign_name).strip().replace(' ', '_')
-    if not safe_campaign_name:
-        raise HTTPException(status_code=400, detail="Campaign name is invalid or empty.")
-    
-    campaign_folder_path = f"/{safe_campaign_name}"
+    except Exception as e:
+        if isinstance(e, HTTPException): raise e
+        logging.error(f"An unexpected pipeline failure occurred: {e}")
+        raise HTTPException(status_code=500, detail=f"An internal error occurred: {e}")
 
+@app.post("/jobs", status_code=202)
+async def submit_job_endpoint(
+    brief_data: str = Form(...),
+    base_image_1: Optional[UploadFile] = File(None),
+    base_image_desc_1: Optional[str] = Form(None),
+    base_image_2: Optional[UploadFile] = File(None),
+    base_image_desc_2: Optional[str] = Form(None)
+):
+    """
+    Same input as /process-brief, but returns a job ID immediately and runs the
+    pipeline in the background. Follow progress at /jobs/{id} (polling) or
+    /jobs/{id}/events (Server-Sent Events).
+    """
+    logging.info("New campaign job received.")
+    # The job ID doubles as the trace ID: the job continues the trace started here.
+    job_id = new_trace_id()
     try:
-        dropbox_app_key = os.getenv("DROPBOX_APP_KEY")
-        dropbox_app_secret = os.getenv("DROPBOX_APP_SECRET")
-        dropbox_refresh_token = os.getenv("DROPBOX_REFRESH_TOKEN")
-        if not all([dropbox_app_key, dropbox_app_secret, dropbox_refresh_token]):
-            raise HTTPException(status_code=500, detail="Dropbox environment variables are not configured.")
+        with start_trace(job_id):
+            brief, campaign_folder_path, base_images_data = await _prepare_brief(
+                brief_data, base_image_1, base_image_desc_1, base_image_2, base_image_desc_2
+            )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logging.error(f"Could not queue campaign job: {e}")
+        raise HTTPException(status_code=500, detail=f"An internal error occurred: {e}")
 
-        dropbox_helper = DropboxHelper(app_key=dropbox_app_key, app_secret=dropbox_app_secret, refresh_token=dropbox_refresh_token)
+    total_variants = app.state.generator.variant_count(brief)
+    job = app.state.jobs.submit(
+        brief.campaign_name, campaign_folder_path, total_variants,
+        lambda emit: _run_brief(brief, campaign_folder_path, base_images_data, on_variant=lambda variant: emit("variant", variant)),
+        job_id=job_id,
+    )
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "total_variants": total_variants,
+        "status_url": f"/jobs/{job['id']}",
+        "events_url": f"/jobs/{job['id']}/events",
+        "trace_url": f"/traces/{job['id']}",
+    }
 
-        if dropbox_helper.folder_exists(campaign_folder_path):
-            raise HTTPException(status_code=409, detail=f"A campaign named '{brief.campaign_name}' already exists. Please use a unique name.")
+@app.post("/bulk-briefs", status_code=202)
+async def submit_bulk_briefs_endpoint(briefs_file: UploadFile = File(...)):
+    """
+    Queues a JSONL file of briefs (see bulk_ingest.py) as one background job.
+    Each finished brief is published as a 'brief' event carrying its result
+    manifest. Base image paths are resolved against BULK_BASE_DIR on the server.
+    """
+    storage = _require_storage()
+    generator = _require_generator()
+    # The upload is already spooled to a temporary file; the job streams it
+    # line by line. FastAPI closes the upload once this response is sent, so
+    # the job reads through its own duplicate of the file descriptor.
+    await briefs_file.seek(0)
+    source = os.fdopen(await run_in_threadpool(lambda: os.dup(briefs_file.file.fileno())), "rb")
 
-        base_images_data = []
-        if base_image_1 and base_image_desc_1:
-            base_images_data.append({
-                "image_bytes": await base_image_1.read(),
-                "description": base_image_desc_1
-            })
-        if base_image_2 and base_image_desc_2:
-            base_images_data.append({
-                "image_bytes": await base_image_2.read(),
-                "description": base_image_desc_2
-            })
-        
-        generator = CreativeGenerator()
+    def run(emit):
+        with source:
+            return {"briefs": run_bulk_ingest(
+                source, generator, storage, base_dir=BULK_BASE_DIR, on_brief=lambda manifest: emit("brief", manifest),
+                journal=app.state.journal,
+            )}
 
-        try:
-            local_image_paths = generator.process_and_save_creatives(brief, base_images_data)
-        except ContentGenerationError as e:
-            raise HTTPException(status_code=400, detail=str(e))
-
-        if not local_image_paths:
-            return {"message": "Brief processed, but no images were generated.", "image_urls": []}
-
-        image_urls = []
-        for local_path in local_image_paths:
-            filename = os.path.basename(local_path)
-            match = re.search(r'_(\d+x\d+)_', filename)
-            aspect_ratio_folder = match.group(1).replace('x', ':') if match else ""
-            dropbox_path = f"{campaign_folder_path}/{aspect_ratio_folder}/{filename}"
-            
-            shareable_link = dropbox_helper.upload_file(local_path, dropbox_path)
-            os.remove(local_path)
-            if shareable_link:
-                image_urls.append(shareable_link)
-                logging.info(f"SUCCESS: Creative uploaded to Dropbox path: {dropbox_path}")
-
-        logging.info("Campaign pipeline completed successfully.")
-        try:
-            logging.info("Handing off to Agent for post-processing checks...")
-            run_post_process_checks(brief, image_urls)
-        except Exception as e:
-            logging.error(f"Agent failed to run post-processing checks: {e}")
-        return {"message": "Brief processed successfully.", "image_urls": image_urls}
+    job = app.state.jobs.submit(f"Bulk: {briefs_file.filename}", f"bulk:{briefs_file.filename}", 0, run)
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "status_url": f"/jobs/{job['id']}",
+        "events_url": f"/jobs/{job['id']}/events",
+    }
 
-    except Exception as e:
-        if isinstance(e, HTTPException): raise e
-        logging.error(f"An unexpected pipeline failure occurred: {e}")
-        raise HTTPException(status_code=500, detail=f"An internal error occurred: {e}")
+@app.get("/jobs/{job_id}")
+async def get_job_endpoint(job_id: str):
+    job = app.state.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def job_events_endpoint(job_id: str, request: Request):
+    """
+    Streams the job's progress as Server-Sent Events, replaying earlier events
+    first. Each event's id is its index, so a reconnecting EventSource (which
+    sends Last-Event-ID) picks up after the last event it received.
+    """
+    if app.state.jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    try:
+        since = max(int(request.headers.get("last-event-id", "-1")) + 1, 0)
+    except ValueError:
+        since = 0
+
+    async def event_stream():
+        position = since
+        while True:
+            events, finished = await app.state.jobs.wait_for_events(job_id, position, SSE_KEEPALIVE_SECONDS)
+            for event in events:
+                yield f"id: {position}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+                position += 1
+            if finished and not events:
+                break
+            if not events:
+                # Comment line to keep proxies from closing an idle connection.
+                yield ": keepalive\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+def _with_thumbnails(campaign: Dict[str, Any], thumbnail_size: str) -> Dict[str, Any]:
+    for asset in campaign["assets"]:
+        asset["thumbnail_url"] = f"/thumbnails{quote(asset['path'])}?size={thumbnail_size}"
+    return campaign
 
 @app.get("/list-campaigns")
-async def list_campaigns_endpoint():
-    logging.info("API request received to list all campaigns.")
+async def list_campaigns_endpoint(
+    cursor: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100),
+    campaign: Optional[str] = None,
+    aspect_ratio: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    thumbnail_size: str = "w480h320",
+):
+    """
+    Returns one page of campaigns with their assets. Pass the response's
+    next_cursor back as cursor to get the following page. Assets carry a small
+    thumbnail_url for gallery grids and the full-size url for viewing/download.
+    """
+    logging.info("API request received to list campaigns.")
+    if thumbnail_size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"thumbnail_size must be one of: {', '.join(THUMBNAIL_SIZES)}")
     try:
-        dropbox_app_key = os.getenv("DROPBOX_APP_KEY")
-        dropbox_app_secret = os.getenv("DROPBOX_APP_SECRET")
-        dropbox_refresh_token = os.getenv("DROPBOX_REFRESH_TOKEN")
-        if not all([dropbox_app_key, dropbox_app_secret, dropbox_refresh_token]):
-            raise HTTPException(status_code=500, detail="Dropbox environment variables are not configured.")
-
-        dropbox_helper = DropboxHelper(app_key=dropbox_app_key, app_secret=dropbox_app_secret, refresh_token=dropbox_refresh_token)
-        campaigns_data = dropbox_helper.list_campaign_assets()
-        return campaigns_data
+        storage = _require_storage()
+        campaigns, next_cursor = await run_in_threadpool(
+            storage.list,
+            after=cursor, limit=limit, name=campaign, aspect_ratio=aspect_ratio, since=since, until=until,
+        )
+        return {
+            "campaigns": [_with_thumbnails(c, thumbnail_size) for c in campaigns],
+            "next_cursor": next_cursor,
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"API Error: Failed to list campaigns: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/campaigns/{campaign_id}")
+async def get_campaign_endpoint(campaign_id: str, aspect_ratio: Optional[str] = None, thumbnail_size: str = "w480h320"):
+    if thumbnail_size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"thumbnail_size must be one of: {', '.join(THUMBNAIL_SIZES)}")
+    storage = _require_storage()
+    try:
+        campaigns, _ = await run_in_threadpool(
+            storage.list, limit=1, folder=campaign_id, aspect_ratio=aspect_ratio,
+        )
+    except Exception as e:
+        logging.error(f"API Error: Failed to load campaign '{campaign_id}': {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if not campaigns:
+        raise HTTPException(status_code=404, detail=f"Campaign '{campaign_id}' not found.")
+    return _with_thumbnails(campaigns[0], thumbnail_size)
+
+@app.post("/campaigns/{campaign_id}/resume", status_code=202)
+async def resume_campaign_endpoint(campaign_id: str):
+    """
+    Regenerates only the variants of an earlier campaign that have no uploaded
+    creative: those an interrupted run never finished and those that failed
+    (e.g. after the agent flagged the run for insufficient assets). Runs as a
+    background job, like /jobs.
+    """
+    storage = _require_storage()
+    generator = _require_generator()
+    journal = app.state.journal
+    run = await run_in_threadpool(journal.get, campaign_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail=f"No journaled run for campaign '{campaign_id}'.")
+    if app.state.jobs.is_active(run["campaign_folder"]) or journal.is_active(run["campaign_folder"]):
+        raise HTTPException(status_code=409, detail=f"Campaign '{run['campaign_name']}' is already running.")
+
+    total_variants = run["total_variants"] - run["uploaded_variants"]
+    job = app.state.jobs.submit(
+        run["campaign_name"], run["campaign_folder"], total_variants,
+        lambda emit: resume_campaign(
+            run["campaign_folder"], generator, storage, journal, on_variant=lambda variant: emit("variant", variant),
+        ),
+    )
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "total_variants": total_variants,
+        "status_url": f"/jobs/{job['id']}",
+        "events_url": f"/jobs/{job['id']}/events",
+        "trace_url": f"/traces/{job['id']}",
+    }
+
+@app.get("/campaigns/{campaign_id}/journal")
+async def campaign_journal_endpoint(campaign_id: str):
+    """The journaled state of a campaign's latest run and the outcome of each of its variants."""
+    run = await run_in_threadpool(app.state.journal.get, campaign_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail=f"No journaled run for campaign '{campaign_id}'.")
+    return run
+
+@app.get("/thumbnails/{asset_path:path}")
+async def thumbnail_endpoint(asset_path: str, size: str = "w480h320"):
+    if size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"size must be one of: {', '.join(THUMBNAIL_SIZES)}")
+    storage = _require_storage()
+    try:
+        data = await run_in_threadpool(storage.get_thumbnail, f"/{asset_path}", size)
+    except Exception as e:
+        logging.error(f"API Error: Failed to render thumbnail for '{asset_path}': {e}")
+        raise HTTPException(status_code=502, detail=str(e))
+    if data is None:
+        raise HTTPException(status_code=404, detail="Asset not found.")
+    return Response(content=data, media_type="image/jpeg", headers={"Cache-Control": "public, max-age=86400"})
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """Whether the client's cached copy (If-None-Match, else If-Modified-Since) is still current."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        return if_none_match.strip() == "*" or etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+@app.get("/assets/{asset_path:path}")
+async def asset_endpoint(asset_path: str, request: Request):
+    """
+    Serves a stored creative. Local storage answers straight from disk with
+    ETag/Last-Modified validators and a long Cache-Control, so browsers and a
+    CDN in front of this endpoint rarely ask twice; other backends redirect
+    to the file's own link.
+    """
+    storage = _require_storage()
+    path = f"/{asset_path}"
+    local_path = storage.local_path(path)
+    if local_path is None:
+        url = await run_in_threadpool(storage.link, path)
+        if url is None:
+            raise HTTPException(status_code=404, detail="Asset not found.")
+        return RedirectResponse(url, status_code=307)
+
+    stat = os.stat(local_path)
+    headers = {
+        "ETag": f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": f"public, max-age={ASSET_CACHE_MAX_AGE}, immutable",
+    }
+    if _not_modified(request, headers["ETag"], stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(local_path, headers=headers)
+
+@app.get("/cache/stats")
+async def cache_stats_endpoint():
+    generator = _require_generator()
+    return generator.cache.stats()
+
+@app.get("/stats/resilience")
+async def resilience_stats_endpoint():
+    """Per-stage retry counts and latencies, plus the state of each service's circuit breaker."""
+    return resilience_stats()
+
+@app.get("/stats/scheduler")
+async def scheduler_stats_endpoint():
+    """Model quota usage, queue depth and wait times per priority class, plus the generation queue."""
+    generator = _require_generator()
+    return {"models": scheduler_stats(), "generation": generator.queue_stats()}
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics: stage latency histograms, variant outcomes, bytes transferred and jobs in flight."""
+    payload, content_type = metrics_payload()
+    return Response(content=payload, media_type=content_type)
+
+@app.get("/traces/{trace_id}")
+async def trace_endpoint(trace_id: str):
+    """
+    Spans of a recent /process-brief request or job (the job ID is its trace
+    ID), with parent links, timings and the thread each ran on.
+    """
+    trace = get_trace(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found. Only the most recent TRACE_HISTORY traces are kept.")
+    return trace
+
+@app.get("/ready")
+async def readiness_endpoint():
+    """Returns the cached result of the last background readiness check."""
+    status_code = 200 if app.state.readiness["ready"] else 503
+    return JSONResponse(status_code=status_code, content=app.state.readiness)
+
 app.mount("/", StaticFiles(directory="frontend", html=True), name="frontend")
\ No newline at end of file
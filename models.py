@@ -0,0 +1,23 @@
+from pydantic import BaseModel
+from typing import Dict, List, Literal
+
+class ProductBrief(BaseModel):
+    description: str
+
+class CampaignBrief(BaseModel):
+    campaign_name: str
+    region: str
+    audience: str
+    message: str
+    brand_colors: List[str]
+    products: Dict[str, ProductBrief]
+    # Bypass the generation cache and call the model for every variant.
+    force_regenerate: bool = False
+    # "generate": one model call per aspect ratio. "derive": one model call per
+    # product; the other ratios are cropped/padded from it locally.
+    generation_mode: Literal["generate", "derive"] = "generate"
+    # "model": the model renders the message into the image. "overlay": the model
+    # generates a text-free background and the message is composited locally,
+    # once per entry in localized_messages (locale -> message) plus the main message.
+    text_mode: Literal["model", "overlay"] = "model"
+    localized_messages: Dict[str, str] = {}
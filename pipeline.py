@@ -0,0 +1,306 @@
+import os
+import re
+import time
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from agent import build_run_record, submit_run
+from export import export_creative
+from telemetry import span, submit_in_context, VARIANTS_TOTAL
+from scheduler import scheduling
+
+# Maximum number of uploads (and their exports) in flight per campaign.
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+# Uploaded files are committed (and their share links created) in batches of
+# this many, or once no new upload has arrived for UPLOAD_BATCH_WAIT seconds,
+# whichever comes first; variants are reported once their batch commits.
+UPLOAD_BATCH_SIZE = int(os.getenv("UPLOAD_BATCH_SIZE", "12"))
+UPLOAD_BATCH_WAIT = float(os.getenv("UPLOAD_BATCH_WAIT", "0.25"))
+
+def campaign_folder_for(campaign_name: str) -> Optional[str]:
+    """Storage folder for a campaign name, e.g. 'Summer Launch!' -> '/Summer_Launch'. None if nothing usable remains."""
+    safe_campaign_name = re.sub(r'[^\w\-_\. ]', '', campaign_name).strip().replace(' ', '_')
+    return f"/{safe_campaign_name}" if safe_campaign_name else None
+
+def _export_path(campaign_folder_path: str, result: Dict, output: Dict, primary: bool) -> str:
+    folder = f"{campaign_folder_path}/{result['aspect_ratio']}"
+    if primary:
+        return f"{folder}/{result['basename']}.{output['extension']}"
+    # Extra formats and downscaled renditions live next to, not among, the primary creatives.
+    suffix = "" if output["rendition"] == "full" else f"_{output['rendition']}"
+    return f"{folder}/renditions/{result['basename']}{suffix}.{output['extension']}"
+
+class _CommitBatcher:
+    """
+    Collects variants whose files are uploaded but not yet committed, and
+    commits them UPLOAD_BATCH_SIZE files at a time (see
+    StorageBackend.commit_uploads). Whichever upload thread fills a batch
+    commits it; a batch that stops growing for UPLOAD_BATCH_WAIT seconds is
+    committed by a timer, so progress never waits on variants still being
+    generated. Backends without batch_commits commit every variant at once.
+    flush() commits the rest.
+    """
+
+    def __init__(self, storage, on_variant):
+        self.storage = storage
+        self.on_variant = on_variant
+        self._pending: List[Tuple[Dict, List]] = []
+        self._pending_files = 0
+        self._timer: Optional[threading.Timer] = None
+        # Batches taken but not yet committed, so flush(wait=True) can wait for them.
+        self._committing = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def add(self, result: Dict, staged: List):
+        with self._lock:
+            self._pending.append((result, staged))
+            self._pending_files += len(staged)
+            self._cancel_timer()
+            batch = None
+            if not self.storage.batch_commits or self._pending_files >= UPLOAD_BATCH_SIZE:
+                batch = self._take()
+            else:
+                self._timer = threading.Timer(UPLOAD_BATCH_WAIT, contextvars.copy_context().run, (self.flush,))
+                self._timer.daemon = True
+                self._timer.start()
+        if batch:
+            self._commit(batch)
+
+    def flush(self, wait: bool = False):
+        """Commits every pending variant; with wait, also waits for batches other threads are committing."""
+        with self._lock:
+            self._cancel_timer()
+            batch = self._take()
+        if batch:
+            self._commit(batch)
+        if wait:
+            with self._idle:
+                self._idle.wait_for(lambda: not self._committing)
+
+    def _cancel_timer(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    def _take(self) -> List[Tuple[Dict, List]]:
+        batch, self._pending, self._pending_files = self._pending, [], 0
+        if batch:
+            self._committing += 1
+        return batch
+
+    def _commit(self, batch: List[Tuple[Dict, List]]):
+        try:
+            self._commit_batch(batch)
+        finally:
+            with self._idle:
+                self._committing -= 1
+                self._idle.notify_all()
+
+    def _commit_batch(self, batch: List[Tuple[Dict, List]]):
+        entries = [entry for _, staged in batch for _, entry in staged]
+        failed = {"url": None, "error": "Upload failed."}
+        try:
+            outcomes = self.storage.commit_uploads(entries) if entries else {}
+        except Exception as e:
+            logging.error(f"Committing uploads failed: {e}")
+            outcomes = {}
+            failed = {"url": None, "error": f"Upload failed: {e}"}
+        for result, staged in batch:
+            for output, _ in staged:
+                outcome = outcomes.get(output["storage_path"], failed)
+                output["url"] = outcome["url"]
+                if output["storage_path"] == result["storage_path"]:
+                    result["url"] = outcome["url"]
+                    if outcome["error"]:
+                        result["error"] = outcome["error"]
+                if outcome["url"]:
+                    logging.info(f"SUCCESS: Creative stored at: {output['storage_path']}")
+            if self.on_variant:
+                self.on_variant(result)
+
+def _upload_variant(storage, campaign_folder_path: str, result: Dict, batcher: _CommitBatcher) -> Dict:
+    result["storage_path"] = None
+    result["url"] = None
+    result["exports"] = []
+    try:
+        # Encoding runs on the export process pool; this upload thread just waits for it.
+        with span("export_encode", aspect_ratio=result["aspect_ratio"]):
+            outputs = export_creative(result["data"])
+    except Exception as e:
+        logging.error(f"Export of '{result['product']}' ({result['aspect_ratio']}) failed: {e}")
+        outputs = []
+        result["error"] = f"Export failed: {e}"
+
+    # Upload now, commit later: the bytes go up while other variants are still
+    # generating, and the batcher commits many files per call.
+    staged = []
+    for position, output in enumerate(outputs):
+        storage_path = _export_path(campaign_folder_path, result, output, primary=position == 0)
+        output["storage_path"] = storage_path
+        output["url"] = None
+        result["exports"].append(output)
+        if position == 0:
+            result["storage_path"] = storage_path
+        try:
+            staged.append((output, storage.start_upload(output.pop("data"), storage_path)))
+        except Exception as e:
+            logging.error(f"Upload of {storage_path} failed: {e}")
+            if position == 0:
+                result["error"] = f"Upload failed: {e}"
+    result["data"] = None
+    batcher.add(result, staged)
+    return result
+
+def run_campaign_pipeline(
+    brief,
+    base_images_data: List[Dict],
+    generator,
+    storage,
+    campaign_folder_path: str,
+    on_variant: Optional[Callable[[Dict], None]] = None,
+    only: Optional[Set[Tuple[str, str, Optional[str]]]] = None,
+) -> List[Dict]:
+    """
+    Generates every variant of a brief and streams each finished creative
+    straight from memory to storage (a storage.StorageBackend). Export
+    (encoding to OUTPUT_FORMATS and RENDITION_WIDTHS on a process pool) and
+    uploads run on their own pool, overlapping with generations that are
+    still in progress; uploaded files are committed and linked in batches
+    (see _CommitBatcher).
+
+    Returns one result per variant in brief order (see
+    CreativeGenerator.generate_creatives), with 'url' and 'storage_path' set
+    for the uploaded primary creative and 'exports' listing every exported
+    file. The image bytes are dropped once uploaded.
+    If given, on_variant is called with each finished result as soon as it
+    completes; it may be called from worker threads. 'only' limits the run to
+    those variant keys (see CreativeGenerator.variant_keys).
+    """
+    results = {}
+    batcher = _CommitBatcher(storage, on_variant)
+    with ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY) as upload_executor:
+        upload_futures = []
+        for result in generator.generate_creatives(brief, base_images_data, only=only):
+            if result["data"] is None:
+                result["url"] = None
+                result["storage_path"] = None
+                result["exports"] = []
+                results[result["index"]] = result
+                if on_variant:
+                    on_variant(result)
+                continue
+            upload_futures.append(submit_in_context(upload_executor, _upload_variant, storage, campaign_folder_path, result, batcher))
+
+        for future in upload_futures:
+            result = future.result()
+            results[result["index"]] = result
+    batcher.flush(wait=True)
+
+    for result in results.values():
+        VARIANTS_TOTAL.labels("uploaded" if result["url"] else "blocked" if result["blocked"] else "failed").inc()
+    return [results[index] for index in sorted(results)]
+
+def variant_summary(result: Dict) -> Dict[str, Any]:
+    """The client-facing subset of a variant result."""
+    return {
+        "product": result["product"],
+        "aspect_ratio": result["aspect_ratio"],
+        "duration_s": result["duration_s"],
+        "cache_hit": result["cache_hit"],
+        "mode": result["mode"],
+        "locale": result["locale"],
+        "quality": result["quality"],
+        "url": result["url"],
+        "error": result["error"],
+        "exports": [
+            {key: output[key] for key in ("format", "rendition", "width", "height", "bytes", "encode_s", "url")}
+            for output in result["exports"]
+        ],
+    }
+
+def process_campaign(
+    brief,
+    base_images_data: List[Dict],
+    generator,
+    storage,
+    campaign_folder_path: str,
+    on_variant: Optional[Callable[[Dict], None]] = None,
+    journal=None,
+    only: Optional[Set[Tuple[str, str, Optional[str]]]] = None,
+) -> Dict[str, Any]:
+    """
+    Runs the whole pipeline for one validated brief and returns the
+    /process-brief response body. The run record is handed to the agent's
+    background queue, so logging and alerting never delay the response.
+    on_variant receives each variant's summary as it completes.
+    With a journal (see job_journal.JobJournal), each variant's outcome is
+    recorded as it is uploaded, and the response and run record cover every
+    variant of the campaign, including those 'only' left out because an
+    earlier run already uploaded them.
+    """
+    start_time = time.perf_counter()
+    if journal:
+        journal.begin(brief, campaign_folder_path, base_images_data, generator.variant_keys(brief))
+
+    def report(result: Dict):
+        summary = variant_summary(result)
+        if journal:
+            journal.record_variant(campaign_folder_path, summary)
+        if on_variant:
+            on_variant(summary)
+
+    try:
+        # Model calls queue fairly against other campaigns under this brief's name.
+        with span("campaign", campaign=brief.campaign_name), scheduling(campaign=brief.campaign_name):
+            variant_results = run_campaign_pipeline(
+                brief, base_images_data, generator, storage, campaign_folder_path,
+                on_variant=report if journal or on_variant else None, only=only,
+            )
+    except Exception:
+        if journal:
+            journal.finish(campaign_folder_path, "failed")
+        raise
+
+    variants = [variant_summary(r) for r in variant_results]
+    if journal:
+        variants = journal.variant_summaries(campaign_folder_path)
+        journal.finish(campaign_folder_path, "completed" if all(variant["url"] for variant in variants) else "flagged")
+    image_urls = [variant["url"] for variant in variants if variant["url"]]
+
+    try:
+        submit_run(build_run_record(brief, variants, campaign_folder_path, time.perf_counter() - start_time))
+    except Exception as e:
+        logging.error(f"Failed to hand the campaign run to the Agent: {e}")
+
+    if not image_urls:
+        return {"message": "Brief processed, but no images were generated.", "image_urls": [], "variants": variants}
+
+    logging.info("Campaign pipeline completed successfully.")
+    return {"message": "Brief processed successfully.", "image_urls": image_urls, "variants": variants}
+
+def resume_campaign(
+    campaign_folder_path: str,
+    generator,
+    storage,
+    journal,
+    on_variant: Optional[Callable[[Dict], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Re-runs a journaled campaign for just the variants that have no uploaded
+    creative yet (never started, interrupted or failed), with the brief and
+    base images of its first run. Returns the same body as process_campaign.
+    Raises KeyError if the journal does not know the campaign.
+    """
+    loaded = journal.load(campaign_folder_path)
+    if loaded is None:
+        raise KeyError(campaign_folder_path)
+    brief, campaign_folder_path, base_images_data = loaded
+    missing = journal.missing_variants(campaign_folder_path)
+    logging.info(f"Resuming campaign '{brief.campaign_name}': {len(missing)} variant(s) to generate.")
+    return process_campaign(
+        brief, base_images_data, generator, storage, campaign_folder_path,
+        on_variant=on_variant, journal=journal, only=missing,
+    )
@@ -0,0 +1,254 @@
+import os
+import time
+import random
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import dropbox
+import requests
+from google.api_core import exceptions as google_exceptions
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1.0"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "30"))
+# Consecutive retryable failures that open a service's circuit, and how long it stays open.
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+# Per-call timeouts handed to the SDKs.
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "120"))
+GEMINI_TEXT_TIMEOUT = float(os.getenv("GEMINI_TEXT_TIMEOUT", "10"))
+DROPBOX_TIMEOUT = float(os.getenv("DROPBOX_TIMEOUT", "60"))
+
+_RETRYABLE_GOOGLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.Aborted,
+)
+_RETRYABLE_NETWORK_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+
+class CircuitOpenError(Exception):
+    """Raised without calling the service while its circuit breaker is open."""
+    pass
+
+def classify_error(exc: BaseException) -> Tuple[bool, Optional[float]]:
+    """
+    Returns (retryable, retry_after_seconds). Rate limits, 5xx responses and
+    network failures are retryable; everything else (bad requests, auth errors,
+    safety blocks) is terminal. retry_after is the server's hint, if it gave one.
+    """
+    if isinstance(exc, dropbox.exceptions.RateLimitError):
+        return True, exc.backoff
+    if isinstance(exc, dropbox.exceptions.InternalServerError):
+        return True, None
+    if isinstance(exc, dropbox.exceptions.HttpError):
+        return exc.status_code >= 500, None
+    if isinstance(exc, _RETRYABLE_GOOGLE_ERRORS):
+        return True, _google_retry_after(exc)
+    if isinstance(exc, _RETRYABLE_NETWORK_ERRORS):
+        return True, None
+    return False, None
+
+def is_rate_limit(exc: BaseException) -> bool:
+    """Rate limits are back-pressure from a healthy service, so they do not count towards opening its circuit."""
+    return isinstance(exc, (dropbox.exceptions.RateLimitError, google_exceptions.TooManyRequests, google_exceptions.ResourceExhausted))
+
+def _google_retry_after(exc: google_exceptions.GoogleAPICallError) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    header = getattr(response, "headers", {}).get("Retry-After") if response is not None else None
+    if header:
+        try:
+            return float(header)
+        except ValueError:
+            pass
+    # gRPC errors carry the hint as a google.rpc.RetryInfo detail.
+    for detail in getattr(exc, "details", None) or []:
+        retry_delay = getattr(detail, "retry_delay", None)
+        if retry_delay is not None:
+            return retry_delay.seconds + retry_delay.nanos / 1e9
+    return None
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive retryable failures, rejecting
+    calls for reset_seconds; then lets a single trial call through (half-open)
+    and closes again if it succeeds.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_seconds: float = CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_count = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self.reset_seconds:
+                    raise CircuitOpenError(f"{self.name} is unavailable (circuit open); failing fast.")
+                self.state = "half_open"
+            if self.state == "half_open":
+                if self._trial_in_flight:
+                    raise CircuitOpenError(f"{self.name} is recovering (circuit half-open); failing fast.")
+                self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._trial_in_flight = False
+            self.consecutive_failures += 1
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opened_count += 1
+                    logging.error(f"Circuit for {self.name} opened after {self.consecutive_failures} consecutive failures.")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+    def release(self):
+        """Ends a call that neither succeeded nor failed retryably (e.g. a terminal error)."""
+        with self._lock:
+            if self.state == "half_open":
+                # The service answered, so it is reachable again.
+                self.state = "closed"
+                self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self.consecutive_failures, "opened_count": self.opened_count}
+
+class _StageStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def add(self, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def record_latency(self, latency: float):
+        with self._lock:
+            self.calls += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "attempts": self.attempts,
+            "retries": self.retries,
+            "successes": self.successes,
+            "failures": self.failures,
+            "rejected_by_circuit": self.rejected,
+            "avg_latency_s": round(self.total_latency / self.calls, 3) if self.calls else None,
+            "max_latency_s": round(self.max_latency, 3),
+        }
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_stats: Dict[str, _StageStats] = {}
+_registry_lock = threading.Lock()
+
+def get_breaker(service: str) -> CircuitBreaker:
+    with _registry_lock:
+        if service not in _breakers:
+            _breakers[service] = CircuitBreaker(service)
+        return _breakers[service]
+
+def _stage_stats(stage: str) -> _StageStats:
+    with _registry_lock:
+        if stage not in _stats:
+            _stats[stage] = _StageStats()
+        return _stats[stage]
+
+def _backoff_delay(attempt: int, retry_after: Optional[float]) -> float:
+    # Full jitter keeps many workers retrying the same outage from moving in lockstep.
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** (attempt - 1))))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, RETRY_MAX_DELAY))
+    return delay
+
+def call_with_resilience(service: str, stage: str, fn: Callable, *args, max_attempts: int = RETRY_MAX_ATTEMPTS, **kwargs):
+    """
+    Calls fn(*args, **kwargs) through the service's circuit breaker, retrying
+    retryable errors (see classify_error) with jittered exponential backoff that
+    honours retry-after hints. Terminal errors and the last retryable error are
+    re-raised unchanged; CircuitOpenError is raised while the circuit is open.
+    Attempts, retries and latency are recorded under 'stage'.
+    """
+    breaker = get_breaker(service)
+    stats = _stage_stats(stage)
+    start_time = time.perf_counter()
+    attempt = 0
+    try:
+        while True:
+            attempt += 1
+            try:
+                breaker.before_call()
+            except CircuitOpenError:
+                stats.add(rejected=1, failures=1)
+                raise
+            stats.add(attempts=1)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                retryable, retry_after = classify_error(e)
+                if not retryable:
+                    breaker.release()
+                    stats.add(failures=1)
+                    raise
+                if is_rate_limit(e):
+                    breaker.release()
+                else:
+                    breaker.record_failure()
+                if attempt >= max_attempts:
+                    stats.add(failures=1)
+                    raise
+                delay = _backoff_delay(attempt, retry_after)
+                stats.add(retries=1)
+                logging.warning(f"{stage} attempt {attempt}/{max_attempts} failed ({type(e).__name__}: {e}); retrying in {delay:.1f}s.")
+                time.sleep(delay)
+                continue
+            breaker.record_success()
+            stats.add(successes=1)
+            return result
+    finally:
+        stats.record_latency(time.perf_counter() - start_time)
+
+def resilience_stats() -> Dict[str, Any]:
+    with _registry_lock:
+        return {
+            "stages": {stage: stats.snapshot() for stage, stats in _stats.items()},
+            "circuits": {service: breaker.snapshot() for service, breaker in _breakers.items()},
+        }
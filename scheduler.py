@@ -0,0 +1,324 @@
+import os
+import time
+import logging
+import threading
+import contextvars
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, Optional
+from resilience import classify_error, is_rate_limit
+from telemetry import span, SCHEDULER_QUEUE_DEPTH, SCHEDULER_WAIT_SECONDS
+
+# Request quotas per model: a token bucket refilled at *_RPM requests per
+# minute that holds at most *_BURST requests. An RPM of 0 disables the limit.
+GEMINI_IMAGE_RPM = float(os.getenv("GEMINI_IMAGE_RPM", "60"))
+GEMINI_IMAGE_BURST = int(os.getenv("GEMINI_IMAGE_BURST", "10"))
+GEMINI_TEXT_RPM = float(os.getenv("GEMINI_TEXT_RPM", "60"))
+GEMINI_TEXT_BURST = int(os.getenv("GEMINI_TEXT_BURST", "5"))
+# A call that has waited this long for quota fails instead of waiting further.
+SCHEDULER_MAX_WAIT = float(os.getenv("SCHEDULER_MAX_WAIT", "600"))
+# Pause after a rate-limit response that came without a retry-after hint.
+RATE_LIMIT_PAUSE = 5.0
+
+# Served in this order; within a class, campaigns take turns.
+PRIORITIES = ("interactive", "bulk")
+
+MODEL_LIMITS = {
+    "gemini_image": (GEMINI_IMAGE_RPM, GEMINI_IMAGE_BURST),
+    "gemini_text": (GEMINI_TEXT_RPM, GEMINI_TEXT_BURST),
+}
+
+class QuotaWaitTimeout(Exception):
+    """Raised when a model call waited longer than allowed for its quota."""
+    pass
+
+# Who is asking: set per brief (see scheduling) and inherited by the worker
+# threads that generate its variants.
+_campaign: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("scheduler_campaign", default=None)
+_priority: contextvars.ContextVar[str] = contextvars.ContextVar("scheduler_priority", default="interactive")
+
+@contextmanager
+def scheduling(campaign: Optional[str] = None, priority: Optional[str] = None) -> Iterator[None]:
+    """
+    Attributes model calls made in this context (and in contexts copied from
+    it) to a campaign and priority class ("interactive" or "bulk").
+    Arguments left as None keep the current value.
+    """
+    if priority is not None and priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority '{priority}'; expected one of {PRIORITIES}.")
+    campaign_token = _campaign.set(campaign) if campaign is not None else None
+    priority_token = _priority.set(priority) if priority is not None else None
+    try:
+        yield
+    finally:
+        if priority_token is not None:
+            _priority.reset(priority_token)
+        if campaign_token is not None:
+            _campaign.reset(campaign_token)
+
+def _current() -> tuple:
+    return _priority.get(), _campaign.get() or "default"
+
+class _FairQueue:
+    """
+    Waiting items by priority class, then round-robin across campaigns, then
+    first come first served within a campaign. Callers hold the lock.
+    """
+
+    def __init__(self):
+        self._classes: Dict[str, "OrderedDict[str, Deque[Any]]"] = {priority: OrderedDict() for priority in PRIORITIES}
+
+    def push(self, priority: str, campaign: str, item: Any):
+        self._classes[priority].setdefault(campaign, deque()).append(item)
+
+    def _head(self):
+        for priority in PRIORITIES:
+            campaigns = self._classes[priority]
+            if campaigns:
+                return priority, next(iter(campaigns))
+        return None, None
+
+    def peek(self) -> Optional[Any]:
+        priority, campaign = self._head()
+        return self._classes[priority][campaign][0] if priority else None
+
+    def pop(self) -> tuple:
+        """Removes the head item and returns (priority, item); its campaign moves to the back of its class."""
+        priority, campaign = self._head()
+        campaigns = self._classes[priority]
+        items = campaigns[campaign]
+        item = items.popleft()
+        if items:
+            campaigns.move_to_end(campaign)
+        else:
+            del campaigns[campaign]
+        return priority, item
+
+    def remove(self, priority: str, campaign: str, item: Any):
+        items = self._classes[priority].get(campaign)
+        if items and item in items:
+            items.remove(item)
+            if not items:
+                del self._classes[priority][campaign]
+
+    def depth(self) -> Dict[str, Dict[str, int]]:
+        """{priority: {"queued", "campaigns"}}."""
+        return {
+            priority: {"queued": sum(len(items) for items in campaigns.values()), "campaigns": len(campaigns)}
+            for priority, campaigns in self._classes.items()
+        }
+
+    def __len__(self) -> int:
+        return sum(len(items) for campaigns in self._classes.values() for items in campaigns.values())
+
+class _WaitStats:
+    def __init__(self):
+        self.granted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+
+    def record(self, wait: float):
+        self.granted += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "granted": self.granted,
+            "avg_wait_s": round(self.total_wait / self.granted, 3) if self.granted else None,
+            "max_wait_s": round(self.max_wait, 3),
+            "timeouts": self.timeouts,
+        }
+
+class ModelScheduler:
+    """
+    Process-wide admission control for one model: a token bucket of
+    requests_per_minute with room for 'burst', handed out to waiting calls by
+    priority class and then round-robin across campaigns, so one large brief
+    cannot starve the others. A rate-limit response empties the bucket and
+    pauses the model for the server's retry-after hint.
+    """
+
+    def __init__(self, name: str, requests_per_minute: float, burst: int):
+        self.name = name
+        self.rate = requests_per_minute / 60
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._queue = _FairQueue()
+        self._condition = threading.Condition()
+        self._stats = {priority: _WaitStats() for priority in PRIORITIES}
+        self._rate_limited = 0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _publish_depth(self):
+        for priority, depth in self._queue.depth().items():
+            SCHEDULER_QUEUE_DEPTH.labels(self.name, priority).set(depth["queued"])
+
+    def acquire(self, timeout: Optional[float] = SCHEDULER_MAX_WAIT) -> float:
+        """
+        Blocks until this call may go to the model. Returns the seconds waited;
+        raises QuotaWaitTimeout after 'timeout' seconds.
+        """
+        if self.rate <= 0:
+            return 0.0
+        priority, campaign = _current()
+        ticket = object()
+        start = time.monotonic()
+        deadline = start + timeout if timeout is not None else None
+        with span("quota_wait", model=self.name, priority=priority), self._condition:
+            self._queue.push(priority, campaign, ticket)
+            self._publish_depth()
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    at_head = self._queue.peek() is ticket
+                    if at_head and self._tokens >= 1 and now >= self._paused_until:
+                        self._queue.pop()
+                        self._tokens -= 1
+                        break
+                    if deadline is not None and now >= deadline:
+                        self._stats[priority].timeouts += 1
+                        raise QuotaWaitTimeout(f"Waited {now - start:.0f}s for {self.name} quota.")
+                    # Only the head waits for a token; the rest wait for their turn.
+                    delay = max(self._paused_until - now, (1 - self._tokens) / self.rate) if at_head else None
+                    if deadline is not None:
+                        delay = min(delay, deadline - now) if delay is not None else deadline - now
+                    self._condition.wait(delay)
+            except BaseException:
+                self._queue.remove(priority, campaign, ticket)
+                raise
+            finally:
+                self._publish_depth()
+                self._condition.notify_all()
+            waited = time.monotonic() - start
+            self._stats[priority].record(waited)
+        SCHEDULER_WAIT_SECONDS.labels(self.name, priority).observe(waited)
+        return waited
+
+    def penalize(self, retry_after: Optional[float]):
+        """Empties the bucket and holds every call back for retry_after seconds (RATE_LIMIT_PAUSE if unknown)."""
+        with self._condition:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens = 0.0
+            self._paused_until = max(self._paused_until, now + (retry_after or RATE_LIMIT_PAUSE))
+            self._rate_limited += 1
+            self._condition.notify_all()
+        logging.warning(f"{self.name} rate limited; pausing calls for {retry_after or RATE_LIMIT_PAUSE:.1f}s.")
+
+    def wrap(self, fn: Callable, timeout: Optional[float] = SCHEDULER_MAX_WAIT) -> Callable:
+        """fn, but each call (retries included) first waits for quota, and a rate-limit error pauses the model."""
+        def scheduled(*args, **kwargs):
+            self.acquire(timeout)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if is_rate_limit(e):
+                    self.penalize(classify_error(e)[1])
+                raise
+        return scheduled
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            self._refill(time.monotonic())
+            return {
+                "requests_per_minute": round(self.rate * 60, 3),
+                "burst": self.capacity,
+                "tokens": round(self._tokens, 2),
+                "paused_for_s": round(max(0.0, self._paused_until - time.monotonic()), 1),
+                "rate_limited": self._rate_limited,
+                "queue": self._queue.depth(),
+                "waits": {priority: stats.snapshot() for priority, stats in self._stats.items()},
+            }
+
+class FairExecutor:
+    """
+    A thread pool like ThreadPoolExecutor whose queued tasks are started by
+    priority class and then round-robin across campaigns (taken from the
+    submitter's context, see scheduling) instead of in submission order.
+    """
+
+    def __init__(self, max_workers: int, thread_name_prefix: str = "fair"):
+        self.name = thread_name_prefix
+        self._queue = _FairQueue()
+        self._condition = threading.Condition()
+        self._shutdown = False
+        self._running = 0
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"{thread_name_prefix}_{i}", daemon=True)
+            for i in range(max(1, max_workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        future: Future = Future()
+        priority, campaign = _current()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            self._queue.push(priority, campaign, (future, fn, args, kwargs))
+            SCHEDULER_QUEUE_DEPTH.labels(self.name, priority).inc()
+            self._condition.notify()
+        return future
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._shutdown:
+                    self._condition.wait()
+                if not self._queue:
+                    return
+                priority, (future, fn, args, kwargs) = self._queue.pop()
+                SCHEDULER_QUEUE_DEPTH.labels(self.name, priority).dec()
+                self._running += 1
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._condition:
+                    self._running -= 1
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False):
+        with self._condition:
+            self._shutdown = True
+            if cancel_futures:
+                while self._queue:
+                    priority, (future, *_) = self._queue.pop()
+                    SCHEDULER_QUEUE_DEPTH.labels(self.name, priority).dec()
+                    future.cancel()
+            self._condition.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            return {"workers": len(self._threads), "running": self._running, "queue": self._queue.depth()}
+
+_schedulers: Dict[str, ModelScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+def get_scheduler(model: str) -> ModelScheduler:
+    """The process-wide scheduler for a model in MODEL_LIMITS."""
+    with _schedulers_lock:
+        scheduler = _schedulers.get(model)
+        if scheduler is None:
+            requests_per_minute, burst = MODEL_LIMITS[model]
+            scheduler = _schedulers[model] = ModelScheduler(model, requests_per_minute, burst)
+        return scheduler
+
+def scheduler_stats() -> Dict[str, Any]:
+    with _schedulers_lock:
+        return {model: scheduler.stats() for model, scheduler in _schedulers.items()}
@@ -0,0 +1,259 @@
+import io
+import os
+import re
+import uuid
+import hashlib
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+from PIL import Image
+from campaign_catalog import CampaignCatalog
+from dropbox_helper import DropboxHelper, THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_BYTES, create_dropbox_helper
+from generation_cache import GenerationCache
+from telemetry import span, BYTES_TOTAL
+
+# "dropbox" (default) or "local".
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "dropbox").lower()
+# Local backend: where creatives are written, and the URL prefix they are
+# served under. The default is the app's own /assets endpoint; point it at a
+# CDN whose origin is that endpoint (or LOCAL_STORAGE_DIR) to offload serving.
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", "storage")
+LOCAL_STORAGE_BASE_URL = os.getenv("LOCAL_STORAGE_BASE_URL", "/assets").rstrip("/")
+LOCAL_CATALOG_DB_PATH = os.getenv("LOCAL_CATALOG_DB_PATH", os.path.join("cache", "local_catalog.sqlite3"))
+
+class StorageBackend(ABC):
+    """
+    Where campaign creatives are stored and served from. Paths are
+    '/<campaign folder>/<aspect ratio>/<file>', as built by the pipeline.
+    """
+    name = "storage"
+    # Whether commit_uploads costs much less per file for many files at once
+    # (one remote call per batch). If not, the pipeline commits each variant
+    # as soon as its files are uploaded.
+    batch_commits = False
+
+    @abstractmethod
+    def check_health(self) -> bool:
+        """Readiness probe: raises if the backend can't be used."""
+
+    @abstractmethod
+    def exists(self, campaign_folder: str) -> bool:
+        """Whether a campaign folder already exists."""
+
+    @abstractmethod
+    def put(self, data: bytes, path: str) -> Optional[str]:
+        """Stores one file and returns its link. Raises if it can't be stored."""
+
+    def start_upload(self, data: bytes, path: str) -> Any:
+        """
+        First half of a batched put: sends the bytes without publishing the
+        file and returns an entry for commit_uploads. Raises on failure.
+        """
+        return path, data
+
+    def commit_uploads(self, entries: List[Any]) -> Dict[str, Dict[str, Optional[str]]]:
+        """Publishes files sent with start_upload. Returns {path: {"url", "error"}} for every entry."""
+        outcomes = {}
+        for path, data in entries:
+            try:
+                outcomes[path] = {"url": self.put(data, path), "error": None}
+            except Exception as e:
+                logging.error(f"Storing {path} failed: {e}")
+                outcomes[path] = {"url": None, "error": f"Upload failed: {e}"}
+        return outcomes
+
+    @abstractmethod
+    def list(self, **filters) -> Tuple[List[Dict], Optional[str]]:
+        """Paginated, filtered campaign listing. See CampaignCatalog.query_campaigns."""
+
+    @abstractmethod
+    def link(self, path: str) -> Optional[str]:
+        """The URL a stored file is served from, or None if there is no such file."""
+
+    @abstractmethod
+    def get_thumbnail(self, path: str, size: str) -> Optional[bytes]:
+        """A JPEG thumbnail (size is one of dropbox_helper.THUMBNAIL_SIZES), or None if there is no such file."""
+
+    def local_path(self, path: str) -> Optional[str]:
+        """The file on this machine's disk holding 'path', for backends that have one."""
+        return None
+
+    def close(self):
+        pass
+
+class DropboxStorage(StorageBackend):
+    """Creatives in the Dropbox app folder, served through share links (see DropboxHelper)."""
+    name = "dropbox"
+    batch_commits = True
+
+    def __init__(self, helper: DropboxHelper):
+        self.helper = helper
+        self.catalog = helper.catalog
+
+    def check_health(self) -> bool:
+        return self.helper.check_health()
+
+    def exists(self, campaign_folder: str) -> bool:
+        return self.helper.folder_exists(campaign_folder)
+
+    def put(self, data: bytes, path: str) -> Optional[str]:
+        return self.helper.upload_bytes(data, path)
+
+    def start_upload(self, data: bytes, path: str) -> Any:
+        return self.helper.start_upload(data, path)
+
+    def commit_uploads(self, entries: List[Any]) -> Dict[str, Dict[str, Optional[str]]]:
+        return self.helper.commit_uploads(entries)
+
+    def list(self, **filters) -> Tuple[List[Dict], Optional[str]]:
+        return self.helper.query_campaigns(**filters)
+
+    def link(self, path: str) -> Optional[str]:
+        if self.catalog:
+            asset = self.catalog.get_asset(path)
+            return asset["url"] if asset else None
+        try:
+            return self.helper._get_shareable_link(path)
+        except Exception as e:
+            logging.error(f"Share link lookup for {path} failed: {e}")
+            return None
+
+    def get_thumbnail(self, path: str, size: str) -> Optional[bytes]:
+        return self.helper.get_thumbnail(path, size)
+
+    def close(self):
+        if self.catalog:
+            self.catalog.stop_longpoll()
+
+class LocalStorage(StorageBackend):
+    """
+    Creatives on the local filesystem (or a mounted volume) under root, served
+    by the app's /assets endpoint or a CDN in front of it. Listings come from
+    a CampaignCatalog rebuilt from the directory tree at startup, so the
+    gallery queries work exactly as they do for Dropbox.
+    """
+    name = "local"
+
+    def __init__(self, root: str = LOCAL_STORAGE_DIR, base_url: str = LOCAL_STORAGE_BASE_URL,
+                 catalog_db_path: str = LOCAL_CATALOG_DB_PATH):
+        self.root = os.path.realpath(root)
+        self.base_url = base_url
+        os.makedirs(self.root, exist_ok=True)
+        self.catalog = CampaignCatalog(None, catalog_db_path)
+        self.thumbnail_cache = GenerationCache(THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_BYTES)
+        self._reindex()
+
+    def _full_path(self, path: str) -> str:
+        full_path = os.path.realpath(os.path.join(self.root, path.lstrip("/")))
+        if os.path.commonpath([self.root, full_path]) != self.root:
+            raise ValueError(f"Path '{path}' is outside the storage directory.")
+        return full_path
+
+    @staticmethod
+    def _modified(full_path: str) -> str:
+        mtime = os.stat(full_path).st_mtime
+        return datetime.fromtimestamp(mtime, timezone.utc).replace(tzinfo=None).isoformat(timespec="seconds")
+
+    def _url(self, path: str) -> str:
+        return f"{self.base_url}{quote(path)}"
+
+    def _reindex(self):
+        # Files may have been added, removed or restored while the app was down.
+        self.catalog.clear()
+        count = 0
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if name.startswith("."):
+                    continue
+                full_path = os.path.join(directory, name)
+                path = "/" + os.path.relpath(full_path, self.root).replace(os.sep, "/")
+                self.catalog.record_asset(path, self._url(path), os.path.getsize(full_path), self._modified(full_path))
+                count += 1
+        logging.info(f"Local storage indexed {count} files under '{self.root}'.")
+
+    def check_health(self) -> bool:
+        if not os.access(self.root, os.W_OK):
+            raise PermissionError(f"Storage directory '{self.root}' is not writable.")
+        return True
+
+    def exists(self, campaign_folder: str) -> bool:
+        if self.catalog.campaign_exists(campaign_folder):
+            return True
+        # Matches Dropbox, where folder names are case-insensitive.
+        folder = campaign_folder.strip("/").lower()
+        return any(name.lower() == folder for name in os.listdir(self.root))
+
+    def start_upload(self, data: bytes, path: str) -> Any:
+        """Writes the bytes to a hidden temporary file next to the destination; commit_uploads renames it into place."""
+        full_path = self._full_path(path)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        temp_path = os.path.join(directory, f".{uuid.uuid4().hex}.tmp")
+        with span("local_write", bytes=len(data)):
+            with open(temp_path, "wb") as f:
+                f.write(data)
+        BYTES_TOTAL.labels("storage_out").inc(len(data))
+        return path, temp_path
+
+    def commit_uploads(self, entries: List[Any]) -> Dict[str, Dict[str, Optional[str]]]:
+        outcomes = {}
+        for path, temp_path in entries:
+            try:
+                full_path = self._full_path(path)
+                os.replace(temp_path, full_path)
+                self.catalog.record_asset(path, self._url(path), os.path.getsize(full_path), self._modified(full_path))
+                outcomes[path] = {"url": self._url(path), "error": None}
+            except Exception as e:
+                logging.error(f"Storing {path} failed: {e}")
+                outcomes[path] = {"url": None, "error": f"Upload failed: {e}"}
+        return outcomes
+
+    def put(self, data: bytes, path: str) -> Optional[str]:
+        outcome = self.commit_uploads([self.start_upload(data, path)])[path]
+        if outcome["error"]:
+            raise RuntimeError(outcome["error"])
+        return outcome["url"]
+
+    def list(self, **filters) -> Tuple[List[Dict], Optional[str]]:
+        return self.catalog.query_campaigns(**filters)
+
+    def local_path(self, path: str) -> Optional[str]:
+        try:
+            full_path = self._full_path(path)
+        except ValueError:
+            return None
+        return full_path if os.path.isfile(full_path) else None
+
+    def link(self, path: str) -> Optional[str]:
+        return self._url(path) if self.local_path(path) else None
+
+    def get_thumbnail(self, path: str, size: str) -> Optional[bytes]:
+        """Renders the thumbnail locally (fit within the size's box, like Dropbox) and caches it per path, modification time and size."""
+        full_path = self.local_path(path)
+        if not full_path:
+            return None
+        cache_key = hashlib.sha256(f"{path.lower()}|{self._modified(full_path)}|{size}".encode("utf-8")).hexdigest()
+        cached = self.thumbnail_cache.get(cache_key)
+        if cached:
+            data, _ = cached
+        else:
+            width, height = (int(value) for value in re.fullmatch(r"w(\d+)h(\d+)", size).groups())
+            with Image.open(full_path) as image:
+                image.thumbnail((width, height))
+                buffer = io.BytesIO()
+                image.convert("RGB").save(buffer, format="JPEG", quality=85)
+            data = buffer.getvalue()
+            self.thumbnail_cache.put(cache_key, data, "image/jpeg")
+        return data
+
+def create_storage() -> Optional[StorageBackend]:
+    """Builds the backend named by STORAGE_BACKEND, or None if it is not configured."""
+    if STORAGE_BACKEND == "local":
+        return LocalStorage()
+    if STORAGE_BACKEND == "dropbox":
+        helper = create_dropbox_helper()
+        return DropboxStorage(helper) if helper else None
+    logging.error(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}'; expected 'dropbox' or 'local'.")
+    return None
@@ -0,0 +1,169 @@
+import os
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Number of recent traces kept in memory for /traces/{id}.
+TRACE_HISTORY = int(os.getenv("TRACE_HISTORY", "200"))
+MAX_SPANS_PER_TRACE = 5000
+
+STAGE_SECONDS = Histogram(
+    "creative_pipeline_stage_seconds",
+    "Time spent in each pipeline stage.",
+    ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120, 300),
+)
+VARIANTS_TOTAL = Counter(
+    "creative_pipeline_variants_total",
+    "Finished creative variants by outcome (uploaded, blocked, failed).",
+    ["outcome"],
+)
+BYTES_TOTAL = Counter(
+    "creative_pipeline_bytes_total",
+    "Image bytes transferred: client_in (base images), model_in (generated images), dropbox_out and storage_out (Dropbox and local storage writes).",
+    ["direction"],
+)
+JOBS_IN_FLIGHT = Gauge(
+    "creative_pipeline_jobs_in_flight",
+    "Background jobs that are queued or running.",
+    ["state"],
+)
+SCHEDULER_QUEUE_DEPTH = Gauge(
+    "creative_pipeline_scheduler_queue_depth",
+    "Model calls waiting for quota, and generation tasks waiting for a worker, by queue and priority.",
+    ["queue", "priority"],
+)
+SCHEDULER_WAIT_SECONDS = Histogram(
+    "creative_pipeline_scheduler_wait_seconds",
+    "Time model calls waited for quota.",
+    ["model", "priority"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+
+class _Trace:
+    def __init__(self, trace_id: str, attributes: Dict[str, Any]):
+        self.trace_id = trace_id
+        self.attributes = attributes
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.duration_s: Optional[float] = None
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add_span(self, span: Dict[str, Any]):
+        with self._lock:
+            if len(self.spans) < MAX_SPANS_PER_TRACE:
+                self.spans.append(span)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start_s"])
+        return {
+            "trace_id": self.trace_id,
+            "attributes": self.attributes,
+            "started_at": self.started_at,
+            "duration_s": self.duration_s,
+            "spans": spans,
+        }
+
+# The active trace and the innermost open span, per task or thread. Worker
+# threads only see them if they run in a copied context (see submit_in_context).
+_current_trace: contextvars.ContextVar[Optional[_Trace]] = contextvars.ContextVar("current_trace", default=None)
+_current_span: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_span", default=None)
+_traces: "OrderedDict[str, _Trace]" = OrderedDict()
+_traces_lock = threading.Lock()
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.trace_id if trace else None
+
+@contextmanager
+def start_trace(trace_id: str, **attributes) -> Iterator[str]:
+    """
+    Makes trace_id (a job ID, or a fresh ID per request) the active trace, so
+    every span opened in this context, and in contexts copied from it, is
+    recorded under it. Starting a trace ID that is still in memory continues
+    it, e.g. a job picking up the trace of the request that queued it.
+    Logs the slowest stages when the trace ends.
+    """
+    with _traces_lock:
+        trace = _traces.get(trace_id)
+        if trace is None:
+            trace = _traces[trace_id] = _Trace(trace_id, attributes)
+        else:
+            trace.attributes.update(attributes)
+            _traces.move_to_end(trace_id)
+        while len(_traces) > TRACE_HISTORY:
+            _traces.popitem(last=False)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(None)
+    try:
+        yield trace_id
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        trace.duration_s = round(time.perf_counter() - trace._start, 3)
+        totals: Dict[str, float] = defaultdict(float)
+        for recorded in trace.snapshot()["spans"]:
+            totals[recorded["name"]] += recorded["duration_s"]
+        slowest = ", ".join(f"{name} {total:.2f}s" for name, total in sorted(totals.items(), key=lambda item: -item[1])[:4])
+        logging.info(f"Trace {trace_id} finished in {trace.duration_s}s ({slowest or 'no spans'}).")
+
+@contextmanager
+def span(stage: str, **attributes) -> Iterator[Dict[str, Any]]:
+    """
+    Times a pipeline stage: always observed in the stage latency histogram, and
+    recorded as a span (with its parent span) when a trace is active. The
+    yielded dict can be used to add attributes while the span is open.
+    """
+    trace = _current_trace.get()
+    span_id = uuid.uuid4().hex[:16]
+    parent_id = _current_span.get()
+    token = _current_span.set(span_id)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield attributes
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _current_span.reset(token)
+        STAGE_SECONDS.labels(stage).observe(duration)
+        if trace is not None:
+            trace.add_span({
+                "span_id": span_id,
+                "parent_id": parent_id,
+                "name": stage,
+                "start_s": round(start - trace._start, 4),
+                "duration_s": round(duration, 4),
+                "thread": threading.current_thread().name,
+                "attributes": attributes,
+                "error": error,
+            })
+
+def submit_in_context(executor, fn, *args, **kwargs):
+    """
+    executor.submit that runs fn in a copy of the caller's context, so the
+    active trace and parent span follow the work onto the worker thread.
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+def get_trace(trace_id: str) -> Optional[Dict[str, Any]]:
+    with _traces_lock:
+        trace = _traces.get(trace_id)
+    return trace.snapshot() if trace else None
+
+def metrics_payload() -> Tuple[bytes, str]:
+    """The Prometheus exposition of every metric, and its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,125 @@
+import io
+import os
+import logging
+from functools import lru_cache
+from PIL import Image, ImageColor, ImageDraw, ImageFont, ImageStat
+from typing import List, Optional, Tuple
+from export import encode_intermediate
+
+# TrueType/OpenType font used for composited messages. Without one, Pillow's
+# built-in font is used, which only covers Latin scripts.
+FONT_PATH = os.getenv("FONT_PATH")
+# Share of the width/height kept clear of text along every edge.
+TEXT_SAFE_MARGIN = float(os.getenv("TEXT_SAFE_MARGIN", "0.06"))
+# Text is laid out in the bottom part of the creative, starting at this share of its height.
+TEXT_AREA_TOP = float(os.getenv("TEXT_AREA_TOP", "0.62"))
+MAX_FONT_SHARE = 0.09
+MIN_FONT_SIZE = 14
+# Text with less contrast than this (WCAG ratio) gets a translucent band behind it.
+MIN_CONTRAST = 4.5
+SCRIM_OPACITY = 150
+
+@lru_cache(maxsize=64)
+def _font(size: int) -> ImageFont.FreeTypeFont:
+    if FONT_PATH:
+        try:
+            return ImageFont.truetype(FONT_PATH, size)
+        except OSError as e:
+            logging.error(f"Could not load FONT_PATH '{FONT_PATH}', using the default font: {e}")
+    return ImageFont.load_default(size=size)
+
+def _luminance(colour: Tuple[int, int, int]) -> float:
+    def channel(value: int) -> float:
+        value = value / 255
+        return value / 12.92 if value <= 0.03928 else ((value + 0.055) / 1.055) ** 2.4
+    r, g, b = colour
+    return 0.2126 * channel(r) + 0.7152 * channel(g) + 0.0722 * channel(b)
+
+def _contrast(a: Tuple[int, int, int], b: Tuple[int, int, int]) -> float:
+    lighter, darker = sorted((_luminance(a), _luminance(b)), reverse=True)
+    return (lighter + 0.05) / (darker + 0.05)
+
+def _brand_rgb(brand_colors: List[str]) -> List[Tuple[int, int, int]]:
+    colours = []
+    for name in brand_colors:
+        try:
+            colours.append(ImageColor.getrgb(name.strip())[:3])
+        except ValueError:
+            continue
+    return colours
+
+def _wrap(text: str, font: ImageFont.FreeTypeFont, max_width: int) -> List[str]:
+    """Greedy word wrap; words wider than a line (or scripts without spaces) are broken by character."""
+    lines: List[str] = []
+    for paragraph in text.splitlines() or [""]:
+        line = ""
+        for word in paragraph.split(" "):
+            candidate = f"{line} {word}" if line else word
+            if font.getlength(candidate) <= max_width:
+                line = candidate
+                continue
+            if line:
+                lines.append(line)
+            line = ""
+            for char in word:
+                if font.getlength(line + char) > max_width and line:
+                    lines.append(line)
+                    line = ""
+                line += char
+        lines.append(line)
+    return lines
+
+def _fit(text: str, box_width: int, box_height: int, max_size: int) -> Tuple[ImageFont.FreeTypeFont, List[str], int]:
+    """Largest font size whose wrapped text fits the box. Returns (font, lines, line height)."""
+    size = max_size
+    while True:
+        font = _font(size)
+        lines = _wrap(text, font, box_width)
+        line_height = round(size * 1.2)
+        if line_height * len(lines) <= box_height or size <= MIN_FONT_SIZE:
+            return font, lines, line_height
+        size = max(MIN_FONT_SIZE, int(size * 0.9))
+
+def composite_text(background_bytes: bytes, message: str, brand_colors: List[str]) -> bytes:
+    """
+    Renders 'message' onto a text-free background: centred in the lower part
+    of the safe area, as large as fits, in the brand colour (or black/white)
+    that contrasts best with what is behind it. Returns PNG bytes.
+    """
+    image = Image.open(io.BytesIO(background_bytes)).convert("RGBA")
+    width, height = image.size
+    margin_x, margin_y = round(width * TEXT_SAFE_MARGIN), round(height * TEXT_SAFE_MARGIN)
+    box = (margin_x, round(height * TEXT_AREA_TOP), width - margin_x, height - margin_y)
+    box_width, box_height = box[2] - box[0], box[3] - box[1]
+
+    overlay = Image.new("RGBA", image.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    font, lines, line_height = _fit(message, box_width, box_height, max(MIN_FONT_SIZE, round(min(width, height) * MAX_FONT_SHARE)))
+    text_height = line_height * len(lines)
+    top = box[3] - text_height
+
+    background = tuple(int(c) for c in ImageStat.Stat(image.convert("RGB").crop((box[0], top, box[2], box[3]))).mean)
+    candidates = _brand_rgb(brand_colors) + [(255, 255, 255), (0, 0, 0)]
+    text_colour = max(candidates, key=lambda colour: _contrast(colour, background))
+    outline = (0, 0, 0) if _luminance(text_colour) > 0.5 else (255, 255, 255)
+    if _contrast(text_colour, background) < MIN_CONTRAST:
+        padding = line_height // 3
+        draw.rectangle((0, top - padding, width, box[3] + padding), fill=(*outline, SCRIM_OPACITY))
+
+    for position, line in enumerate(lines):
+        line_width = font.getlength(line)
+        draw.text(
+            (box[0] + (box_width - line_width) / 2, top + position * line_height),
+            line, font=font, fill=(*text_colour, 255),
+            stroke_width=max(1, line_height // 30), stroke_fill=(*outline, 160),
+        )
+
+    return encode_intermediate(Image.alpha_composite(image, overlay))
+
+def message_variants(brief) -> List[Tuple[Optional[str], str]]:
+    """(locale, message) pairs to render: the brief's own message under its region first, then localized_messages."""
+    variants = [(brief.region, brief.message)]
+    for locale, message in (getattr(brief, "localized_messages", None) or {}).items():
+        if locale != brief.region:
+            variants.append((locale, message))
+    return variants